@@ -0,0 +1,137 @@
+"""
+Форматы ответа с сущностями и выбор формата по заголовку Accept
+
+- application/json - список сущностей-объектов на каждый текст (по умолчанию)
+- application/msgpack - та же структура в msgpack (нужен пакет msgpack)
+- application/vnd.ner.columnar+json, application/vnd.ner.columnar+msgpack - колоночный
+  формат: параллельные массивы start_index / end_index / entity (id тега), границы
+  текстов row_splits и словарь тегов tags. Сущности текста i - элементы
+  row_splits[i]:row_splits[i + 1] каждого массива
+"""
+from typing import List, Dict, Any, Optional, Tuple
+import orjson
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+COLUMNAR_JSON = "application/vnd.ner.columnar+json"
+COLUMNAR_MSGPACK = "application/vnd.ner.columnar+msgpack"
+NDJSON = "application/x-ndjson"
+
+# Синонимы msgpack, которые встречаются у клиентов
+_ALIASES = {"application/x-msgpack": MSGPACK}
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        return None
+    return msgpack
+
+
+def _parse_accept(accept: str) -> List[Tuple[str, float]]:
+    """Типы из Accept в порядке убывания q (при равных q - в порядке заголовка)"""
+    ranges = []
+    for position, part in enumerate(accept.split(",")):
+        media_type, *params = [item.strip() for item in part.split(";")]
+        if not media_type:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        ranges.append((position, _ALIASES.get(media_type.lower(), media_type.lower()), quality))
+    ranges.sort(key=lambda item: (-item[2], item[0]))
+    return [(media_type, quality) for _, media_type, quality in ranges]
+
+
+def negotiate(accept: Optional[str], default: str = JSON) -> Optional[str]:
+    """
+    Формат ответа по заголовку Accept: default для пустого заголовка и */*,
+    None - ни один из принимаемых клиентом форматов не поддерживается
+    """
+    if not accept:
+        return default
+
+    supported = {JSON, COLUMNAR_JSON, default}
+    if _msgpack() is not None:
+        supported |= {MSGPACK, COLUMNAR_MSGPACK}
+
+    for media_type, quality in _parse_accept(accept):
+        if quality <= 0:
+            continue
+        if media_type in supported:
+            return media_type
+        if media_type in ("*/*", "application/*"):
+            return default
+    return None
+
+
+def to_columnar(results: List[List[Dict[str, Any]]]) -> Dict[str, Any]:
+    """Колоночное представление результатов: параллельные массивы и словарь тегов"""
+    tag_ids: Dict[str, int] = {}
+    starts, ends, tags, row_splits = [], [], [], [0]
+    for entities in results:
+        for entity in entities:
+            starts.append(entity["start_index"])
+            ends.append(entity["end_index"])
+            tag = entity["entity"]
+            tag_id = tag_ids.get(tag)
+            if tag_id is None:
+                tag_id = tag_ids[tag] = len(tag_ids)
+            tags.append(tag_id)
+        row_splits.append(len(starts))
+    return {
+        "tags": list(tag_ids),
+        "row_splits": row_splits,
+        "start_index": starts,
+        "end_index": ends,
+        "entity": tags
+    }
+
+
+def dumps(content: Any, media_type: str) -> bytes:
+    """Кодирование готовой структуры в JSON или msgpack"""
+    if media_type in (MSGPACK, COLUMNAR_MSGPACK):
+        return _msgpack().packb(content)
+    return orjson.dumps(content)
+
+
+def encode_results(results: List[List[Dict[str, Any]]], media_type: str) -> bytes:
+    """Результаты батча в выбранном формате"""
+    if media_type in (COLUMNAR_JSON, COLUMNAR_MSGPACK):
+        return dumps(to_columnar(results), media_type)
+    return dumps(results, media_type)
+
+
+def encode_stream_record(record: Dict[str, Any], media_type: str) -> bytes:
+    """Одна запись потока: строка NDJSON или объект msgpack"""
+    data = dumps(record, media_type)
+    return data if media_type in (MSGPACK, COLUMNAR_MSGPACK) else data + b"\n"
+
+
+def encode_stream_chunk(chunk: List[Tuple[Dict[str, Any], Optional[List[Dict[str, Any]]]]],
+                        media_type: str) -> bytes:
+    """
+    Часть потока /api/predict/stream. NDJSON и msgpack - запись на строку входа
+    (метаданные и entities); колоночные форматы - одна запись на часть: метаданные
+    строк в lines и сущности всех строк массивами
+    """
+    if media_type in (COLUMNAR_JSON, COLUMNAR_MSGPACK):
+        record = to_columnar([entities or [] for _, entities in chunk])
+        record["lines"] = [meta for meta, _ in chunk]
+        return encode_stream_record(record, media_type)
+
+    records = []
+    for meta, entities in chunk:
+        if entities is not None:
+            meta["entities"] = entities
+        records.append(meta)
+    if media_type == MSGPACK:
+        packer = _msgpack().Packer()
+        return b"".join(packer.pack(record) for record in records)
+    return b"\n".join(orjson.dumps(record) for record in records) + b"\n"
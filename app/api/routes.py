@@ -3,25 +3,61 @@ API роуты
 """
 import time
 import asyncio
-from typing import List
-from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
-from ..models.schemas import PredictRequest, PredictResponse, Entity, HealthResponse, MetricsResponse
+import tempfile
+import orjson
+from typing import List, Any, Optional, Tuple, AsyncIterator
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, Request, Query, Header
+from fastapi.responses import Response, StreamingResponse
+from pydantic import ValidationError
+from ..core.config import settings
+from ..models.schemas import (
+    PredictRequest, PredictResponse, Entity, HealthResponse, MetricsResponse, MetricsHistoryResponse, JobStatusResponse,
+    JobResultsResponse, ColumnarResponse
+)
+from . import encoding
 from ..services.prediction import prediction_service
+from ..services.jobs import job_manager
+from ..services.scheduler import OverloadedError
 from ..services.metrics import metrics_collector
+from ..monitoring.prometheus import prometheus_exporter
+from ..monitoring.stages import stage
+from ..monitoring.profiler import profiler, ProfilerBusy
 from ..models.ner_model import ner_model
 from ..core.logging import app_logger
 
 router = APIRouter()
 
+class _JSONBytesResponse(Response):
+    """
+    JSON ответ из готовых dict/list, закодированный orjson. Возвращается вместо
+    pydantic модели: сущности не проверяются повторно, а response_model роута
+    по-прежнему описывает ответ в OpenAPI
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
+
+def request_deadline(request: Request) -> Optional[float]:
+    """Дедлайн запроса по time.monotonic() из заголовка settings.deadline_header (мс)"""
+    value = request.headers.get(settings.deadline_header)
+    if value is None:
+        return None
+    try:
+        budget_ms = float(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Некорректный заголовок {settings.deadline_header}: {value}")
+    return time.monotonic() + budget_ms / 1000
+
+def _overloaded(e: OverloadedError) -> HTTPException:
+    """503 с Retry-After для запроса, отклонённого контролем допуска"""
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
 @router.post("/api/predict", response_model=PredictResponse, tags=["prediction"])
-async def predict(request: PredictRequest) -> PredictResponse:
+async def predict(request: PredictRequest, deadline: Optional[float] = Depends(request_deadline)) -> _JSONBytesResponse:
     """
     Извлечение именованных сущностей из текста
     """
-    start_time = time.time()
-    success = False
-    error_type = None
-    
     try:
         # Проверка пустого ввода
         if not request.input.strip():
@@ -29,119 +65,337 @@ async def predict(request: PredictRequest) -> PredictResponse:
             entities = []
         else:
             # Предсказание сущностей
-            entities = await prediction_service.predict(request.input)
+            entities = await prediction_service.predict(request.input, deadline)
             # entities = [Entity(**entity) for entity in entities_data]
         
-        response = PredictResponse(root=entities)
-        success = True
-        return response
+        with stage("serialize"):
+            return _JSONBytesResponse(entities)
         
+    except OverloadedError as e:
+        raise _overloaded(e)
     except Exception as e:
-        error_type = type(e).__name__
         app_logger.error(f"Ошибка в /api/predict: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Ошибка при обработке запроса: {str(e)}")
-    
-    finally:
-        # Записываем метрики асинхронно
-        response_time = time.time() - start_time
-        asyncio.create_task(
-            metrics_collector.record_request("/api/predict", response_time, success, error_type)
-        )
 
 @router.get("/health", response_model=HealthResponse, tags=["health"])
 async def health_check() -> HealthResponse:
     """
     Проверка состояния сервиса
     """
-    start_time = time.time()
-    success = False
-    
     try:
         model_loaded = ner_model.is_loaded()
         device = str(ner_model.device) if ner_model.device else "unknown"
         
         status = "healthy" if model_loaded else "unhealthy"
         
-        response = HealthResponse(
+        return HealthResponse(
             status=status,
             model_loaded=model_loaded,
             device=device
         )
-        success = True
-        return response
         
     except Exception as e:
         app_logger.error(f"Ошибка в /health: {str(e)}")
         raise HTTPException(status_code=500, detail="Ошибка при проверке состояния")
-    
-    finally:
-        response_time = time.time() - start_time
-        asyncio.create_task(
-            metrics_collector.record_request("/health", response_time, success)
-        )
 
 @router.get("/metrics", response_model=MetricsResponse, tags=["monitoring"])
 async def get_metrics() -> MetricsResponse:
     """
     Получение метрик производительности
     """
-    start_time = time.time()
-    success = False
-    
     try:
         metrics_data = metrics_collector.get_metrics()
         
-        response = MetricsResponse(
+        return MetricsResponse(
             total_requests=metrics_data["total_requests"],
             successful_requests=metrics_data["successful_requests"],
             failed_requests=metrics_data["failed_requests"],
             average_response_time=metrics_data["average_response_time"],
-            requests_per_second=metrics_data["requests_per_second"]
+            p50_response_time=metrics_data["p50_response_time"],
+            p90_response_time=metrics_data["p90_response_time"],
+            p95_response_time=metrics_data["p95_response_time"],
+            p99_response_time=metrics_data["p99_response_time"],
+            response_time_by_endpoint=metrics_data["response_time_by_endpoint"],
+            requests_per_second=metrics_data["requests_per_second"],
+            queue_depth=prediction_service.queue_depth,
+            batches_total=metrics_data["batches_total"],
+            average_batch_size=metrics_data["average_batch_size"],
+            batch_size_distribution=metrics_data["batch_size_distribution"],
+            queue_depth_by_priority=prediction_service.scheduler.queue_depths(),
+            queue_time_by_priority=metrics_data["queue_time_by_priority"],
+            stage_time=metrics_data["stage_time"],
+            estimated_throughput=prediction_service.scheduler.throughput or 0.0,
+            shed_requests=metrics_data["shed_requests"]
         )
-        success = True
-        return response
         
     except Exception as e:
         app_logger.error(f"Ошибка в /metrics: {str(e)}")
         raise HTTPException(status_code=500, detail="Ошибка при получении метрик")
-    
-    finally:
-        response_time = time.time() - start_time
-        asyncio.create_task(
-            metrics_collector.record_request("/metrics", response_time, success)
+
+@router.get("/metrics/history", response_model=MetricsHistoryResponse, tags=["monitoring"])
+async def get_metrics_history(
+    seconds: int = Query(300, ge=1, le=settings.metrics_history_seconds, description="Длина истории (секунды)")
+) -> _JSONBytesResponse:
+    """
+    Посекундная история запросов, ошибок и времени ответа за последние seconds секунд
+    """
+    return _JSONBytesResponse(metrics_collector.get_history(seconds))
+
+@router.get("/metrics/prometheus", tags=["monitoring"],
+            responses={200: {"content": {"text/plain": {}}}, 501: {"description": "Не установлен prometheus-client"}})
+async def get_prometheus_metrics() -> Response:
+    """
+    Метрики в формате экспозиции Prometheus: запросы и время ответа по endpoint, этапы
+    инференса, размеры батчей, очередь планировщика, отклонённые запросы и кеш.
+    При PROMETHEUS_MULTIPROC_DIR - сумма по всем процессам сервиса
+    """
+    try:
+        content, media_type = prometheus_exporter.render()
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    return Response(content, media_type=media_type)
+
+def _response_format(accept: Optional[str], default: str = encoding.JSON) -> str:
+    """Формат ответа по Accept или 406"""
+    media_type = encoding.negotiate(accept, default)
+    if media_type is None:
+        raise HTTPException(
+            status_code=406,
+            detail=f"Поддерживаемые форматы: {encoding.JSON}, {encoding.MSGPACK}, "
+                   f"{encoding.COLUMNAR_JSON}, {encoding.COLUMNAR_MSGPACK}"
         )
+    return media_type
 
-@router.post("/api/predict/batch", tags=["prediction"])
-async def predict_batch(requests: List[PredictRequest]) -> List[PredictResponse]:
+# Альтернативные форматы ответа в OpenAPI (выбираются заголовком Accept)
+_COMPACT_RESPONSES = {
+    200: {"content": {
+        encoding.MSGPACK: {},
+        encoding.COLUMNAR_JSON: {"schema": ColumnarResponse.model_json_schema()},
+        encoding.COLUMNAR_MSGPACK: {}
+    }},
+    406: {"description": "Ни один формат из Accept не поддерживается"}
+}
+
+@router.post("/api/predict/batch", response_model=List[PredictResponse], responses=_COMPACT_RESPONSES,
+             tags=["prediction"])
+async def predict_batch(requests: List[PredictRequest],
+                        deadline: Optional[float] = Depends(request_deadline),
+                        accept: Optional[str] = Header(None)) -> Response:
     """
-    Батчевое извлечение сущностей
+    Батчевое извлечение сущностей. Формат ответа выбирается заголовком Accept:
+    JSON (по умолчанию), msgpack или колоночный (JSON / msgpack)
     """
-    start_time = time.time()
-    success = False
+    media_type = _response_format(accept)
     
     try:
-        if not requests:
-            return []
-        
         texts = [req.input for req in requests]
-        batch_results = await prediction_service.batch_predict(texts)
+        batch_results = await prediction_service.batch_predict(texts, deadline=deadline) if texts else []
         
-        responses = []
-        for entities_data in batch_results:            
-            responses.append(PredictResponse(entities_data))
-        
-        success = True
-        return responses
+        with stage("serialize"):
+            content = encoding.encode_results(batch_results, media_type)
+        return Response(content, media_type=media_type, headers={"Vary": "Accept"})
         
+    except OverloadedError as e:
+        raise _overloaded(e)
     except Exception as e:
         app_logger.error(f"Ошибка в /api/predict/batch: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Ошибка при батчевой обработке: {str(e)}")
-    
-    finally:
-        response_time = time.time() - start_time
-        asyncio.create_task(
-            metrics_collector.record_request("/api/predict/batch", response_time, success)
-        )
+
+class _DuplexStreamingResponse(StreamingResponse):
+    """
+    Потоковый ответ, который отправляется одновременно с чтением тела запроса.
+    Стандартный StreamingResponse (ASGI < 2.4) слушает отключение клиента через receive
+    и забирает себе части тела; здесь receive читает только обработчик, а отключение
+    клиента приходит ему как ClientDisconnect.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+async def _read_ndjson(request: Request) -> AsyncIterator[Tuple[Any, Optional[str]]]:
+    """
+    Строки NDJSON из тела запроса по мере поступления: (метаданные, текст).
+    Метаданные - номер строки, поля строки кроме input или ошибка разбора (текст None).
+    """
+    buffer = b""
+    line_number = 0
+    async for data in request.stream():
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        if len(buffer) > settings.stream_max_line_bytes:
+            raise ValueError(f"Строка {line_number + len(lines)} длиннее {settings.stream_max_line_bytes} байт")
+        for line in lines:
+            if line.strip():
+                yield _parse_ndjson_line(line_number, line)
+            line_number += 1
+    if buffer.strip():
+        yield _parse_ndjson_line(line_number, buffer)
+
+def _parse_ndjson_line(line_number: int, line: bytes) -> Tuple[Any, Optional[str]]:
+    """Разбор одной строки потока в формате PredictRequest"""
+    try:
+        fields = orjson.loads(line)
+        text = PredictRequest(**fields).input
+    except (ValueError, TypeError, ValidationError) as e:
+        return {"line": line_number, "error": f"Некорректная строка: {str(e)}"}, None
+    fields.pop("input")
+    return {"line": line_number, **fields}, text
+
+class _ResultSpool:
+    """
+    Очередь байтов ответа между обработкой и отправкой клиенту: в памяти до
+    max_memory_bytes, дальше во временном файле. Обработка не ждёт клиента, который
+    читает ответ только после отправки всего тела запроса (обычные HTTP клиенты),
+    пока в очереди не больше max_bytes; дальше write ждёт, пока клиент не дочитает
+    очередь, и чтение тела запроса останавливается.
+    """
+
+    def __init__(self, max_memory_bytes: int, max_bytes: int, read_size: int = 256 * 1024):
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_memory_bytes)
+        self._max_bytes = max_bytes
+        self._read_size = read_size
+        self._read_pos = 0
+        self._write_pos = 0
+        self._closed = False
+        self._ready = asyncio.Event()
+        self._drained = asyncio.Event()
+
+    @property
+    def size(self) -> int:
+        """Размер буфера (байты), не больше max_bytes"""
+        return self._write_pos
+
+    async def write(self, data: bytes):
+        # Буфер сбрасывается, только когда клиент догнал обработку: ждём сброса,
+        # иначе размер буфера не ограничен. Часть больше max_bytes пишется в пустой буфер
+        while self._write_pos and self._write_pos + len(data) > self._max_bytes:
+            self._drained.clear()
+            await self._drained.wait()
+        self._file.seek(self._write_pos)
+        self._file.write(data)
+        self._write_pos += len(data)
+        self._ready.set()
+
+    def close(self):
+        self._closed = True
+        self._ready.set()
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        try:
+            while True:
+                if self._read_pos < self._write_pos:
+                    self._file.seek(self._read_pos)
+                    data = self._file.read(min(self._write_pos - self._read_pos, self._read_size))
+                    self._read_pos += len(data)
+                    if self._read_pos == self._write_pos:
+                        # Клиент догнал обработку - буфер начинается заново
+                        self._file.seek(0)
+                        self._file.truncate()
+                        self._read_pos = self._write_pos = 0
+                        self._drained.set()
+                    yield data
+                elif self._closed:
+                    return
+                else:
+                    self._ready.clear()
+                    await self._ready.wait()
+        finally:
+            self._file.close()
+
+@router.post("/api/predict/stream", tags=["prediction"])
+async def predict_stream(request: Request, accept: Optional[str] = Header(None)) -> StreamingResponse:
+    """
+    Потоковое батчевое извлечение сущностей: NDJSON строки {"input": ...} на входе,
+    NDJSON строки {"line": ..., "entities": [...]} на выходе в том же порядке.
+    По Accept вместо NDJSON - поток объектов msgpack или колоночные записи по частям
+    """
+    media_type = _response_format(accept, default=encoding.NDJSON)
+    if media_type == encoding.JSON:
+        media_type = encoding.NDJSON
+    spool = _ResultSpool(settings.stream_spool_memory_bytes, settings.stream_spool_max_bytes)
+
+    async def process():
+        try:
+            async for chunk in prediction_service.stream_predict(
+                _read_ndjson(request), max_pending_chunks=settings.stream_max_pending_chunks
+            ):
+                with stage("serialize"):
+                    data = encoding.encode_stream_chunk(chunk, media_type)
+                await spool.write(data)
+        except Exception as e:
+            # Статус ответа уже отправлен - ошибка передаётся последней строкой потока
+            app_logger.error(f"Ошибка в /api/predict/stream: {str(e)}")
+            await spool.write(encoding.encode_stream_record({"error": f"Ошибка при потоковой обработке: {str(e)}"}, media_type))
+        finally:
+            spool.close()
+
+    async def results():
+        processing = asyncio.create_task(process())
+        try:
+            async for data in spool.chunks():
+                yield data
+        finally:
+            # Клиент отключился - обработка останавливается
+            processing.cancel()
+
+    return _DuplexStreamingResponse(results(), media_type=media_type, headers={"Vary": "Accept"})
+
+@router.post("/api/jobs", response_model=JobStatusResponse, status_code=202, tags=["jobs"])
+async def create_job(requests: List[PredictRequest]) -> JobStatusResponse:
+    """
+    Асинхронное задание на разметку большого батча: ответ сразу, обработка в фоне
+    """
+    try:
+        job = job_manager.submit([req.input for req in requests])
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except OverflowError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return JobStatusResponse(**job.info())
+
+@router.get("/api/jobs/{job_id}", response_model=JobStatusResponse, tags=["jobs"])
+async def get_job(job_id: str) -> JobStatusResponse:
+    """
+    Статус и прогресс задания
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return JobStatusResponse(**job.info())
+
+@router.get("/api/jobs/{job_id}/results", response_model=JobResultsResponse, tags=["jobs"])
+async def get_job_results(
+    job_id: str,
+    offset: int = Query(0, ge=0, description="Индекс первого результата"),
+    limit: int = Query(1000, ge=1, le=100000, description="Максимум результатов в ответе")
+) -> _JSONBytesResponse:
+    """
+    Готовые результаты задания (в том числе частичные, пока задание выполняется)
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    # До 100000 результатов за ответ: кодируются orjson без проверки каждой сущности
+    with stage("serialize"):
+        return _JSONBytesResponse({
+            "job_id": job.id,
+            "status": job.status,
+            "offset": offset,
+            "processed": job.processed,
+            "total": job.total,
+            "results": job.results[offset:offset + limit]
+        })
+
+@router.delete("/api/jobs/{job_id}", tags=["jobs"])
+async def delete_job(job_id: str):
+    """
+    Отмена задания и удаление результатов
+    """
+    if not job_manager.delete(job_id):
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return {"message": "Задание удалено"}
 
 @router.delete("/cache", tags=["admin"])
 async def clear_cache():
@@ -165,4 +419,29 @@ async def get_cache_stats():
         return stats
     except Exception as e:
         app_logger.error(f"Ошибка при получении статистики кеша: {str(e)}")
-        raise HTTPException(status_code=500, detail="Ошибка при получении статистики")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Ошибка при получении статистики")
+
+@router.post("/profile", tags=["admin"],
+             responses={200: {"content": {"application/zip": {}}, "description": "Архив профиля"},
+                        403: {"description": "Профилирование выключено"},
+                        409: {"description": "Захват профиля уже идёт"}})
+async def capture_profile(
+    seconds: float = Query(10.0, gt=0, le=settings.profiler_max_seconds, description="Длительность захвата (секунды)")
+) -> Response:
+    """
+    Профиль процесса, принявшего запрос, за seconds секунд в zip архиве: cProfile
+    event loop и батчей модели (python.prof, python.txt) и trace torch.profiler
+    первых батчей (torch/*.json, torch_ops.txt). Включается PROFILER_ENABLED
+    """
+    if not settings.profiler_enabled:
+        raise HTTPException(status_code=403, detail="Профилирование выключено (PROFILER_ENABLED)")
+
+    app_logger.info(f"Захват профиля на {seconds} с")
+    try:
+        content = await profiler.capture(seconds)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    filename = time.strftime("profile-%Y%m%d-%H%M%S.zip")
+    return Response(content, media_type="application/zip",
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
@@ -0,0 +1,253 @@
+"""
+Офлайн разметка файлов без HTTP: JSONL или Parquet на входе, пул процессов с моделью
+
+python -m app.cli catalog.jsonl -o catalog.tagged.jsonl
+python -m app.cli catalog.parquet -o catalog.tagged.parquet --processes 8 --text-field name
+
+Каждая строка результата - исходная запись с полем entities (для Parquet - JSON строка).
+Порядок строк совпадает с входом.
+
+Схема Parquet результата фиксирована заранее: колонки входного Parquet (для JSONL на
+входе - колонка record с исходной записью в JSON), entities и error (null, если строка
+размечена).
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import queue
+import argparse
+import multiprocessing
+from collections import deque
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+
+from .core.config import settings
+
+# Модель процесса пула (загружается один раз в initializer)
+_worker_model = None
+
+
+def _init_worker(num_threads: int, ready):
+    """
+    Загрузка модели в процессе пула; в ready - None или текст ошибки загрузки.
+    Исключение из initializer заставило бы пул бесконечно перезапускать процессы,
+    поэтому об ошибке сообщается, а разметку прерывает основной процесс
+    """
+    global _worker_model
+    from .models.ner_model import NERModelWrapper
+
+    settings.torch_num_threads = num_threads
+    settings.torch_interop_threads = 1
+    settings.inference_threads = 1
+    model = NERModelWrapper()
+    try:
+        loaded = asyncio.run(model.load_model())
+        error = None if loaded else "Не удалось загрузить модель"
+    except Exception as e:
+        error = f"{type(e).__name__}: {str(e)}"
+    _worker_model = model if error is None else None
+    ready.put(error)
+
+
+def _tag_chunk(texts: List[str]):
+    """Разметка части файла; результат в компактном виде (EntityBatch)"""
+    return _worker_model.predict_batch_arrays(texts)
+
+
+def _parse_record(line: bytes, text_field: str) -> Tuple[Dict[str, Any], Optional[str]]:
+    """Разбор строки JSONL: запись и текст (None - некорректная строка)"""
+    try:
+        record = json.loads(line)
+        text = record[text_field]
+    except (ValueError, TypeError, KeyError) as e:
+        return {"error": f"Некорректная строка: {str(e)}"}, None
+    if not isinstance(text, str):
+        return {**record, "error": f"Поле {text_field} должно быть строкой"}, None
+    return record, text
+
+
+def read_jsonl(path: str, chunk_size: int, text_field: str) -> Iterator[Tuple[List[Dict[str, Any]], List[Optional[str]]]]:
+    """Чтение JSONL частями по chunk_size строк"""
+    records, texts = [], []
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record, text = _parse_record(line, text_field)
+            records.append(record)
+            texts.append(text)
+            if len(records) >= chunk_size:
+                yield records, texts
+                records, texts = [], []
+    if records:
+        yield records, texts
+
+
+def read_parquet(path: str, chunk_size: int, text_field: str) -> Iterator[Tuple[List[Dict[str, Any]], List[Optional[str]]]]:
+    """Чтение Parquet по row group'ам через memory map (нужен pyarrow)"""
+    pq = _import_parquet()
+    parquet_file = pq.ParquetFile(path, memory_map=True)
+    for batch in parquet_file.iter_batches(batch_size=chunk_size):
+        records = batch.to_pylist()
+        texts = [record.get(text_field) if isinstance(record.get(text_field), str) else None for record in records]
+        yield records, texts
+
+
+class JsonlWriter:
+    """Запись результатов в JSONL"""
+
+    def __init__(self, path: str):
+        self._file = open(path, "w", encoding="utf-8")
+
+    def write(self, records: List[Dict[str, Any]]):
+        self._file.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+
+    def close(self):
+        self._file.close()
+
+
+# Колонки результата, которые добавляет разметка
+RESULT_COLUMNS = ("entities", "error")
+# Колонка исходной записи JSONL в Parquet результате
+RECORD_COLUMN = "record"
+
+
+def parquet_schema(input_path: str):
+    """
+    Схема Parquet результата: колонки входного Parquet или record (JSON исходной
+    записи JSONL), затем entities (JSON строка) и error
+    """
+    pa, pq = _import_parquet(with_arrow=True)
+    if input_path.endswith(".parquet"):
+        fields = [field for field in pq.read_schema(input_path) if field.name not in RESULT_COLUMNS]
+    else:
+        fields = [pa.field(RECORD_COLUMN, pa.string())]
+    return pa.schema(fields + [pa.field("entities", pa.string()), pa.field("error", pa.string(), nullable=True)])
+
+
+class ParquetWriter:
+    """Запись результатов в Parquet со схемой, заданной до первой записи (parquet_schema)"""
+
+    def __init__(self, path: str, input_path: str):
+        self._pa = _import_parquet(with_arrow=True)[0]
+        self._schema = parquet_schema(input_path)
+        self._record_column = not input_path.endswith(".parquet")
+        self._writer = _import_parquet().ParquetWriter(path, self._schema)
+
+    def _row(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        entities = record.get("entities")
+        row = {
+            "entities": None if entities is None else json.dumps(entities, ensure_ascii=False),
+            "error": record.get("error")
+        }
+        source = {key: value for key, value in record.items() if key not in RESULT_COLUMNS}
+        if self._record_column:
+            row[RECORD_COLUMN] = json.dumps(source, ensure_ascii=False) if source else None
+        else:
+            # Колонок, которых нет в схеме, from_pylist не пишет; недостающие - null
+            row.update(source)
+        return row
+
+    def write(self, records: List[Dict[str, Any]]):
+        table = self._pa.Table.from_pylist([self._row(record) for record in records], schema=self._schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        self._writer.close()
+
+
+def _import_parquet(with_arrow: bool = False):
+    try:
+        import pyarrow
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Для Parquet установите pyarrow")
+    return (pyarrow, pq) if with_arrow else pq
+
+
+def _merge(records: List[Dict[str, Any]], texts: List[Optional[str]], entities: List[List[Dict[str, Any]]]):
+    """Добавление сущностей к записям части (некорректные строки остаются с полем error)"""
+    predictions = iter(entities)
+    for record, text in zip(records, texts):
+        if text is not None:
+            record["entities"] = next(predictions)
+    return records
+
+
+def run(args) -> Dict[str, float]:
+    """Разметка файла пулом процессов с записью результатов в порядке входа"""
+    is_parquet = args.input.endswith(".parquet")
+    reader = read_parquet if is_parquet else read_jsonl
+    output = args.output or os.path.splitext(args.input)[0] + (".tagged.parquet" if is_parquet else ".tagged.jsonl")
+    writer = ParquetWriter(output, args.input) if output.endswith(".parquet") else JsonlWriter(output)
+
+    processes = args.processes or os.cpu_count() or 1
+    num_threads = args.threads or max(1, (os.cpu_count() or 1) // processes)
+    ctx = multiprocessing.get_context("spawn")
+
+    ready = ctx.Queue()
+    total = 0
+    # Окно частей в работе: вход читается не дальше, чем успевает пул
+    window = deque()
+    with ctx.Pool(processes, initializer=_init_worker, initargs=(num_threads, ready)) as pool:
+        # Пропускная способность считается после загрузки моделей во всех процессах
+        load_start = time.perf_counter()
+        for _ in range(processes):
+            try:
+                error = ready.get(timeout=args.load_timeout)
+            except queue.Empty:
+                writer.close()
+                raise SystemExit(f"Процессы не загрузили модель за {args.load_timeout} с")
+            if error is not None:
+                writer.close()
+                raise SystemExit(f"Процесс пула не загрузил модель: {error}")
+        start = last_report = time.perf_counter()
+        print(f"Процессов: {processes} по {num_threads} потоков, загрузка моделей {start - load_start:.1f} с",
+              file=sys.stderr)
+        try:
+            chunks = reader(args.input, args.chunk_size, args.text_field)
+            while True:
+                while len(window) < processes * 2:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    records, texts = chunk
+                    window.append((records, texts, pool.apply_async(_tag_chunk, ([t for t in texts if t is not None],))))
+                if not window:
+                    break
+
+                records, texts, result = window.popleft()
+                writer.write(_merge(records, texts, result.get().to_lists()))
+                total += len(records)
+
+                now = time.perf_counter()
+                if now - last_report >= args.report_interval:
+                    last_report = now
+                    print(f"Размечено {total} строк, {total / (now - start):.1f} строк/с", file=sys.stderr)
+        finally:
+            writer.close()
+
+    elapsed = time.perf_counter() - start
+    return {"rows": total, "seconds": elapsed, "rows_per_second": total / elapsed if elapsed else 0.0, "output": output}
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Офлайн разметка JSONL/Parquet файла NER моделью")
+    parser.add_argument("input", help="Входной файл .jsonl или .parquet")
+    parser.add_argument("-o", "--output", help="Файл результата .jsonl или .parquet (по умолчанию <input>.tagged.*)")
+    parser.add_argument("--text-field", default="input", help="Поле с текстом")
+    parser.add_argument("--processes", type=int, default=0, help="Процессов с моделью (0 - по числу ядер)")
+    parser.add_argument("--threads", type=int, default=0, help="Потоков PyTorch на процесс (0 - ядра / процессы)")
+    parser.add_argument("--chunk-size", type=int, default=1024, help="Строк в одной задаче процесса")
+    parser.add_argument("--load-timeout", type=float, default=600.0, help="Ожидание загрузки моделей (сек)")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="Период вывода прогресса (сек)")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    print(f"Готово: {report['rows']} строк за {report['seconds']:.1f} с, "
+          f"{report['rows_per_second']:.1f} строк/с -> {report['output']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,8 @@
 Конфигурация приложения
 """
 import os
-from typing import Dict, Any
+import tempfile
+from typing import Dict, Any, List
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -16,8 +17,101 @@ class Settings(BaseSettings):
 
     max_workers: int = 4
     batch_size: int = 32
+    # Максимальное ожидание набора батча, пока модель занята другими батчами (секунды)
+    max_wait_time: float = 0.01
+    # Размер батча для /api/predict/batch - тексты уже собраны, ждать не нужно
+    bulk_batch_size: int = 128
     max_sequence_length: int = 128
+    # Потоковый /api/predict/stream: частей по bulk_batch_size строк одновременно в работе
+    # и максимальная длина строки NDJSON (байты)
+    stream_max_pending_chunks: int = 4
+    stream_max_line_bytes: int = 1024 * 1024
+    # Готовые строки ответа, которые клиент ещё не прочитал, держатся в памяти до этого
+    # объёма, дальше - во временном файле. Больше stream_spool_max_bytes обработка
+    # не уходит вперёд клиента
+    stream_spool_memory_bytes: int = 8 * 1024 * 1024
+    stream_spool_max_bytes: int = 256 * 1024 * 1024
+    # Асинхронные задания /api/jobs: размер части, лимиты и время хранения результатов (сек)
+    job_chunk_size: int = 64
+    job_max_jobs: int = 100
+    job_max_items: int = 1000000
+    job_result_ttl: float = 3600.0
+    # Планировщик инференса: веса классов приоритета (доля слотов модели при конкуренции),
+    # часть батча в очереди (между частями проходят интерактивные запросы) и слоты
+    # инференса, которые батчи и задания оставляют интерактивным запросам
+    scheduler_weights: Dict[str, float] = {"interactive": 8.0, "bulk": 2.0, "background": 1.0}
+    scheduler_chunk_size: int = 32
+    scheduler_reserved_slots: int = 1
+    # Контроль допуска: запросы /api/predict и /api/predict/batch отклоняются с 503, если
+    # оценка ожидания в очереди (по измеренной пропускной способности) больше
+    # admission_max_queue_time секунд (0 - без ограничения) или не укладывается в дедлайн
+    # из заголовка deadline_header (миллисекунды от получения запроса)
+    admission_max_queue_time: float = 5.0
+    deadline_header: str = "X-Request-Deadline-Ms"
+    # Тексты длиннее max_len модели режутся на окна с перекрытием window_overlap токенов,
+    # логиты перекрытий усредняются. sliding_window=False - обрезка по max_len
+    sliding_window: bool = True
+    window_overlap: int = 32
+    # "longest" - паддинг до самой длинной строки группы, "max_length" - до max_len модели
+    padding_strategy: str = "longest"
+    # Границы корзин длин (в токенах) для группировки батча перед прогоном модели
+    length_buckets: List[int] = [8, 16, 32, 64]
     device: str = "cuda"
+    # Бэкенд инференса: "torch" (eager), "onnx" (ONNX Runtime) или "torchscript".
+    # Артефакты onnx/torchscript создаются командой export_model.py
+    inference_backend: str = "torch"
+    onnx_model_path: str = ""
+    torchscript_model_path: str = ""
+    # Квантизация для CPU: "none" или "dynamic" (INT8 веса линейных слоёв; для onnx -
+    # модель export_model.py --quantize). Включается, только если доля совпавших тегов
+    # с fp32 моделью на контрольной выборке не ниже quantization_min_agreement
+    quantization: str = "none"
+    quantization_min_agreement: float = 0.99
+    # JSONL с {"input": ...} в каждой строке (по умолчанию MODEL_PATH/quantization_sample.jsonl)
+    quantization_sample_path: str = ""
+    # Потоки инференса: модель работает вне event loop, в отдельном пуле потоков
+    inference_threads: int = 1
+    # Максимум батчей, одновременно переданных в пул инференса
+    max_inflight_batches: int = 2
+    # Потоки PyTorch внутри операции и между операциями (0 - значение по умолчанию)
+    torch_num_threads: int = 0
+    torch_interop_threads: int = 0
+    # Процессы инференса с общими весами в разделяемой памяти (0 - инференс в процессе API)
+    inference_processes: int = 0
+    # Таймаут ответа процесса инференса на батч (секунды)
+    worker_request_timeout: float = 30.0
+    # Перезапусков упавшего процесса инференса подряд, если он так и не стал готов
+    worker_max_restarts: int = 3
+    # Кеш предсказаний: LRU с ограничением по записям и памяти, TTL 0 - без истечения
+    cache_max_entries: int = 10000
+    cache_max_bytes: int = 64 * 1024 * 1024
+    cache_ttl_seconds: float = 0.0
+    # Нормализация ключа кеша: схлопывание пробелов и приведение к нижнему регистру.
+    # При нормализации в модель идёт нормализованный текст, позиции переводятся в исходный
+    cache_normalize_whitespace: bool = True
+    cache_normalize_case: bool = False
+    # Общий кеш второго уровня для всех worker'ов хоста: "none" или "sqlite"
+    shared_cache_backend: str = "none"
+    shared_cache_path: str = os.path.join(tempfile.gettempdir(), "ner_cache.sqlite3")
+    shared_cache_max_entries: int = 1000000
+    # Окно перцентилей и RPS в /metrics (секунды); окно сдвигается интервалами
+    # metrics_window_seconds / metrics_window_slots
+    metrics_window_seconds: float = 60.0
+    metrics_window_slots: int = 12
+    # Посекундная история запросов для /metrics/history (секунды) и окно RPS (секунды)
+    metrics_history_seconds: int = 600
+    metrics_rps_window: int = 10
+    # Разбивка времени запроса по этапам (queue, tokenize, forward, decode, serialize) в
+    # заголовке ответа Server-Timing: доля запросов в выборке и заголовок запроса,
+    # с которым разбивка возвращается всегда
+    stage_timing_sample_rate: float = 0.0
+    stage_timing_header: str = "X-Stage-Timing"
+    # Профилирование по запросу POST /profile (выключено по умолчанию): длительность
+    # захвата не больше profiler_max_seconds, trace torch.profiler - для первых
+    # profiler_max_traces батчей захвата
+    profiler_enabled: bool = False
+    profiler_max_seconds: float = 30.0
+    profiler_max_traces: int = 10
     prometheus_port: int = 8001
     streamlit_port: int = 8501
     api_port: int = 8000
@@ -9,7 +9,11 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from .api.routes import router
 from .models.ner_model import ner_model
+from .services.prediction import prediction_service
+from .services.jobs import job_manager
+from .services.worker_pool import worker_pool
 from .monitoring.middleware import MetricsMiddleware
+from .monitoring.prometheus import prometheus_exporter
 from .core.config import settings
 from .core.logging import app_logger
 
@@ -26,12 +30,20 @@ async def lifespan(app: FastAPI):
         app_logger.error("Не удалось загрузить модель!")
         raise RuntimeError("Модель не загружена")
     
+    # Пул процессов инференса с общими весами (INFERENCE_PROCESSES > 0)
+    worker_pool.start(ner_model)
+    
     app_logger.info("Сервис успешно запущен")
     
     yield
     
     # Shutdown
     app_logger.info("Остановка сервиса...")
+    await job_manager.stop()
+    await prediction_service.stop()
+    worker_pool.stop()
+    ner_model.shutdown()
+    prometheus_exporter.mark_process_dead()
 
 # Создание FastAPI приложения
 app = FastAPI(
@@ -3,12 +3,17 @@ NER модель - загрузка и обёртка для предсказа
 """
 import os
 import json
+import time
+import bisect
 import asyncio
+import numpy as np
 import torch
+from concurrent.futures import ThreadPoolExecutor
 import torch.nn as nn
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Optional
 from transformers import AutoModelForTokenClassification, AutoTokenizer, AutoConfig, AutoModel
 from ..core.config import settings
+from ..monitoring.profiler import profiler
 from ..core.logging import model_logger
 
 class NERModel(nn.Module):
@@ -40,6 +45,145 @@ class NERModel(nn.Module):
         
         return {'loss': loss, 'logits': logits}
 
+class InferenceBackend:
+    """Исполнитель прямого прохода модели: признаки батча -> логиты"""
+    
+    name = "base"
+    
+    def forward(self, features: Dict[str, torch.Tensor]) -> torch.Tensor:
+        raise NotImplementedError
+
+class TorchBackend(InferenceBackend):
+    """Eager PyTorch"""
+    
+    name = "torch"
+    
+    def __init__(self, model: nn.Module):
+        self.model = model
+    
+    def forward(self, features: Dict[str, torch.Tensor]) -> torch.Tensor:
+        with torch.no_grad():
+            return self.model(**features).logits
+
+class TorchScriptBackend(InferenceBackend):
+    """Трассированный TorchScript граф (см. export_model.py)"""
+    
+    name = "torchscript"
+    
+    def __init__(self, path: str, device: str = "cpu"):
+        self.module = torch.jit.load(path, map_location=device)
+        self.module.eval()
+    
+    def forward(self, features: Dict[str, torch.Tensor]) -> torch.Tensor:
+        with torch.no_grad():
+            return self.module(
+                features["input_ids"],
+                features["attention_mask"],
+                features.get("token_type_ids", torch.zeros_like(features["input_ids"]))
+            )
+
+class OnnxBackend(InferenceBackend):
+    """ONNX Runtime сессия с оптимизацией графа (см. export_model.py)"""
+    
+    name = "onnx"
+    
+    def __init__(self, path: str):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise RuntimeError("Для INFERENCE_BACKEND=onnx установите onnxruntime")
+        
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if settings.torch_num_threads > 0:
+            options.intra_op_num_threads = settings.torch_num_threads
+        if settings.torch_interop_threads > 0:
+            options.inter_op_num_threads = settings.torch_interop_threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [node.name for node in self.session.get_inputs()]
+    
+    def forward(self, features: Dict[str, torch.Tensor]) -> torch.Tensor:
+        feeds = {}
+        for name in self.input_names:
+            value = features.get(name)
+            if value is None:
+                value = torch.zeros_like(features["input_ids"])
+            feeds[name] = value.cpu().numpy()
+        logits = self.session.run(["logits"], feeds)[0]
+        return torch.from_numpy(logits)
+
+def backend_artifact_path(backend: str, model_path: str, quantized: bool = False) -> str:
+    """Путь к экспортированному артефакту бэкенда"""
+    if backend == "onnx":
+        path = settings.onnx_model_path or os.path.join(model_path, "model.onnx")
+        # Квантизованная модель лежит рядом: model.onnx -> model.int8.onnx
+        return os.path.splitext(path)[0] + ".int8.onnx" if quantized else path
+    if backend == "torchscript" and not quantized:
+        return settings.torchscript_model_path or os.path.join(model_path, "model.torchscript.pt")
+    raise ValueError(f"У бэкенда {backend} нет артефакта экспорта" + (" для квантизации" if quantized else ""))
+
+def create_backend(backend: str, model_path: str, model: nn.Module, device: str = "cpu",
+                   quantized: bool = False) -> InferenceBackend:
+    """Создание бэкенда инференса по имени из настроек"""
+    if backend == "torch":
+        if quantized:
+            # Динамическая квантизация: INT8 веса nn.Linear, активации квантуются на лету
+            model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+        return TorchBackend(model)
+    if backend == "torchscript":
+        return TorchScriptBackend(backend_artifact_path(backend, model_path, quantized), device)
+    if backend == "onnx":
+        return OnnxBackend(backend_artifact_path(backend, model_path, quantized))
+    raise ValueError(f"Неизвестный бэкенд инференса: {backend}")
+
+# Таблица "кодовая точка -> пробельный символ"; все пробельные символы Unicode < U+3001
+_WHITESPACE_TABLE = np.array([chr(code).isspace() for code in range(0x3001)] + [False])
+
+class EntityBatch:
+    """
+    Сущности батча в компактном виде: строка i владеет элементами
+    row_splits[i]:row_splits[i + 1] массивов starts / ends / tag_ids.
+    В список словарей переводится только на выходе (to_lists).
+    timings - время этапов батча в секундах (tokenize, forward, decode).
+    """
+    
+    __slots__ = ("row_splits", "starts", "ends", "tag_ids", "tags", "timings")
+    
+    def __init__(self, row_splits: np.ndarray, starts: np.ndarray, ends: np.ndarray,
+                 tag_ids: np.ndarray, tags: List[str]):
+        self.row_splits = row_splits
+        self.starts = starts
+        self.ends = ends
+        self.tag_ids = tag_ids
+        self.tags = tags
+        self.timings: Dict[str, float] = {}
+    
+    def __len__(self) -> int:
+        return len(self.row_splits) - 1
+    
+    def to_lists(self) -> List[List[Dict[str, Any]]]:
+        """Сериализация в формат API: список сущностей для каждого текста"""
+        starts = self.starts.tolist()
+        ends = self.ends.tolist()
+        names = [self.tags[tag_id] for tag_id in self.tag_ids.tolist()]
+        splits = self.row_splits.tolist()
+        return [
+            [
+                {'start_index': starts[j], 'end_index': ends[j], 'entity': names[j]}
+                for j in range(splits[row], splits[row + 1])
+            ]
+            for row in range(len(splits) - 1)
+        ]
+
+def batch_to_lists(batch: EntityBatch, timings: Optional[Dict[str, float]] = None) -> List[List[Dict[str, Any]]]:
+    """to_lists() с записью времени этапов батча в timings (перевод в словари - часть decode)"""
+    start = time.perf_counter()
+    results = batch.to_lists()
+    if timings is not None:
+        timings.update(batch.timings)
+        timings["decode"] = timings.get("decode", 0.0) + time.perf_counter() - start
+    return results
+
 class NERModelWrapper:
     """Обёртка для загруженной модели NER"""
     
@@ -48,7 +192,17 @@ class NERModelWrapper:
         self.tokenizer = None
         self.config = None
         self.device = None
+        self.tags = None
+        # Массивы для векторного декодирования тегов (строятся по self.tags)
+        self._tag_tables = None
+        self.backend = None
+        self.quantized = False
+        self.quantization_report = None
         self._lock = asyncio.Lock()
+        # Инференс выполняется в отдельном пуле потоков, а не в event loop
+        self._executor = None
+        self._inflight = None
+        self._inflight_loop = None
         
         
     async def load_model(self, model_path: str = None) -> bool:
@@ -68,6 +222,12 @@ class NERModelWrapper:
                 id_to_tag = self.saved["id_to_tag"]
                 num_labels = len(tag_to_id)
 
+                # Таблица id -> тег для быстрого декодирования (ключи в json - строки)
+                self.tags = [None] * num_labels
+                for tag_id, tag in id_to_tag.items():
+                    self.tags[int(tag_id)] = tag
+                self._tag_tables = None
+
                 # Загружаем базовую конфигурацию предобученной модели и обновляем для задачи NER
                 # base_model_name = self.saved.get("model", "")
                 # base_model_path = r"D:\PythonProjects\!AI\NER-X5TECH-MSK-25\NER-fastapi-service\app\model_weights\bert"
@@ -79,8 +239,13 @@ class NERModelWrapper:
                     label2id=tag_to_id
                 )
 
+                self._configure_threads()
+
                 # Загружаем токенизатор и модель весов
                 self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+                if not self.tokenizer.is_fast:
+                    # offset_mapping есть только у fast (Rust) токенизатора
+                    raise RuntimeError("Нужен fast токенизатор: в папке модели нет tokenizer.json")
                 self.model = AutoModelForTokenClassification.from_pretrained(
                     model_path,
                     config=config,
@@ -94,178 +259,387 @@ class NERModelWrapper:
                 self.model.to(self.device)
                 self.model.eval()
 
+                self.backend = create_backend(settings.inference_backend, model_path, self.model, self.device)
+                if settings.quantization != "none":
+                    self._apply_quantization(model_path)
+
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=settings.inference_threads,
+                        thread_name_prefix="inference"
+                    )
             
-                model_logger.info(f"Модель успешно загружена на {self.device}")
+                model_logger.info(f"Модель успешно загружена на {self.device}, бэкенд: {self.backend.name}")
                 return True
                 
             except Exception as e:
                 model_logger.error(f"Ошибка при загрузке модели: {str(e)}")
                 return False
     
-    def _clean_bio_tags(self, tags: List[str]) -> List[str]:
-        """Очистка BIO тегов"""
-        cleaned = []
-        prev = 'O'
-        for tag in tags:
-            if tag.startswith('I-') and not prev.endswith(tag[2:]):
-                tag = 'B-' + tag[2:]
-            cleaned.append(tag)
-
-            prev = tag
-        return cleaned
-    
-    def _convert_predictions_to_entities(self, text: str, tags: List[str]) -> List[Dict[str, Any]]:
-        """Конвертация тегов в сущности с позициями"""
-        entities = []
-        words = text.split()
-        
-        current_entity = None
-        char_pos = 0
-        
-        for i, (word, tag) in enumerate(zip(words, tags)):
-            word_start = text.find(word, char_pos)
-            word_end = word_start + len(word)
-            
-            if tag.startswith('B-'):
-                # Начало новой сущности
-                if current_entity:
-                    entities.append(current_entity)
-                
-                current_entity = {
-                    'start_index': word_start,
-                    'end_index': word_end,
-                    'entity': tag
-                }
-            
-            elif tag.startswith('I-') and current_entity:
-                # Продолжение сущности
-                current_entity['end_index'] = word_end
-                current_entity['entity'] = tag
-            
-            elif tag == 'O':
-                # Конец сущности
-                if current_entity:
-                    entities.append(current_entity)
-                    current_entity = None
-            
-            char_pos = word_end + 1  # +1 для пробела
-        
-        # Добавляем последнюю сущность если есть
-        if current_entity:
-            entities.append(current_entity)
-        
-        return entities
-    
+    def _apply_quantization(self, model_path: str):
+        """Включение INT8 модели, если её теги совпадают с fp32 моделью на контрольной выборке"""
+        if settings.quantization != "dynamic":
+            raise ValueError(f"Неизвестный режим квантизации: {settings.quantization}")
+        if self.device != "cpu":
+            model_logger.warning("Квантизация поддерживается только на CPU, используется fp32 модель")
+            return
+
+        sample = self._load_quantization_sample(model_path)
+        if not sample:
+            model_logger.warning("Нет контрольной выборки для проверки квантизации, используется fp32 модель")
+            return
+
+        reference = self.backend
+        try:
+            candidate = create_backend(settings.inference_backend, model_path, self.model, self.device, quantized=True)
+        except Exception as e:
+            # Квантизация необязательна: без INT8 артефакта сервис работает на fp32 модели
+            model_logger.warning(f"Не удалось создать INT8 модель ({type(e).__name__}: {str(e)}), используется fp32 модель")
+            return
+
+        reference_results, reference_time = self._timed_predict(reference, sample)
+        candidate_results, candidate_time = self._timed_predict(candidate, sample)
+        agreement = self._tag_agreement(reference_results, candidate_results)
+
+        self.quantized = agreement >= settings.quantization_min_agreement
+        self.backend = candidate if self.quantized else reference
+        self.quantization_report = {
+            "mode": settings.quantization,
+            "applied": self.quantized,
+            "sample_size": len(sample),
+            "tag_agreement": agreement,
+            "min_agreement": settings.quantization_min_agreement,
+            "speedup": reference_time / candidate_time if candidate_time else None
+        }
+
+        if self.quantized:
+            model_logger.info(
+                f"INT8 модель включена: совпадение тегов {agreement:.4f}, "
+                f"ускорение x{self.quantization_report['speedup']:.2f}"
+            )
+        else:
+            model_logger.warning(
+                f"INT8 модель не прошла проверку точности: совпадение тегов {agreement:.4f} "
+                f"< {settings.quantization_min_agreement}, используется fp32 модель"
+            )
+
+    def _load_quantization_sample(self, model_path: str) -> List[str]:
+        """Контрольная выборка текстов (JSONL с полем input)"""
+        path = settings.quantization_sample_path or os.path.join(model_path, "quantization_sample.jsonl")
+        if not os.path.exists(path):
+            return []
+        sample = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    sample.append(json.loads(line)["input"])
+        return sample
+
+    def _timed_predict(self, backend: InferenceBackend, texts: List[str]) -> Tuple[List[List[Dict[str, Any]]], float]:
+        """Предсказание выборки заданным бэкендом с замером времени"""
+        current, self.backend = self.backend, backend
+        try:
+            results = []
+            start = time.perf_counter()
+            for i in range(0, len(texts), settings.bulk_batch_size):
+                results.extend(self.predict_batch_sync(texts[i:i + settings.bulk_batch_size]))
+            return results, time.perf_counter() - start
+        finally:
+            self.backend = current
+
+    @staticmethod
+    def _tag_agreement(reference: List[List[Dict[str, Any]]], candidate: List[List[Dict[str, Any]]]) -> float:
+        """Доля слов, получивших одинаковый тег у обеих моделей"""
+        total = matched = 0
+        for reference_entities, candidate_entities in zip(reference, candidate):
+            candidate_tags = {(e['start_index'], e['end_index']): e['entity'] for e in candidate_entities}
+            for entity in reference_entities:
+                total += 1
+                matched += candidate_tags.get((entity['start_index'], entity['end_index'])) == entity['entity']
+        return matched / total if total else 1.0
+
+    def _configure_threads(self):
+        """Настройка потоков PyTorch (intra-op и inter-op)"""
+        if settings.torch_num_threads > 0:
+            torch.set_num_threads(settings.torch_num_threads)
+        if settings.torch_interop_threads > 0:
+            try:
+                torch.set_num_interop_threads(settings.torch_interop_threads)
+            except RuntimeError as e:
+                # Можно задать только до первой параллельной операции в процессе
+                model_logger.warning(f"Не удалось задать inter-op потоки: {str(e)}")
+        model_logger.info(
+            f"Потоки PyTorch: intra-op={torch.get_num_threads()}, inter-op={torch.get_num_interop_threads()}, "
+            f"потоков инференса={settings.inference_threads}"
+        )
+
+    def _get_inflight_semaphore(self) -> asyncio.Semaphore:
+        """Ограничение числа батчей, одновременно переданных в пул инференса"""
+        loop = asyncio.get_running_loop()
+        if self._inflight is None or self._inflight_loop is not loop:
+            self._inflight = asyncio.Semaphore(settings.max_inflight_batches)
+            self._inflight_loop = loop
+        return self._inflight
+
+    def shutdown(self):
+        """Остановка пула потоков инференса"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _get_tag_tables(self) -> Dict[str, Any]:
+        """
+        Таблицы по id тега: имя, тип сущности, признак I- и id соответствующего B- тега.
+        B- теги, которых нет в словаре модели, добавляются в конец списка имён
+        """
+        if self._tag_tables is None:
+            names = [tag or "" for tag in self.tags]
+            types = {}
+            entity_type = np.full(len(names), -1, dtype=np.int64)
+            for tag_id, tag in enumerate(names):
+                if tag[:2] in ("B-", "I-"):
+                    entity_type[tag_id] = types.setdefault(tag[2:], len(types))
+
+            is_inside = np.array([tag.startswith("I-") for tag in names])
+            begin_of = np.arange(len(names), dtype=np.int64)
+            for tag_id, tag in enumerate(names):
+                if tag.startswith("I-"):
+                    begin = "B-" + tag[2:]
+                    if begin not in names:
+                        names.append(begin)
+                    begin_of[tag_id] = names.index(begin)
+
+            self._tag_tables = {
+                "names": names,
+                "entity_type": entity_type,
+                "is_inside": is_inside,
+                "begin_of": begin_of,
+                "keep": np.array([bool(tag) for tag in names])
+            }
+        return self._tag_tables
+
     async def predict(self, text: str) -> List[Dict[str, Any]]:
         """Асинхронное предсказание сущностей"""
         if not text.strip():
             return []
         
+        results = await self.predict_batch([text])
+        return results[0]
+    
+    async def predict_batch(self, texts: List[str], timings: Optional[Dict[str, float]] = None) -> List[List[Dict[str, Any]]]:
+        """
+        Предсказание сущностей для батча текстов в пуле потоков инференса.
+        timings - словарь, в который записывается время этапов батча
+        """
         if not self.model or not self.tokenizer:
             raise RuntimeError("Модель не загружена")
         
-        try:
-            # words = text.split()
-            # if not words:
-            #     return []
-            
-            # # Токенизация
-            # encoding = self.tokenizer(
-            #     words,
-            #     is_split_into_words=True,
-            #     padding="max_length",
-            #     truncation=True,
-            #     max_length=settings.max_sequence_length,
-            #     return_tensors="pt"
-            # )
-            
-            # # Перенос на устройство
-            # device_encoding = {k: v.to(self.device) for k, v in encoding.items()}
-            
-            # # Предсказание
-            # with torch.no_grad():
-            #     outputs = self.model(**device_encoding)
-            #     logits = outputs['logits']
-            
-            # # Получение предсказаний
-            # predictions = logits.argmax(dim=-1)[0].cpu().tolist()
-            # word_ids = encoding.word_ids(batch_index=0)
-            
-            # # Маппинг предсказаний на слова
-            # result_tags = []
-            # prev_word_idx = None
-            
-            # for token_idx, word_idx in enumerate(word_ids):
-            #     if word_idx is not None and word_idx != prev_word_idx:
-            #         pred_id = predictions[token_idx]
-            #         tag = self.config['id_to_tag'][str(pred_id)]
-            #         result_tags.append(tag)
-            #         prev_word_idx = word_idx
+        loop = asyncio.get_running_loop()
+        async with self._get_inflight_semaphore():
+            return await loop.run_in_executor(self._executor, self.predict_batch_sync, texts, timings)
+    
+    def predict_batch_sync(self, texts: List[str], timings: Optional[Dict[str, float]] = None) -> List[List[Dict[str, Any]]]:
+        """Синхронное предсказание для батча (один проход модели на группу длин)"""
+        return batch_to_lists(profiler.run(self.predict_batch_arrays, texts), timings)
 
-            id_to_tag = self.saved["id_to_tag"]
-            max_length=self.saved.get("max_len", 128)
+    def predict_batch_arrays(self, texts: List[str]) -> EntityBatch:
+        """Предсказание для батча в компактном виде (EntityBatch)"""
+        if not self.model or not self.tokenizer:
+            raise RuntimeError("Модель не загружена")
+        
+        # Пустые тексты в модель не отправляем
+        batch_indices = [i for i, text in enumerate(texts) if text.strip()]
+        tables = self._get_tag_tables()
+        if not batch_indices:
+            empty = np.zeros(0, dtype=np.int64)
+            return EntityBatch(np.zeros(len(texts) + 1, dtype=np.int64), empty, empty, empty, tables["names"])
+        
+        try:
+            max_length = self.saved.get("max_len", 128)
+            batch_texts = [texts[i] for i in batch_indices]
 
-            words = text.split()    
+            # Один батчевый вызов fast токенизатора по исходным текстам: позиции символов
+            # берутся из offset_mapping. Длинные тексты режутся на окна с перекрытием
+            tokenize_start = time.perf_counter()
             enc = self.tokenizer(
-                words,
-                is_split_into_words=True,
-                padding="max_length",
+                batch_texts,
+                padding=True,
                 truncation=True,
                 max_length=max_length,
-                return_tensors="pt"
-            ).to(self.device)
-
-            with torch.no_grad():
-                logits = self.model(**enc).logits
-
-            preds = logits.argmax(dim=-1)[0].cpu().tolist()
-            word_ids = enc.word_ids(batch_index=0)
-
-            result_tags = []
-            result = []
-            prev_widx = None
-            for idx, widx in enumerate(word_ids):
-                if widx is not None and widx != prev_widx:
-                    tag = id_to_tag[str(preds[idx])] if isinstance(list(id_to_tag.keys())[0], str) else id_to_tag[preds[idx]]
-                    token = words[widx]
-                    result.append((token, tag))
-                    prev_widx = widx
-                    result_tags.append(tag)
-            
+                return_offsets_mapping=True,
+                return_overflowing_tokens=settings.sliding_window,
+                stride=self._window_stride(max_length),
+                return_tensors="np"
+            )
+            window_rows = enc.get("overflow_to_sample_mapping")
+            if window_rows is None:
+                window_rows = np.arange(len(batch_texts))
 
-            # Очистка BIO тегов
-            result_tags = self._clean_bio_tags(result_tags)
-            
-            # model_logger.info(f"result {result} {result_tags}")
-            # Конвертация в формат API
-            # entities = self._convert_predictions_to_entities(text, result_tags)
-            
-            return self.format_annotation(text, result_tags)
+            forward_start = time.perf_counter()
+            logits = self._run_model(enc, max_length)
+            decode_start = time.perf_counter()
+            text_base = np.concatenate(([0], np.cumsum([len(text) for text in batch_texts])))
+            rows, token_starts, token_ends, token_preds = self._merge_windows(
+                text_base, enc["offset_mapping"], window_rows, logits
+            )
+            word_rows, starts, ends, tag_ids = self._decode(
+                batch_texts, text_base, rows, token_starts, token_ends, token_preds, tables
+            )
+
+            # Строки без слов (пустые тексты) получают пустой диапазон
+            counts = np.zeros(len(texts), dtype=np.int64)
+            counts[batch_indices] = np.bincount(word_rows, minlength=len(batch_indices))
+            row_splits = np.concatenate(([0], np.cumsum(counts)))
+            batch = EntityBatch(row_splits, starts, ends, tag_ids, tables["names"])
+            batch.timings = {
+                "tokenize": forward_start - tokenize_start,
+                "forward": decode_start - forward_start,
+                "decode": time.perf_counter() - decode_start
+            }
+            return batch
             
         except Exception as e:
             model_logger.error(f"Ошибка при предсказании: {str(e)}")
             raise
+
+    def _window_stride(self, max_length: int) -> int:
+        """Перекрытие окон в токенах (не больше половины окна без служебных токенов)"""
+        content_length = max_length - self.tokenizer.num_special_tokens_to_add()
+        return max(0, min(settings.window_overlap, content_length // 2))
+
+    @staticmethod
+    def _merge_windows(text_base: np.ndarray, offsets: np.ndarray, window_rows: np.ndarray,
+                       logits: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Склейка окон: токены всех окон приводятся к позиции в тексте, логиты токена,
+        попавшего в несколько окон, суммируются (argmax суммы = argmax среднего).
+        Возвращает (строка текста, начало, конец, id тега) для токенов в порядке текста.
+        """
+        token_starts = offsets[..., 0]
+        token_ends = offsets[..., 1]
+        # Служебные токены и паддинг имеют пустой диапазон (0, 0)
+        windows, cols = np.nonzero(token_ends > token_starts)
+        rows = window_rows[windows]
+        token_starts = token_starts[windows, cols]
+        token_ends = token_ends[windows, cols]
+        token_logits = logits[windows, cols]
+
+        # Ключ токена - позиция его начала в склеенной строке батча
+        keys, first, inverse = np.unique(text_base[rows] + token_starts, return_index=True, return_inverse=True)
+        if len(keys) == len(token_starts):
+            token_preds = token_logits.argmax(axis=-1)[first]
+        else:
+            scores = np.zeros((len(keys), token_logits.shape[-1]), dtype=token_logits.dtype)
+            np.add.at(scores, inverse.reshape(-1), token_logits)
+            token_preds = scores.argmax(axis=-1)
+
+        return rows[first], token_starts[first], token_ends[first], token_preds
+
+    @staticmethod
+    def _decode(texts: List[str], text_base: np.ndarray, rows: np.ndarray, token_starts: np.ndarray,
+                token_ends: np.ndarray, token_preds: np.ndarray,
+                tables: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Векторное декодирование всего батча: слова, их позиции и теги после исправления BIO.
+        Возвращает (строка слова, начало, конец, id тега) для сущностей в порядке текста.
+        """
+        if not len(rows):
+            return rows, rows, rows, rows
+
+        # Пробельные символы всех текстов батча: префиксные суммы по склеенной строке
+        codes = np.frombuffer("".join(texts).encode("utf-32-le"), dtype=np.uint32)
+        is_space = _WHITESPACE_TABLE[np.minimum(codes, len(_WHITESPACE_TABLE) - 1)]
+        space_count = np.concatenate(([0], np.cumsum(is_space)))
+
+        # Новое слово: первый токен строки или пробельный символ между токенами
+        row_first = np.ones(len(rows), dtype=bool)
+        row_first[1:] = rows[1:] != rows[:-1]
+        prev_end = np.empty_like(token_ends)
+        prev_end[0] = 0
+        prev_end[1:] = token_ends[:-1]
+        base = text_base[rows]
+        gap_spaces = space_count[base + token_starts] - space_count[base + np.where(row_first, token_starts, prev_end)]
+        word_first = row_first | (gap_spaces > 0)
+
+        # Слово: от начала первого токена до конца последнего, тег - по первому сабтокену
+        first = np.flatnonzero(word_first)
+        last = np.append(first[1:] - 1, len(rows) - 1)
+        word_rows = rows[first]
+        starts = token_starts[first]
+        ends = token_ends[last]
+        tag_ids = token_preds[first]
+
+        # Исправление BIO: I-X без предшествующего слова типа X становится B-X
+        entity_type = tables["entity_type"][tag_ids]
+        prev_type = np.empty_like(entity_type)
+        prev_type[0] = -1
+        prev_type[1:] = entity_type[:-1]
+        prev_type[row_first[first]] = -1
+        broken = tables["is_inside"][tag_ids] & (entity_type != prev_type)
+        tag_ids = np.where(broken, tables["begin_of"][tag_ids], tag_ids)
+
+        keep = tables["keep"][tag_ids]
+        return word_rows[keep], starts[keep], ends[keep], tag_ids[keep]
     
+    def _length_groups(self, lengths: List[int]) -> List[List[int]]:
+        """Группировка строк батча по корзинам длин, чтобы паддинг был минимальным"""
+        order = sorted(range(len(lengths)), key=lengths.__getitem__)
+        buckets = settings.length_buckets
+        if not buckets:
+            return [order]
+
+        groups = []
+        current_bucket = None
+        for row in order:
+            bucket = bisect.bisect_left(buckets, lengths[row])
+            if bucket != current_bucket:
+                groups.append([])
+                current_bucket = bucket
+            groups[-1].append(row)
+        return groups
+
+    def _run_model(self, enc, max_length: int) -> np.ndarray:
+        """Прогон модели по группам длин; возвращает логиты каждого токена батча"""
+        attention_mask = enc["attention_mask"]
+        lengths = attention_mask.sum(axis=1)
+        pad_id = self.tokenizer.pad_token_id or 0
+        batch_logits = None
+        batch_width = attention_mask.shape[1]
+        # Окна длинных текстов добавляют строки: прогоняем их частями, а не одним тензором
+        chunk_size = max(settings.bulk_batch_size, 1)
+
+        for group in self._length_groups(lengths.tolist()):
+            for chunk_start in range(0, len(group), chunk_size):
+                rows = group[chunk_start:chunk_start + chunk_size]
+                # Динамический паддинг до самой длинной строки группы
+                if settings.padding_strategy == "max_length":
+                    width = max_length
+                else:
+                    width = int(lengths[rows].max())
+
+                features = {}
+                for key in ("input_ids", "attention_mask", "token_type_ids"):
+                    if key not in enc:
+                        continue
+                    values = enc[key][rows, :width].astype(np.int64)
+                    if values.shape[1] < width:
+                        pad_value = pad_id if key == "input_ids" else 0
+                        values = np.pad(values, ((0, 0), (0, width - values.shape[1])), constant_values=pad_value)
+                    features[key] = torch.from_numpy(values).to(self.device)
+
+                logits = self.backend.forward(features)
+
+                # Одна передача с устройства на часть группы
+                group_logits = logits.float().cpu().numpy()
+                if batch_logits is None:
+                    batch_logits = np.zeros((len(lengths), batch_width, group_logits.shape[-1]), dtype=np.float32)
+                batch_logits[rows, :min(width, batch_width)] = group_logits[:, :batch_width]
+
+        return batch_logits
+
     def is_loaded(self) -> bool:
         """Проверка загружена ли модель"""
         return self.model is not None and self.tokenizer is not None
-    
-    @staticmethod
-    def format_annotation(text, tagged_output):        
-        ann = []
-        idx = 0
-        for token, tag in zip(text.split(), tagged_output):
-            length = len(token)        
-            if tag:
-                current_entity = {
-                    'start_index': idx,
-                    'end_index': idx + length,
-                    'entity': tag
-                }
-                ann.append(current_entity)
-            idx += length + 1  # +1 на разделитель пробела
-
-        return ann
 
 # Глобальный экземпляр модели
 ner_model = NERModelWrapper()
\ No newline at end of file
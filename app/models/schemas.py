@@ -1,7 +1,7 @@
 """
 Pydantic схемы для API
 """
-from typing import List, Optional
+from typing import List, Optional, Dict
 from pydantic import BaseModel, Field, RootModel
 
 class PredictRequest(BaseModel):
@@ -50,6 +50,13 @@ class PredictResponse(RootModel[List[Entity]]):
             ]
         }
 
+class ColumnarResponse(BaseModel):
+    tags: List[str] = Field(..., description="Словарь тегов: entity содержит индексы в этом списке")
+    row_splits: List[int] = Field(..., description="Границы текстов: сущности текста i - элементы row_splits[i]:row_splits[i + 1]")
+    start_index: List[int] = Field(..., description="Начальные позиции сущностей")
+    end_index: List[int] = Field(..., description="Конечные позиции сущностей")
+    entity: List[int] = Field(..., description="Id тегов сущностей")
+
 class HealthResponse(BaseModel):
     status: str = Field(..., description="Статус сервиса")
     model_loaded: bool = Field(..., description="Загружена ли модель")
@@ -60,4 +67,48 @@ class MetricsResponse(BaseModel):
     successful_requests: int = Field(..., description="Успешные запросы")
     failed_requests: int = Field(..., description="Неуспешные запросы")
     average_response_time: float = Field(..., description="Среднее время ответа в миллисекундах")
-    requests_per_second: float = Field(..., description="Запросов в секунду")
\ No newline at end of file
+    p50_response_time: float = Field(0.0, description="Медиана времени ответа за окно (мс)")
+    p90_response_time: float = Field(0.0, description="90-й перцентиль времени ответа за окно (мс)")
+    p95_response_time: float = Field(0.0, description="95-й перцентиль времени ответа за окно (мс)")
+    p99_response_time: float = Field(0.0, description="99-й перцентиль времени ответа за окно (мс)")
+    response_time_by_endpoint: Dict[str, Dict[str, float]] = Field(default_factory=dict, description="Время ответа по endpoint за окно (count, avg, p50, p90, p99, max в мс)")
+    requests_per_second: float = Field(..., description="Запросов в секунду")
+    queue_depth: int = Field(0, description="Запросов в очереди на батчинг")
+    batches_total: int = Field(0, description="Количество батчей, отправленных в модель")
+    average_batch_size: float = Field(0.0, description="Средний размер батча")
+    batch_size_distribution: Dict[str, int] = Field(default_factory=dict, description="Распределение размеров батчей")
+    queue_depth_by_priority: Dict[str, int] = Field(default_factory=dict, description="Текстов в очереди планировщика по классам приоритета")
+    queue_time_by_priority: Dict[str, Dict[str, float]] = Field(default_factory=dict, description="Время ожидания в очереди по классам приоритета (count, p50, p95, max в мс)")
+    stage_time: Dict[str, Dict[str, float]] = Field(default_factory=dict, description="Время этапов tokenize, forward, decode (на батч) и serialize (на ответ) за окно (count, avg, p50, p90, p99, max в мс)")
+    estimated_throughput: float = Field(0.0, description="Измеренная пропускная способность модели (текстов/с)")
+    shed_requests: Dict[str, int] = Field(default_factory=dict, description="Отклонённые контролем допуска запросы по классу и причине")
+
+class MetricsHistoryResponse(BaseModel):
+    interval: float = Field(..., description="Шаг ряда (секунды)")
+    latency_bucket_bounds: List[float] = Field(..., description="Верхние границы корзин времени ответа (мс); последняя корзина рядов - выше последней границы")
+    timestamps: List[int] = Field(..., description="Начало секунды (unix)")
+    requests: List[int] = Field(..., description="Запросов за секунду")
+    errors: List[int] = Field(..., description="Неуспешных запросов за секунду")
+    average_response_time: List[float] = Field(..., description="Среднее время ответа (мс)")
+    p50_response_time: List[float] = Field(..., description="Медиана времени ответа по корзинам (мс)")
+    p99_response_time: List[float] = Field(..., description="99-й перцентиль времени ответа по корзинам (мс)")
+    latency_buckets: List[List[int]] = Field(..., description="Запросов в каждой корзине времени ответа")
+
+class JobStatusResponse(BaseModel):
+    job_id: str = Field(..., description="Идентификатор задания")
+    status: str = Field(..., description="Статус: queued, running, completed, failed, cancelled")
+    total: int = Field(..., description="Количество текстов в задании")
+    processed: int = Field(..., description="Обработано текстов")
+    progress: float = Field(..., description="Доля обработанных текстов")
+    error: Optional[str] = Field(None, description="Ошибка выполнения")
+    created_at: float = Field(..., description="Время постановки (unix)")
+    started_at: Optional[float] = Field(None, description="Время начала обработки (unix)")
+    finished_at: Optional[float] = Field(None, description="Время завершения (unix)")
+
+class JobResultsResponse(BaseModel):
+    job_id: str = Field(..., description="Идентификатор задания")
+    status: str = Field(..., description="Статус задания")
+    offset: int = Field(..., description="Индекс первого результата в задании")
+    processed: int = Field(..., description="Обработано текстов на момент запроса")
+    total: int = Field(..., description="Количество текстов в задании")
+    results: List[List[Entity]] = Field(..., description="Сущности для текстов offset..offset+len(results)")
@@ -21,6 +21,7 @@ st.set_page_config(
 # Константы
 API_BASE_URL = "http://localhost:8000"
 REFRESH_INTERVAL = 2  # секунды
+HISTORY_SECONDS = 300  # длина графиков, секунды
 
 class Dashboard:
     """Главный класс дашборда"""
@@ -30,8 +31,6 @@ class Dashboard:
     
     def setup_session_state(self):
         """Инициализация состояния сессии"""
-        if 'metrics_history' not in st.session_state:
-            st.session_state.metrics_history = []
         if 'last_update' not in st.session_state:
             st.session_state.last_update = datetime.now()
     
@@ -45,6 +44,16 @@ class Dashboard:
             st.error(f"Ошибка при получении метрик: {str(e)}")
         return None
     
+    def fetch_history(self, seconds: int = HISTORY_SECONDS):
+        """Посекундная история запросов из API"""
+        try:
+            response = requests.get(f"{API_BASE_URL}/metrics/history", params={"seconds": seconds}, timeout=5)
+            if response.status_code == 200:
+                return response.json()
+        except Exception as e:
+            st.error(f"Ошибка при получении истории метрик: {str(e)}")
+        return None
+    
     def fetch_health(self):
         """Получение информации о здоровье сервиса"""
         try:
@@ -109,15 +118,6 @@ class Dashboard:
         
         metrics_data = self.fetch_metrics()
         if metrics_data:
-            # Добавляем метрики в историю
-            current_time = datetime.now()
-            metrics_data['timestamp'] = current_time
-            st.session_state.metrics_history.append(metrics_data)
-            
-            # Ограничиваем историю последними 100 записями
-            if len(st.session_state.metrics_history) > 100:
-                st.session_state.metrics_history = st.session_state.metrics_history[-100:]
-            
             # Основные метрики
             col1, col2, col3, col4 = st.columns(4)
             
@@ -137,12 +137,20 @@ class Dashboard:
                 st.metric("Успешность (%)", f"{success_rate:.1f}%")
             
             # Графики
-            if len(st.session_state.metrics_history) > 1:
-                self.render_performance_charts()
+            history = self.fetch_history()
+            if history:
+                self.render_performance_charts(history)
     
-    def render_performance_charts(self):
-        """Отрисовка графиков производительности"""
-        df = pd.DataFrame(st.session_state.metrics_history)
+    def render_performance_charts(self, history: dict):
+        """Отрисовка графиков производительности по посекундной истории сервиса"""
+        df = pd.DataFrame({
+            'timestamp': [datetime.fromtimestamp(second) for second in history['timestamps']],
+            'requests_per_second': history['requests'],
+            'p50_response_time': history['p50_response_time'],
+            'p99_response_time': history['p99_response_time'],
+            'failed_requests': history['errors']
+        })
+        df['successful_requests'] = df['requests_per_second'] - df['failed_requests']
         
         col1, col2 = st.columns(2)
         
@@ -163,17 +171,17 @@ class Dashboard:
             fig_time = px.line(
                 df, 
                 x='timestamp', 
-                y='average_response_time',
-                title='Среднее время ответа (мс)',
-                labels={'average_response_time': 'Время (мс)', 'timestamp': 'Время'}
+                y=['p50_response_time', 'p99_response_time'],
+                title='Время ответа p50 / p99 (мс)',
+                labels={'value': 'Время (мс)', 'timestamp': 'Время'}
             )
             fig_time.update_layout(height=300)
             st.plotly_chart(fig_time, use_container_width=True)
         
         # График ошибок
-        if 'error_rate' in df.columns:
+        if df['requests_per_second'].any():
             fig_errors = px.bar(
-                df.tail(20), 
+                df.tail(60), 
                 x='timestamp', 
                 y=['successful_requests', 'failed_requests'],
                 title='Успешные vs Неуспешные запросы',
@@ -2,57 +2,78 @@
 Middleware для мониторинга производительности
 """
 import time
-import asyncio
-from typing import Callable
+import random
 from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
+from ..core.config import settings
 from ..services.metrics import metrics_collector
+from .stages import request_stages, server_timing
 from ..core.logging import app_logger
 
-class MetricsMiddleware(BaseHTTPMiddleware):
-    """Middleware для сбора метрик HTTP запросов"""
+class MetricsMiddleware:
+    """
+    Middleware для сбора метрик HTTP запросов. Запрос учитывается под шаблоном пути
+    роута (/api/jobs/{job_id}), время - до отправки последней части тела, поэтому
+    потоковые ответы учитываются целиком. X-Response-Time - время до заголовков ответа.
+    Запросы из выборки (доля stage_sample_rate или с заголовком stage_header) получают
+    разбивку времени по этапам в заголовке Server-Timing
+    """
     
-    def __init__(self, app, exclude_paths: list = None):
-        super().__init__(app)
-        self.exclude_paths = exclude_paths or ["/docs", "/openapi.json", "/redoc"]
+    def __init__(self, app, exclude_paths: list = None, stage_sample_rate: float = None, stage_header: str = None):
+        self.app = app
+        self.exclude_paths = set(exclude_paths or ["/docs", "/openapi.json", "/redoc"])
+        self.stage_sample_rate = settings.stage_timing_sample_rate if stage_sample_rate is None else stage_sample_rate
+        self.stage_header = (stage_header or settings.stage_timing_header).lower().encode()
+    
+    def _sampled(self, scope) -> bool:
+        """Попал ли запрос в выборку разбивки по этапам"""
+        if self.stage_sample_rate > 0 and random.random() < self.stage_sample_rate:
+            return True
+        return any(name == self.stage_header for name, _ in scope["headers"])
     
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+    async def __call__(self, scope, receive, send):
         # Исключаем определенные пути из мониторинга
-        if request.url.path in self.exclude_paths:
-            return await call_next(request)
+        if scope["type"] != "http" or scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
         
-        start_time = time.time()
+        start_time = time.perf_counter()
+        status_code = 500
+        stages = {} if self._sampled(scope) else None
+        stages_token = request_stages.set(stages) if stages is not None else None
         
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                response_time = time.perf_counter() - start_time
+                message["headers"] = list(message.get("headers", []))
+                message["headers"].append((b"X-Response-Time", f"{response_time * 1000:.2f}ms".encode()))
+                if stages is not None:
+                    message["headers"].append((b"Server-Timing", server_timing(stages, response_time).encode()))
+            await send(message)
+        
+        error_type = None
         try:
-            response = await call_next(request)
-            success = response.status_code < 400
-            
-            # Записываем метрики асинхронно
-            response_time = time.time() - start_time
-            asyncio.create_task(
-                metrics_collector.record_request(
-                    endpoint=request.url.path,
-                    response_time=response_time,
-                    success=success
-                )
-            )
-            
-            # Добавляем заголовки ответа
-            response.headers["X-Response-Time"] = f"{response_time * 1000:.2f}ms"
-            return response
-            
+            await self.app(scope, receive, send_wrapper)
         except Exception as e:
-            # Записываем ошибку в метрики
-            response_time = time.time() - start_time
-            asyncio.create_task(
-                metrics_collector.record_request(
-                    endpoint=request.url.path,
-                    response_time=response_time,
-                    success=False,
-                    error_type=type(e).__name__
-                )
-            )
+            error_type = type(e).__name__
             raise
+        finally:
+            if stages_token is not None:
+                request_stages.reset(stages_token)
+            success = error_type is None and status_code < 400
+            if not success and error_type is None:
+                error_type = f"HTTP {status_code}"
+            # Роут записывается в scope при маршрутизации; без роута - 404
+            route = scope.get("route")
+            metrics_collector.record_request(
+                endpoint=getattr(route, "path", "unmatched"),
+                response_time=time.perf_counter() - start_time,
+                success=success,
+                error_type=error_type,
+                method=scope["method"],
+                status_code=status_code
+            )
 
 class CORSMiddleware:
     """Простой CORS middleware"""
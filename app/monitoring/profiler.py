@@ -0,0 +1,240 @@
+"""
+Профилирование работающего процесса по запросу (POST /profile)
+
+Захват длится заданное время и собирает:
+- cProfile event loop процесса API (роуты, сериализация, планировщик);
+- cProfile каждого батча модели - в потоке или процессе инференса;
+- trace torch.profiler для первых max_traces батчей захвата (по одному батчу
+  одновременно) и сводку операций torch по ним.
+
+Результат - zip архив. Вне захвата инференс проверяет один атрибут, поэтому
+выключенный профилировщик ничего не стоит. В Python 3.12+ cProfile один на процесс
+(sys.monitoring): профиль event loop видит и потоки инференса, отдельные профили
+батчей в потоках не создаются.
+"""
+import io
+import os
+import sys
+import json
+import time
+import marshal
+import pstats
+import asyncio
+import cProfile
+import tempfile
+import threading
+import zipfile
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from ..core.config import settings
+
+# Функций в текстовом отчёте python.txt и операций в torch_ops.txt
+TOP_FUNCTIONS = 60
+TOP_OPS = 60
+
+
+class ProfilerBusy(Exception):
+    """Захват профиля уже идёт"""
+
+
+class _LoadedStats:
+    """Словарь статистики cProfile в виде, который принимает pstats.Stats.add"""
+
+    def __init__(self, stats: Dict):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def _start_profile() -> Optional[cProfile.Profile]:
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # Другой профилировщик уже включён (в Python 3.12+ - на весь процесс)
+        return None
+    return profile
+
+
+def _torch_profile():
+    """Запущенный torch.profiler (CPU и, если доступна, CUDA)"""
+    import torch
+    from torch.profiler import profile, ProfilerActivity
+
+    activities = [ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(ProfilerActivity.CUDA)
+    prof = profile(activities=activities)
+    prof.start()
+    return prof
+
+
+def _torch_results(prof) -> Tuple[bytes, Dict[str, List[float]]]:
+    """Chrome trace и сводка операций остановленного torch.profiler"""
+    fd, path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        prof.export_chrome_trace(path)
+        with open(path, "rb") as f:
+            trace = f.read()
+    finally:
+        os.remove(path)
+
+    ops = {
+        event.key: [event.count, event.self_cpu_time_total, event.cpu_time_total]
+        for event in prof.key_averages()
+    }
+    return trace, ops
+
+
+def profiled(fn: Callable, *args, torch_trace: bool = False) -> Tuple[Any, Dict[str, Any]]:
+    """
+    fn(*args) под cProfile текущего потока и, при torch_trace, под torch.profiler.
+    Профиль - словарь из простых типов: его можно передать из процесса инференса
+    """
+    prof = _torch_profile() if torch_trace else None
+    profile = _start_profile()
+    try:
+        result = fn(*args)
+    finally:
+        if profile is not None:
+            profile.disable()
+        if prof is not None:
+            prof.stop()
+
+    stats = None
+    if profile is not None:
+        profile.create_stats()
+        stats = profile.stats
+    # Разбор trace - после остановки cProfile, чтобы не попасть в профиль батча
+    trace, ops = _torch_results(prof) if prof is not None else (None, None)
+    return result, {"stats": stats, "trace": trace, "ops": ops}
+
+
+def _ops_table(ops: Dict[str, List[float]]) -> str:
+    """Сводка операций torch по собственному времени CPU"""
+    lines = [f"{'self_cpu_ms':>12} {'cpu_total_ms':>12} {'calls':>8}  op"]
+    for key, (count, self_cpu, cpu_total) in sorted(ops.items(), key=lambda item: -item[1][1])[:TOP_OPS]:
+        lines.append(f"{self_cpu / 1000:12.3f} {cpu_total / 1000:12.3f} {int(count):8d}  {key}")
+    return "\n".join(lines) + "\n"
+
+
+class ProfileCapture:
+    """Один захват: профили батчей и бюджет trace torch.profiler"""
+
+    def __init__(self, max_traces: int):
+        self.started_at = time.time()
+        self.traces_left = max_traces
+        self.tracing = False
+        self.batches = 0
+        self.stats = pstats.Stats()
+        self.traces: List[bytes] = []
+        self.ops: Dict[str, List[float]] = {}
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def start_trace(self) -> bool:
+        """Писать ли trace torch.profiler для очередного батча"""
+        with self._lock:
+            if self.closed or self.tracing or self.traces_left <= 0:
+                return False
+            self.tracing = True
+            self.traces_left -= 1
+            return True
+
+    def add(self, profile: Optional[Dict[str, Any]], traced: bool):
+        """Профиль батча (None - батч завершился ошибкой); traced - батч из start_trace"""
+        with self._lock:
+            if traced:
+                self.tracing = False
+            # Батчи, завершившиеся после конца захвата, в архив не попадают
+            if self.closed or profile is None:
+                return
+            self.batches += 1
+            if profile["stats"]:
+                self.stats.add(_LoadedStats(profile["stats"]))
+            if profile["trace"] is not None:
+                self.traces.append(profile["trace"])
+            for key, values in (profile["ops"] or {}).items():
+                total = self.ops.setdefault(key, [0, 0.0, 0.0])
+                for i, value in enumerate(values):
+                    total[i] += value
+
+    def archive(self, seconds: float, loop_profile: Optional[cProfile.Profile]) -> bytes:
+        """Zip архив захвата: python.prof, python.txt, torch/*.json, torch_ops.txt, info.json"""
+        with self._lock:
+            self.closed = True
+        if loop_profile is not None:
+            self.stats.add(loop_profile)
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            if self.stats.stats:
+                # Формат pstats.Stats.dump_stats: python -m pstats python.prof, snakeviz
+                archive.writestr("python.prof", marshal.dumps(self.stats.stats))
+                report = io.StringIO()
+                self.stats.stream = report
+                self.stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+                archive.writestr("python.txt", report.getvalue())
+            for i, trace in enumerate(self.traces, 1):
+                archive.writestr(f"torch/batch_{i:03d}.json", trace)
+            if self.ops:
+                archive.writestr("torch_ops.txt", _ops_table(self.ops))
+            archive.writestr("info.json", json.dumps({
+                "pid": os.getpid(),
+                "python": sys.version.split()[0],
+                "started_at": self.started_at,
+                "seconds": seconds,
+                "batches": self.batches,
+                "torch_traces": len(self.traces)
+            }, indent=2))
+        return buffer.getvalue()
+
+
+class Profiler:
+    """Захват профиля процесса: не больше одного одновременно"""
+
+    def __init__(self, max_traces: int = 10):
+        self.max_traces = max_traces
+        self._capture: Optional[ProfileCapture] = None
+
+    @property
+    def active(self) -> Optional[ProfileCapture]:
+        """Текущий захват или None"""
+        return self._capture
+
+    def run(self, fn: Callable, *args) -> Any:
+        """fn(*args) в потоке инференса; во время захвата - с профилем батча"""
+        capture = self._capture
+        if capture is None:
+            return fn(*args)
+
+        traced = capture.start_trace()
+        profile = None
+        try:
+            result, profile = profiled(fn, *args, torch_trace=traced)
+        finally:
+            capture.add(profile, traced)
+        return result
+
+    async def capture(self, seconds: float) -> bytes:
+        """Захват профиля на seconds секунд; zip архив результата"""
+        if self._capture is not None:
+            raise ProfilerBusy("Захват профиля уже идёт")
+
+        capture = self._capture = ProfileCapture(self.max_traces)
+        loop_profile = _start_profile()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            if loop_profile is not None:
+                loop_profile.disable()
+            self._capture = None
+
+        # Сборка отчёта и сжатие - вне event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, capture.archive, seconds, loop_profile)
+
+
+# Глобальный профилировщик процесса
+profiler = Profiler(max_traces=settings.profiler_max_traces)
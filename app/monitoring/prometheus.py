@@ -0,0 +1,140 @@
+"""
+Экспорт метрик в формате Prometheus (нужен пакет prometheus-client)
+
+Значения пишутся в объекты prometheus_client того процесса, где произошло событие.
+Для нескольких процессов (uvicorn --workers, INFERENCE_PROCESSES) задайте переменную
+окружения PROMETHEUS_MULTIPROC_DIR - пустой каталог, общий для процессов сервиса:
+каждый процесс пишет значения в свои файлы, а /metrics/prometheus любого worker'а
+суммирует их (multiprocess mode prometheus_client). Без пакета запись ничего не делает.
+"""
+import os
+from typing import Dict, Any, Optional, Tuple
+
+# Границы корзин (секунды): время ответа и ожидания в очереди, этапы инференса
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+
+def _client():
+    try:
+        import prometheus_client
+    except ImportError:
+        return None
+    return prometheus_client
+
+
+def _multiprocess_dir() -> Optional[str]:
+    return os.environ.get("PROMETHEUS_MULTIPROC_DIR") or os.environ.get("prometheus_multiproc_dir")
+
+
+class PrometheusExporter:
+    """Метрики сервиса в prometheus_client; объекты метрик создаются при первой записи"""
+
+    def __init__(self, namespace: str = "ner"):
+        self.namespace = namespace
+        self._metrics: Optional[Dict[str, Any]] = None
+        self._initialized = False
+        # Метрики с готовыми значениями меток: labels() заметно дороже самой записи
+        self._children: Dict[tuple, Any] = {}
+
+    def _get(self) -> Optional[Dict[str, Any]]:
+        # Создание откладывается до первой записи: PROMETHEUS_MULTIPROC_DIR должна быть
+        # задана до появления метрик
+        if not self._initialized:
+            self._initialized = True
+            client = _client()
+            if client is not None:
+                self._metrics = self._create(client)
+        return self._metrics
+
+    def _create(self, client) -> Dict[str, Any]:
+        namespace = self.namespace
+        return {
+            "requests": client.Counter(
+                "http_requests", "HTTP запросы", ["endpoint", "method", "status"], namespace=namespace
+            ),
+            "latency": client.Histogram(
+                "http_request_duration_seconds", "Время ответа", ["endpoint", "method"],
+                buckets=REQUEST_BUCKETS, namespace=namespace
+            ),
+            "stage": client.Histogram(
+                "inference_stage_seconds", "Время этапа: tokenize, forward, decode (на батч), serialize (на ответ)", ["stage"],
+                buckets=STAGE_BUCKETS, namespace=namespace
+            ),
+            "batch_size": client.Histogram(
+                "batch_size", "Текстов в батче модели", buckets=BATCH_SIZE_BUCKETS, namespace=namespace
+            ),
+            "queue_depth": client.Gauge(
+                "queue_depth", "Текстов в очереди планировщика", multiprocess_mode="livesum", namespace=namespace
+            ),
+            "queue_time": client.Histogram(
+                "queue_wait_seconds", "Ожидание в очереди планировщика", ["priority"],
+                buckets=REQUEST_BUCKETS, namespace=namespace
+            ),
+            "shed": client.Counter(
+                "shed_requests", "Запросы, отклонённые контролем допуска", ["priority", "reason"], namespace=namespace
+            ),
+            "cache": client.Counter(
+                "cache_lookups", "Обращения к кешу предсказаний (hit, shared_hit, miss)", ["result"],
+                namespace=namespace
+            )
+        }
+
+    def _child(self, name: str, *labels):
+        key = (name, *labels)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._metrics[name].labels(*labels)
+        return child
+
+    def observe_request(self, endpoint: str, method: str, status: int, seconds: float):
+        if self._get() is not None:
+            self._child("requests", endpoint, method, str(status)).inc()
+            self._child("latency", endpoint, method).observe(seconds)
+
+    def observe_stage(self, stage: str, seconds: float):
+        if self._get() is not None:
+            self._child("stage", stage).observe(seconds)
+
+    def observe_batch(self, batch_size: int, queue_depth: int):
+        metrics = self._get()
+        if metrics is not None:
+            metrics["batch_size"].observe(batch_size)
+            metrics["queue_depth"].set(queue_depth)
+
+    def observe_queue_time(self, priority: str, seconds: float):
+        if self._get() is not None:
+            self._child("queue_time", priority).observe(seconds)
+
+    def count_shed(self, priority: str, reason: str):
+        if self._get() is not None:
+            self._child("shed", priority, reason).inc()
+
+    def count_cache(self, result: str):
+        if self._get() is not None:
+            self._child("cache", result).inc()
+
+    def render(self) -> Tuple[bytes, str]:
+        """Текст экспозиции и его Content-Type; в multiprocess mode - сумма по всем процессам"""
+        client = _client()
+        if client is None:
+            raise RuntimeError("Для экспорта метрик Prometheus установите prometheus-client")
+        self._get()
+        if _multiprocess_dir():
+            from prometheus_client import multiprocess
+            registry = client.CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = client.REGISTRY
+        return client.generate_latest(registry), client.CONTENT_TYPE_LATEST
+
+    def mark_process_dead(self):
+        """Удаление значений live-gauge завершающегося процесса (multiprocess mode)"""
+        if self._metrics is not None and _multiprocess_dir():
+            from prometheus_client import multiprocess
+            multiprocess.mark_process_dead(os.getpid())
+
+
+# Глобальный экспортер метрик Prometheus
+prometheus_exporter = PrometheusExporter()
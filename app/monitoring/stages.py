@@ -0,0 +1,53 @@
+"""
+Время запроса по этапам: queue, tokenize, forward, decode, serialize
+
+- queue - ожидание части запроса в очереди планировщика
+- tokenize, forward, decode - токенизация, прогон модели и декодирование сущностей
+  (включая перевод в словари API); измеряются один раз на батч
+- serialize - кодирование ответа в роуте
+
+Гистограммы этапов пишутся всегда (MetricsCollector.record_stage). Для запросов из
+выборки (STAGE_TIMING_SAMPLE_RATE или заголовок STAGE_TIMING_HEADER) MetricsMiddleware
+собирает разбивку в request_stages и возвращает её заголовком Server-Timing. Этапы
+батча добавляются каждому запросу батча, а запросу из нескольких частей - по всем его
+батчам; ответ из кеша или общий с одинаковым запросом в работе этапов модели не имеет.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+from ..services.metrics import metrics_collector
+
+STAGES = ("queue", "tokenize", "forward", "decode", "serialize")
+
+# Разбивка текущего запроса (None - запрос не попал в выборку)
+request_stages: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_stages", default=None)
+# Этапы батча, который выполняется в текущей задаче планировщика
+batch_stages: ContextVar[Optional[Dict[str, float]]] = ContextVar("batch_stages", default=None)
+
+
+def add_stages(target: Optional[Dict[str, float]], durations: Dict[str, float]):
+    """Добавление длительностей этапов (секунды) к разбивке запроса"""
+    if target is None:
+        return
+    for stage, seconds in durations.items():
+        target[stage] = target.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def stage(name: str):
+    """Замер этапа в event loop: гистограмма этапа и разбивка текущего запроса"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        metrics_collector.record_stage(name, seconds)
+        add_stages(request_stages.get(), {name: seconds})
+
+
+def server_timing(stages: Dict[str, float], total: float) -> str:
+    """Значение заголовка Server-Timing (длительности в мс)"""
+    parts = [f"{name};dur={stages[name] * 1000:.2f}" for name in STAGES if name in stages]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
@@ -0,0 +1,304 @@
+"""
+Кеш предсказаний: LRU с TTL, ограничением памяти и нормализацией ключей
+
+Первый уровень (L1) - словарь в памяти процесса. Второй уровень (L2) -
+опциональный общий кеш для всех worker'ов хоста (SharedCacheBackend).
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+from ..core.logging import app_logger
+from .metrics import metrics_collector
+
+# Примерный размер одной сущности в памяти (dict с тремя полями)
+_ENTITY_SIZE = sys.getsizeof({'start_index': 0, 'end_index': 0, 'entity': ''})
+
+
+class SharedCacheBackend:
+    """Интерфейс общего кеша второго уровня (L2), разделяемого процессами"""
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        raise NotImplementedError
+
+    def put(self, key: str, entities: List[Dict[str, Any]]):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+class SQLiteCacheBackend(SharedCacheBackend):
+    """
+    Общий кеш на локальном SQLite файле (WAL): все uvicorn worker'ы хоста
+    читают и пишут один файл. Ошибки L2 (блокировка, диск) не ломают запрос -
+    они считаются промахом.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = 0.0, max_entries: int = 1000000,
+                 prune_interval: int = 1000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.prune_interval = prune_interval
+
+        self._conn = None
+        self._conn_pid = None
+        self._puts_since_prune = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        """Соединение открывается лениво и заново после fork"""
+        if self._conn is None or self._conn_pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=0.05, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn = conn
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        try:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM predictions WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            self.errors += 1
+            app_logger.debug(f"Ошибка чтения общего кеша: {str(e)}")
+            return None
+
+        if row is None or (row[1] and row[1] < time.time()):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, entities: List[Dict[str, Any]]):
+        now = time.time()
+        expires_at = now + self.ttl_seconds if self.ttl_seconds > 0 else 0.0
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO predictions (key, value, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(entities, ensure_ascii=False, separators=(",", ":")), now, expires_at)
+            )
+            self._puts_since_prune += 1
+            if self._puts_since_prune >= self.prune_interval:
+                self._puts_since_prune = 0
+                self._prune(conn, now)
+        except sqlite3.Error as e:
+            self.errors += 1
+            app_logger.debug(f"Ошибка записи в общий кеш: {str(e)}")
+
+    def _prune(self, conn: sqlite3.Connection, now: float):
+        """Удаление истёкших записей и самых старых сверх max_entries"""
+        conn.execute("DELETE FROM predictions WHERE expires_at > 0 AND expires_at < ?", (now,))
+        conn.execute(
+            "DELETE FROM predictions WHERE key IN ("
+            "SELECT key FROM predictions ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def clear(self):
+        try:
+            self._connection().execute("DELETE FROM predictions")
+        except sqlite3.Error as e:
+            self.errors += 1
+            app_logger.error(f"Ошибка очистки общего кеша: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            entries = self._connection().execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors
+        }
+
+
+def create_shared_cache(backend: str, path: str, ttl_seconds: float = 0.0,
+                        max_entries: int = 1000000) -> Optional[SharedCacheBackend]:
+    """Создание общего кеша по имени бэкенда из настроек"""
+    if not backend or backend == "none":
+        return None
+    if backend == "sqlite":
+        return SQLiteCacheBackend(path, ttl_seconds=ttl_seconds, max_entries=max_entries)
+    raise ValueError(f"Неизвестный бэкенд общего кеша: {backend}")
+
+
+class PredictionCache:
+    """LRU кеш предсказаний с TTL, бюджетом памяти в байтах и статистикой"""
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024,
+                 ttl_seconds: float = 0.0, normalize_whitespace: bool = True, normalize_case: bool = False,
+                 shared: Optional[SharedCacheBackend] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.normalize_whitespace = normalize_whitespace
+        self.normalize_case = normalize_case
+        # Общий кеш второго уровня; L1 в памяти процесса стоит перед ним
+        self.shared = shared
+
+        # ключ -> (сущности, размер в байтах, время истечения)
+        self._entries = OrderedDict()
+        self.bytes_used = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def normalize(self, text: str) -> Tuple[str, Optional[List[int]]]:
+        """
+        Нормализация текста для ключа кеша.
+        Возвращает ключ и таблицу позиций: индекс символа ключа -> индекс в исходном тексте
+        (None, если ключ совпадает с текстом).
+        """
+        key = text
+        if self.normalize_whitespace:
+            key = " ".join(key.split())
+        if self.normalize_case:
+            key = key.lower()
+        if key == text:
+            return key, None
+
+        index_map = []
+        pending_space = False
+        for idx, char in enumerate(text):
+            if self.normalize_whitespace and char.isspace():
+                pending_space = bool(index_map)
+                continue
+            if pending_space:
+                index_map.append(idx - 1)
+                pending_space = False
+            chars = char.lower() if self.normalize_case else char
+            # Некоторые символы при lower() превращаются в несколько
+            index_map.extend([idx] * len(chars))
+        return key, index_map
+
+    @staticmethod
+    def remap(entities: List[Dict[str, Any]], index_map: Optional[List[int]]) -> List[Dict[str, Any]]:
+        """Перевод позиций сущностей из нормализованного ключа в исходный текст"""
+        if index_map is None:
+            return entities
+        return [
+            {
+                'start_index': index_map[entity['start_index']],
+                'end_index': index_map[entity['end_index'] - 1] + 1,
+                'entity': entity['entity']
+            }
+            for entity in entities
+        ]
+
+    @staticmethod
+    def _entry_size(key: str, entities: List[Dict[str, Any]]) -> int:
+        """Оценка размера записи в байтах"""
+        return sys.getsizeof(key) + sys.getsizeof(entities) + len(entities) * _ENTITY_SIZE
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """Получить результат по ключу: L1, затем общий кеш; обновляет позицию в LRU"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            entities, size, expires_at = entry
+            if expires_at and expires_at < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics_collector.record_cache("hit")
+                return entities
+
+        self.misses += 1
+        if self.shared is None:
+            metrics_collector.record_cache("miss")
+            return None
+
+        # Результат, посчитанный другим worker'ом, поднимается в L1
+        entities = self.shared.get(key)
+        if entities is not None:
+            self._put_local(key, entities)
+        metrics_collector.record_cache("shared_hit" if entities is not None else "miss")
+        return entities
+
+    def __contains__(self, key: str) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and not (entry[2] and entry[2] < time.monotonic())
+
+    def put(self, key: str, entities: List[Dict[str, Any]]):
+        """Сохранить результат в L1 и в общий кеш"""
+        self._put_local(key, entities)
+        if self.shared is not None:
+            self.shared.put(key, entities)
+
+    def _put_local(self, key: str, entities: List[Dict[str, Any]]):
+        """Сохранить результат в L1 с вытеснением наименее давно использованных записей"""
+        size = self._entry_size(key, entities)
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds > 0 else 0.0
+        self._entries[key] = (entities, size, expires_at)
+        self.bytes_used += size
+
+        while len(self._entries) > self.max_entries or self.bytes_used > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self.bytes_used -= size
+
+    def clear(self):
+        """Очистка кеша обоих уровней (счётчики сохраняются)"""
+        self._entries.clear()
+        self.bytes_used = 0
+        if self.shared is not None:
+            self.shared.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика кеша"""
+        lookups = self.hits + self.misses
+        stats = {
+            "cache_size": len(self._entries),
+            "max_cache_size": self.max_entries,
+            "bytes_used": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+        if self.shared is not None:
+            stats["shared"] = self.shared.stats()
+        return stats
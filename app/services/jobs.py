@@ -0,0 +1,179 @@
+"""
+Асинхронные задания на разметку больших батчей
+
+Клиент отправляет батч и сразу получает id задания, затем опрашивает прогресс
+и забирает готовую часть результатов. Задания обрабатываются в фоне небольшими
+частями с фоновым приоритетом планировщика и уступают модель интерактивным
+запросам /api/predict и батчам.
+"""
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+from ..core.config import settings
+from ..core.logging import app_logger
+from .prediction import prediction_service
+from .scheduler import BACKGROUND
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class Job:
+    """Задание: тексты, готовые результаты (префикс списка) и состояние"""
+
+    def __init__(self, texts: List[str]):
+        self.id = uuid.uuid4().hex
+        self.texts = texts
+        self.total = len(texts)
+        self.results: List[List[Dict[str, Any]]] = []
+        self.status = QUEUED
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def processed(self) -> int:
+        return len(self.results)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (COMPLETED, FAILED, CANCELLED)
+
+    def info(self) -> Dict[str, Any]:
+        """Состояние задания для API"""
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "processed": self.processed,
+            "progress": self.processed / self.total if self.total else 1.0,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+
+class JobManager:
+    """Очередь заданий с фоновой обработкой по частям"""
+
+    def __init__(self, chunk_size: int = 64, max_jobs: int = 100, max_items: int = 1000000,
+                 result_ttl: float = 3600.0):
+        self.chunk_size = chunk_size
+        self.max_jobs = max_jobs
+        self.max_items = max_items
+        self.result_ttl = result_ttl
+
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_task = None
+        self._worker_loop = None
+
+    def _ensure_worker(self):
+        """Запуск фоновой обработки в текущем event loop"""
+        loop = asyncio.get_running_loop()
+        if self._worker_loop is loop and self._worker_task is not None and not self._worker_task.done():
+            return
+
+        self._queue = asyncio.Queue()
+        # Задания старого event loop'а ставятся в очередь заново
+        for job in self._jobs.values():
+            if not job.finished:
+                job.status = QUEUED
+                self._queue.put_nowait(job)
+        self._worker_loop = loop
+        self._worker_task = loop.create_task(self._worker())
+
+    def submit(self, texts: List[str]) -> Job:
+        """Постановка задания в очередь"""
+        self._cleanup()
+        if len(texts) > self.max_items:
+            raise ValueError(f"Слишком большое задание: {len(texts)} текстов, максимум {self.max_items}")
+        if len(self._jobs) >= self.max_jobs:
+            raise OverflowError(f"Достигнут лимит заданий: {self.max_jobs}")
+
+        self._ensure_worker()
+        job = Job(texts)
+        self._jobs[job.id] = job
+        self._queue.put_nowait(job)
+        app_logger.info(f"Задание {job.id} поставлено в очередь: {job.total} текстов")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._cleanup()
+        return self._jobs.get(job_id)
+
+    def delete(self, job_id: str) -> bool:
+        """Отмена задания и удаление его результатов"""
+        job = self._jobs.pop(job_id, None)
+        if job is None:
+            return False
+        if not job.finished:
+            job.status = CANCELLED
+            job.finished_at = time.time()
+        return True
+
+    def _cleanup(self):
+        """Удаление завершённых заданий старше result_ttl"""
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and now - job.finished_at > self.result_ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    async def _worker(self):
+        """Обработка заданий по очереди, часть за частью"""
+        while True:
+            job = await self._queue.get()
+            if job.finished:
+                continue
+
+            job.status = RUNNING
+            job.started_at = job.started_at or time.time()
+            try:
+                while job.processed < job.total and job.status == RUNNING:
+                    chunk = job.texts[job.processed:job.processed + self.chunk_size]
+                    results = await prediction_service.batch_predict(chunk, priority=BACKGROUND, admission=False)
+                    if job.status == RUNNING:
+                        job.results.extend(results)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job.status = FAILED
+                job.error = f"{type(e).__name__}: {str(e)}"
+                app_logger.error(f"Задание {job.id} завершилось ошибкой: {job.error}")
+            else:
+                if job.status == RUNNING:
+                    job.status = COMPLETED
+                    app_logger.info(f"Задание {job.id} выполнено: {job.total} текстов")
+            if job.finished_at is None:
+                job.finished_at = time.time()
+            # Тексты больше не нужны - храним только результаты
+            job.texts = []
+
+    async def stop(self):
+        """Остановка фоновой обработки"""
+        if self._worker_task is not None and not self._worker_task.done():
+            self._worker_task.cancel()
+            try:
+                await self._worker_task
+            except asyncio.CancelledError:
+                pass
+        self._worker_task = None
+
+
+# Глобальный менеджер заданий
+job_manager = JobManager(
+    chunk_size=settings.job_chunk_size,
+    max_jobs=settings.job_max_jobs,
+    max_items=settings.job_max_items,
+    result_ttl=settings.job_result_ttl
+)
@@ -1,105 +1,443 @@
 """
 Сбор метрик приложения
+
+Время ответа и ожидания в очереди пишется в гистограммы с логарифмическими
+корзинами фиксированного размера: запись - инкремент счётчика, перцентиль -
+проход по корзинам, без хранения и сортировки отдельных замеров. Перцентили
+считаются за скользящее окно из нескольких интервалов, RPS и история за последние
+минуты - по кольцевому буферу посекундной статистики. Сборщик обновляется только
+из event loop, поэтому обходится без блокировок. Все события также передаются
+в экспортер Prometheus (app/monitoring/prometheus.py).
 """
 import time
-import asyncio
-from typing import Dict, Any
-from collections import defaultdict, deque
+import math
+from bisect import bisect_left
+from typing import Dict, Any, List, Optional
+from collections import defaultdict
+from ..core.config import settings
 from ..core.logging import metrics_logger
+from ..monitoring.prometheus import prometheus_exporter
+
+
+class LatencyHistogram:
+    """
+    Гистограмма времени (секунды) с логарифмическими корзинами: корзина i >= 1
+    покрывает [min_value * growth^(i-1), min_value * growth^i), относительная ошибка
+    перцентиля не больше (growth - 1) / 2. Корзина 0 - значения до min_value,
+    последняя - от max_value
+    """
+
+    def __init__(self, min_value: float = 1e-5, max_value: float = 1e3, growth: float = 1.04):
+        self.min_value = min_value
+        self.growth = growth
+        self._log_min = math.log(min_value)
+        self._log_growth = math.log(growth)
+        self.size = int(math.ceil((math.log(max_value) - self._log_min) / self._log_growth)) + 2
+        self.counts = [0] * self.size
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, value: float):
+        if value <= self.min_value:
+            index = 0
+        else:
+            index = min(int((math.log(value) - self._log_min) / self._log_growth) + 1, self.size - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: "LatencyHistogram"):
+        """Добавление замеров другой гистограммы с теми же корзинами"""
+        counts = self.counts
+        for index, count in enumerate(other.counts):
+            if count:
+                counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def clear(self):
+        self.counts = [0] * self.size
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def quantile(self, q: float) -> float:
+        """Перцентиль q (0..1): середина корзины в геометрической шкале, в пределах [min, max]"""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                break
+        # Крайние корзины не ограничены - для них известны только min и max
+        if index == 0:
+            return self.min
+        if index == self.size - 1:
+            return self.max
+        value = self.min_value * self.growth ** (index - 0.5)
+        return min(max(value, self.min), self.max)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class WindowedHistogram:
+    """
+    Гистограмма за скользящее окно window секунд: slots гистограмм по интервалу
+    window / slots, устаревший интервал очищается при первой записи в новый.
+    Окно покрывает текущий интервал и slots - 1 предыдущих
+    """
+
+    def __init__(self, window: float, slots: int):
+        self.slots = slots
+        self.interval = window / slots
+        self._histograms = [LatencyHistogram() for _ in range(slots)]
+        self._epochs = [-1] * slots
+
+    def record(self, value: float, now: Optional[float] = None):
+        epoch = int((time.monotonic() if now is None else now) // self.interval)
+        slot = epoch % self.slots
+        if self._epochs[slot] != epoch:
+            self._histograms[slot].clear()
+            self._epochs[slot] = epoch
+        self._histograms[slot].record(value)
+
+    def snapshot(self, now: Optional[float] = None) -> LatencyHistogram:
+        """Сумма интервалов окна"""
+        epoch = int((time.monotonic() if now is None else now) // self.interval)
+        merged = LatencyHistogram()
+        for slot_epoch, histogram in zip(self._epochs, self._histograms):
+            if epoch - self.slots < slot_epoch <= epoch:
+                merged.merge(histogram)
+        return merged
+
+    def span(self, now: Optional[float] = None) -> float:
+        """Длительность окна (секунды): полные прошлые интервалы и прошедшая часть текущего"""
+        now = time.monotonic() if now is None else now
+        return (self.slots - 1) * self.interval + now % self.interval
+
+
+# Верхние границы корзин времени ответа в посекундном ряду (секунды), последняя
+# корзина - выше LATENCY_BUCKETS[-1]
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def bucket_quantile(buckets: List[int], q: float) -> float:
+    """Перцентиль q по корзинам LATENCY_BUCKETS с линейной интерполяцией внутри корзины (секунды)"""
+    total = sum(buckets)
+    if not total:
+        return 0.0
+    rank = q * total
+    seen = 0
+    for index, count in enumerate(buckets):
+        if count and seen + count >= rank:
+            lower = LATENCY_BUCKETS[index - 1] if index else 0.0
+            if index == len(LATENCY_BUCKETS):
+                return lower
+            return lower + (LATENCY_BUCKETS[index] - lower) * (rank - seen) / count
+        seen += count
+    return LATENCY_BUCKETS[-1]
+
+
+class SecondSeries:
+    """
+    Кольцевой буфер посекундной статистики запросов за последние size секунд:
+    количество, ошибки, суммарное время и корзины LATENCY_BUCKETS. Строка секунды
+    очищается при первой записи в неё, память выделяется один раз
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._seconds = [-1] * size
+        self._requests = [0] * size
+        self._errors = [0] * size
+        self._latency = [0.0] * size
+        self._buckets = [[0] * (len(LATENCY_BUCKETS) + 1) for _ in range(size)]
+
+    def record(self, response_time: float, success: bool, now: Optional[float] = None):
+        second = int(time.time() if now is None else now)
+        slot = second % self.size
+        if self._seconds[slot] != second:
+            self._seconds[slot] = second
+            self._requests[slot] = 0
+            self._errors[slot] = 0
+            self._latency[slot] = 0.0
+            buckets = self._buckets[slot]
+            for index in range(len(buckets)):
+                buckets[index] = 0
+        self._requests[slot] += 1
+        if not success:
+            self._errors[slot] += 1
+        self._latency[slot] += response_time
+        self._buckets[slot][bisect_left(LATENCY_BUCKETS, response_time)] += 1
+
+    def _slots(self, seconds: int, now: Optional[float]):
+        """(секунда, строка буфера или None) за последние seconds секунд, включая текущую"""
+        last = int(time.time() if now is None else now)
+        for second in range(last - min(seconds, self.size) + 1, last + 1):
+            slot = second % self.size
+            yield second, slot if self._seconds[slot] == second else None
+
+    def count(self, seconds: int, now: Optional[float] = None) -> int:
+        """Запросов за последние seconds секунд, включая текущую"""
+        return sum(self._requests[slot] for _, slot in self._slots(seconds, now) if slot is not None)
+
+    def history(self, seconds: int, now: Optional[float] = None) -> Dict[str, List]:
+        """Ряды по секундам за последние seconds секунд (время в мс); секунды без запросов - нули"""
+        empty = [0] * (len(LATENCY_BUCKETS) + 1)
+        series = {
+            "timestamps": [], "requests": [], "errors": [], "average_response_time": [],
+            "p50_response_time": [], "p99_response_time": [], "latency_buckets": []
+        }
+        for second, slot in self._slots(seconds, now):
+            requests = self._requests[slot] if slot is not None else 0
+            buckets = self._buckets[slot] if slot is not None else empty
+            series["timestamps"].append(second)
+            series["requests"].append(requests)
+            series["errors"].append(self._errors[slot] if slot is not None else 0)
+            series["average_response_time"].append(self._latency[slot] / requests * 1000 if requests else 0.0)
+            series["p50_response_time"].append(bucket_quantile(buckets, 0.5) * 1000)
+            series["p99_response_time"].append(bucket_quantile(buckets, 0.99) * 1000)
+            series["latency_buckets"].append(list(buckets))
+        return series
+
+
+def _summary(histogram: LatencyHistogram) -> Dict[str, float]:
+    """Сводка гистограммы времени ответа в миллисекундах"""
+    return {
+        "count": histogram.count,
+        "avg": histogram.mean * 1000,
+        "p50": histogram.quantile(0.5) * 1000,
+        "p90": histogram.quantile(0.9) * 1000,
+        "p99": histogram.quantile(0.99) * 1000,
+        "max": histogram.max * 1000
+    }
+
 
 class MetricsCollector:
     """Сборщик метрик приложения"""
-    
-    def __init__(self, window_size: int = 1000):
-        self.window_size = window_size
-        self.request_times = deque(maxlen=window_size)
+
+    def __init__(self, window_seconds: float = 60.0, window_slots: int = 12, history_seconds: int = 600,
+                 rps_window: int = 10):
+        self.window_seconds = window_seconds
+        self.window_slots = window_slots
+        self.history_seconds = history_seconds
+        self.rps_window = rps_window
         self.request_count = 0
         self.success_count = 0
         self.error_count = 0
         self.start_time = time.time()
-        self._lock = asyncio.Lock()
-        
-        # Детальные метрики
-        self.response_times_by_endpoint = defaultdict(lambda: deque(maxlen=100))
+        self._start_monotonic = time.monotonic()
+
+        # Время ответа за окно: всего и по endpoint (шаблон пути роута)
+        self.response_times = self._window()
+        self.response_times_by_endpoint: Dict[str, WindowedHistogram] = {}
+        self.requests_by_endpoint = defaultdict(int)
         self.error_types = defaultdict(int)
-        
-    async def record_request(self, endpoint: str, response_time: float, success: bool, error_type: str = None):
+        # Посекундная статистика за последние history_seconds
+        self.series = SecondSeries(history_seconds)
+
+        # Метрики батчинга
+        self.batch_count = 0
+        self.batched_items = 0
+        self.batch_sizes = defaultdict(int)
+        self.queue_depth = 0
+
+        # Время ожидания в очереди планировщика по классам приоритета
+        self.queue_times_by_priority: Dict[str, WindowedHistogram] = {}
+        # Время этапов инференса (app/monitoring/stages.py): на батч или на ответ
+        self.stage_times: Dict[str, WindowedHistogram] = {}
+        # Отклонённые контролем допуска запросы: "класс:причина" -> количество
+        self.shed_counts = defaultdict(int)
+
+    def _window(self) -> WindowedHistogram:
+        return WindowedHistogram(self.window_seconds, self.window_slots)
+
+    def record_request(self, endpoint: str, response_time: float, success: bool, error_type: str = None,
+                       method: str = "GET", status_code: Optional[int] = None):
         """Записать метрики запроса"""
-        async with self._lock:
-            self.request_times.append(response_time)
-            self.response_times_by_endpoint[endpoint].append(response_time)
-            self.request_count += 1
-            
-            if success:
-                self.success_count += 1
-            else:
-                self.error_count += 1
-                if error_type:
-                    self.error_types[error_type] += 1
-    
-    def get_metrics(self) -> Dict[str, Any]:
-        """Получить текущие метрики"""
-        current_time = time.time()
-        uptime = current_time - self.start_time
-        
-        # Среднее время ответа
-        avg_response_time = (
-            sum(self.request_times) / len(self.request_times) * 1000 
-            if self.request_times else 0.0
+        now = time.monotonic()
+        self.response_times.record(response_time, now)
+        histogram = self.response_times_by_endpoint.get(endpoint)
+        if histogram is None:
+            histogram = self.response_times_by_endpoint[endpoint] = self._window()
+        histogram.record(response_time, now)
+        self.requests_by_endpoint[endpoint] += 1
+        self.request_count += 1
+        self.series.record(response_time, success)
+        prometheus_exporter.observe_request(
+            endpoint, method, status_code if status_code is not None else (200 if success else 500), response_time
         )
-        
-        # RPS за последние секунды
-        recent_requests = [
-            t for t in self.request_times 
-            if current_time - t <= 1.0
-        ]
-        rps = len(recent_requests) if recent_requests else 0.0
-        
-        # P95 время ответа
-        if self.request_times:
-            sorted_times = sorted(self.request_times)
-            p95_index = int(len(sorted_times) * 0.95)
-            p95_response_time = sorted_times[p95_index] * 1000 if p95_index < len(sorted_times) else 0.0
+
+        if success:
+            self.success_count += 1
         else:
-            p95_response_time = 0.0
-        
+            self.error_count += 1
+            if error_type:
+                self.error_types[error_type] += 1
+
+    def record_batch(self, batch_size: int, queue_depth: int):
+        """Записать размер отправленного в модель батча и остаток очереди"""
+        self.batch_count += 1
+        self.batched_items += batch_size
+        self.batch_sizes[batch_size] += 1
+        self.queue_depth = queue_depth
+        prometheus_exporter.observe_batch(batch_size, queue_depth)
+
+    def record_queue_time(self, priority: str, wait_time: float):
+        """Записать время ожидания части в очереди планировщика"""
+        histogram = self.queue_times_by_priority.get(priority)
+        if histogram is None:
+            histogram = self.queue_times_by_priority[priority] = self._window()
+        histogram.record(wait_time)
+        prometheus_exporter.observe_queue_time(priority, wait_time)
+
+    def record_shed(self, priority: str, reason: str):
+        """Записать запрос, отклонённый контролем допуска (overload, deadline, expired)"""
+        self.shed_counts[f"{priority}:{reason}"] += 1
+        prometheus_exporter.count_shed(priority, reason)
+
+    def record_stage(self, stage: str, seconds: float):
+        """Записать время этапа: tokenize, forward, decode (на батч) или serialize (на ответ)"""
+        histogram = self.stage_times.get(stage)
+        if histogram is None:
+            histogram = self.stage_times[stage] = self._window()
+        histogram.record(seconds)
+        prometheus_exporter.observe_stage(stage, seconds)
+
+    def record_cache(self, result: str):
+        """Записать обращение к кешу предсказаний: hit, shared_hit или miss"""
+        prometheus_exporter.count_cache(result)
+
+    def get_queue_metrics(self) -> Dict[str, Dict[str, float]]:
+        """Время ожидания в очереди по классам приоритета за окно (мс)"""
+        metrics = {}
+        for priority, window in self.queue_times_by_priority.items():
+            histogram = window.snapshot()
+            if not histogram.count:
+                continue
+            metrics[priority] = {
+                "count": histogram.count,
+                "p50": histogram.quantile(0.5) * 1000,
+                "p95": histogram.quantile(0.95) * 1000,
+                "max": histogram.max * 1000
+            }
+        return metrics
+
+    def get_batch_metrics(self) -> Dict[str, Any]:
+        """Метрики батчинга"""
+        return {
+            "queue_depth": self.queue_depth,
+            "batches_total": self.batch_count,
+            "average_batch_size": self.batched_items / max(self.batch_count, 1),
+            "batch_size_distribution": {
+                str(size): count for size, count in sorted(self.batch_sizes.items())
+            }
+        }
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Получить текущие метрики"""
+        now = time.monotonic()
+        uptime = time.time() - self.start_time
+        histogram = self.response_times.snapshot(now)
+
+        # RPS за последние rps_window секунд (в первые секунды работы - за время с запуска)
+        wall_time = time.time()
+        span = min(self.rps_window - 1 + wall_time % 1, now - self._start_monotonic)
+        rps = self.series.count(self.rps_window, wall_time) / span if span > 0 else 0.0
+
         return {
             "total_requests": self.request_count,
             "successful_requests": self.success_count,
             "failed_requests": self.error_count,
-            "average_response_time": avg_response_time,
-            "p95_response_time": p95_response_time,
+            "average_response_time": histogram.mean * 1000,
+            "p50_response_time": histogram.quantile(0.5) * 1000,
+            "p90_response_time": histogram.quantile(0.9) * 1000,
+            "p95_response_time": histogram.quantile(0.95) * 1000,
+            "p99_response_time": histogram.quantile(0.99) * 1000,
             "requests_per_second": rps,
             "uptime_seconds": uptime,
             "error_rate": self.error_count / max(self.request_count, 1) * 100,
-            "error_types": dict(self.error_types)
+            "error_types": dict(self.error_types),
+            "response_time_by_endpoint": self.get_endpoints_metrics(now),
+            "queue_time_by_priority": self.get_queue_metrics(),
+            "stage_time": self.get_stage_metrics(now),
+            "shed_requests": dict(self.shed_counts),
+            **self.get_batch_metrics()
         }
-    
+
+    def get_history(self, seconds: int) -> Dict[str, Any]:
+        """Посекундные ряды запросов, ошибок и времени ответа за последние seconds секунд"""
+        return {
+            "interval": 1.0,
+            "latency_bucket_bounds": [bound * 1000 for bound in LATENCY_BUCKETS],
+            **self.series.history(seconds)
+        }
+
+    def get_stage_metrics(self, now: Optional[float] = None) -> Dict[str, Dict[str, float]]:
+        """Время этапов инференса за окно (мс): count, avg, p50, p90, p99, max"""
+        return {stage: _summary(window.snapshot(now)) for stage, window in self.stage_times.items()}
+
+    def get_endpoints_metrics(self, now: Optional[float] = None) -> Dict[str, Dict[str, float]]:
+        """Время ответа по endpoint за окно (мс): count, avg, p50, p90, p99, max"""
+        return {
+            endpoint: _summary(window.snapshot(now))
+            for endpoint, window in sorted(self.response_times_by_endpoint.items())
+        }
+
     def get_endpoint_metrics(self, endpoint: str) -> Dict[str, Any]:
         """Метрики для конкретного endpoint"""
-        times = self.response_times_by_endpoint[endpoint]
-        if not times:
-            return {"requests": 0, "avg_time": 0.0}
-        
-        avg_time = sum(times) / len(times) * 1000
+        window = self.response_times_by_endpoint.get(endpoint)
+        histogram = window.snapshot() if window is not None else None
+        if not histogram or not histogram.count:
+            return {"requests": self.requests_by_endpoint.get(endpoint, 0), "avg_time": 0.0}
+
         return {
-            "requests": len(times),
-            "avg_time": avg_time,
-            "min_time": min(times) * 1000,
-            "max_time": max(times) * 1000
+            "requests": self.requests_by_endpoint[endpoint],
+            "avg_time": histogram.mean * 1000,
+            "min_time": histogram.min * 1000,
+            "max_time": histogram.max * 1000,
+            "p50_time": histogram.quantile(0.5) * 1000,
+            "p90_time": histogram.quantile(0.9) * 1000,
+            "p99_time": histogram.quantile(0.99) * 1000
         }
-    
-    async def reset_metrics(self):
+
+    def reset_metrics(self):
         """Сброс метрик"""
-        async with self._lock:
-            self.request_times.clear()
-            self.response_times_by_endpoint.clear()
-            self.request_count = 0
-            self.success_count = 0
-            self.error_count = 0
-            self.error_types.clear()
-            self.start_time = time.time()
-            metrics_logger.info("Метрики сброшены")
+        self.response_times = self._window()
+        self.response_times_by_endpoint.clear()
+        self.requests_by_endpoint.clear()
+        self.request_count = 0
+        self.success_count = 0
+        self.error_count = 0
+        self.error_types.clear()
+        self.series = SecondSeries(self.history_seconds)
+        self.batch_count = 0
+        self.batched_items = 0
+        self.batch_sizes.clear()
+        self.queue_times_by_priority.clear()
+        self.stage_times.clear()
+        self.shed_counts.clear()
+        self.start_time = time.time()
+        self._start_monotonic = time.monotonic()
+        metrics_logger.info("Метрики сброшены")
 
 # Глобальный сборщик метрик
-metrics_collector = MetricsCollector()
\ No newline at end of file
+metrics_collector = MetricsCollector(
+    window_seconds=settings.metrics_window_seconds,
+    window_slots=settings.metrics_window_slots,
+    history_seconds=settings.metrics_history_seconds,
+    rps_window=settings.metrics_rps_window
+)
@@ -3,80 +3,335 @@
 """
 import asyncio
 import time
-from typing import List, Dict, Any, Optional
-from collections import deque
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
 from ..models.ner_model import ner_model
+from ..core.config import settings
 from ..core.logging import app_logger
+from ..monitoring.stages import batch_stages
+from .worker_pool import worker_pool
+from .cache import PredictionCache, create_shared_cache
+from .scheduler import InferenceScheduler, PriorityClass, OverloadedError, DeadlineExceeded, INTERACTIVE, BULK, BACKGROUND
 
 class PredictionService:
     """Сервис для обработки предсказаний с поддержкой батчинга"""
-    
-    def __init__(self, batch_size: int = 32, max_wait_time: float = 0.01):
+
+    def __init__(self, batch_size: int = 32, max_wait_time: float = 0.01, bulk_batch_size: int = 128,
+                 max_inflight_batches: int = 2, cache: Optional[PredictionCache] = None,
+                 bulk_chunk_size: Optional[int] = None, priority_weights: Optional[Dict[str, float]] = None,
+                 reserved_slots: int = 1, max_queue_time: Optional[float] = None):
         self.batch_size = batch_size
         self.max_wait_time = max_wait_time
-        self.pending_requests = deque()
-        self._processing_lock = asyncio.Lock()
-        self._batch_task = None
-        
-        # Простой кеш для частых запросов
-        self.cache = {}
-        self.cache_size = 1000
-        
-    async def predict(self, text: str) -> List[Dict[str, Any]]:
-        """Основной метод для предсказания"""
+        self.bulk_batch_size = bulk_batch_size
+        self.max_inflight_batches = max_inflight_batches
+        # Часть батча в очереди планировщика: между частями проходят интерактивные запросы
+        self.bulk_chunk_size = bulk_chunk_size or bulk_batch_size
+
+        # Планировщик: одиночные запросы собираются в батчи по batch_size / max_wait_time,
+        # батчи и задания идут частями по bulk_chunk_size. Интерактивные запросы и батчи
+        # отклоняются, если оценка ожидания в очереди больше max_queue_time (None - без ограничения)
+        weights = {INTERACTIVE: 8.0, BULK: 2.0, BACKGROUND: 1.0, **(priority_weights or {})}
+        self.scheduler = InferenceScheduler(
+            [
+                PriorityClass(INTERACTIVE, weights[INTERACTIVE], batch_size, max_wait_time, max_queue_time),
+                PriorityClass(BULK, weights[BULK], self.bulk_chunk_size, max_queue_time=max_queue_time),
+                PriorityClass(BACKGROUND, weights[BACKGROUND], self.bulk_chunk_size)
+            ],
+            execute=self._execute,
+            max_inflight=self._max_inflight,
+            reserved_slots=reserved_slots
+        )
+
+        # LRU кеш частых запросов
+        self.cache = cache if cache is not None else PredictionCache()
+
+        # Single-flight: ключ -> future уже выполняющегося предсказания и самый поздний
+        # дедлайн ожидающих его запросов (None - кто-то ждёт без дедлайна)
+        self._inflight_keys: Dict[str, asyncio.Future] = {}
+        self._flight_deadlines: Dict[str, Optional[float]] = {}
+        self.deduplicated_requests = 0
+
+    async def predict(self, text: str, deadline: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Основной метод для предсказания. deadline - момент по time.monotonic(), к которому
+        нужен результат; OverloadedError, если сервис не успеет или перегружен
+        """
         if not text.strip():
             return []
-        
-        # Проверка кеша
-        if text in self.cache:
+
+        # Проверка кеша по нормализованному ключу; позиции переводятся обратно в исходный текст
+        key, index_map = self.cache.normalize(text)
+        entities = self.cache.get(key)
+        if entities is not None:
             app_logger.debug(f"Cache hit for text: {text[:50]}...")
-            return self.cache[text]
-        
-        # Для обеспечения 20+ RPS используем прямое предсказание без батчинга
-        # так как батчинг может добавить задержку
+            return self.cache.remap(entities, index_map)
+
+        # Запрос ставится в интерактивную очередь и объединяется с параллельными запросами в один батч
+        loop = asyncio.get_running_loop()
+        future, owner = self._claim(key, loop, deadline)
+        if owner:
+            self._admit([key], INTERACTIVE, deadline)
+            self._schedule([key], INTERACTIVE, deadline)
+
         try:
-            entities = await ner_model.predict(text)
-            
-            # Кеширование результата
-            if len(self.cache) >= self.cache_size:
-                # Удаляем старейший элемент (FIFO)
-                oldest_key = next(iter(self.cache))
-                del self.cache[oldest_key]
-            
-            self.cache[text] = entities
-            return entities
-            
+            entities = await self._wait(future, INTERACTIVE, deadline)
+            return self.cache.remap(entities, index_map)
+        except OverloadedError:
+            raise
         except Exception as e:
             app_logger.error(f"Ошибка предсказания: {str(e)}")
             raise
-    
-    async def batch_predict(self, texts: List[str]) -> List[List[Dict[str, Any]]]:
-        """Батчевое предсказание для множества текстов"""
+
+    def _admit(self, keys: List[str], priority: str, deadline: Optional[float]):
+        """Контроль допуска для ключей, которыми владеет вызывающий; при отказе ключи освобождаются"""
+        try:
+            self.scheduler.admit(len(keys), priority, deadline)
+        except OverloadedError as e:
+            for key in keys:
+                self._settle(key, error=e)
+            raise
+
+    def _schedule(self, keys: List[str], priority: str, deadline: Optional[float] = None):
+        """Постановка ключей, которыми владеет вызывающий, в очередь планировщика"""
+        unit = self.scheduler.submit(keys, priority, deadline)
+        unit.add_done_callback(lambda unit: self._complete(keys, unit, priority, deadline))
+
+    def _complete(self, keys: List[str], unit: asyncio.Future, priority: str, deadline: Optional[float]):
+        """Кеширование результатов части и раздача ожидающим"""
+        error = unit.exception() if not unit.cancelled() else asyncio.CancelledError()
+        if error is not None:
+            # Дедлайн части - дедлайн запроса, который её поставил. Ключи, которые ждут и
+            # запросы с более поздним дедлайном или без него, ставятся в очередь заново
+            retry: Dict[Optional[float], List[str]] = {}
+            for key in keys:
+                latest = self._flight_deadlines.get(key, deadline)
+                if (isinstance(error, DeadlineExceeded) and key in self._inflight_keys
+                        and (latest is None or (deadline is not None and latest > deadline))):
+                    retry.setdefault(latest, []).append(key)
+                else:
+                    self._settle(key, error=error)
+            for latest, retry_keys in retry.items():
+                self._schedule(retry_keys, priority, latest)
+            return
+
+        for key, entities in zip(keys, unit.result()):
+            self.cache.put(key, entities)
+            self._settle(key, entities)
+
+    async def _execute(self, texts: List[str]) -> List[List[Dict[str, Any]]]:
+        """Один проход модели для батча планировщика"""
+        return await self._runner().predict_batch(texts, timings=batch_stages.get())
+
+    def _claim(self, key: str, loop: asyncio.AbstractEventLoop,
+               deadline: Optional[float] = None) -> Tuple[asyncio.Future, bool]:
+        """
+        Future для ключа: уже выполняющийся (owner=False) или новый (owner=True),
+        который обязан выполнить и завершить через _settle вызывающий.
+        deadline вызывающего продлевает дедлайн общего предсказания
+        """
+        future = self._inflight_keys.get(key)
+        if future is not None and not future.done() and future.get_loop() is loop:
+            self.deduplicated_requests += 1
+            latest = self._flight_deadlines.get(key)
+            if latest is not None:
+                self._flight_deadlines[key] = None if deadline is None else max(latest, deadline)
+            return future, False
+
+        future = loop.create_future()
+        self._inflight_keys[key] = future
+        self._flight_deadlines[key] = deadline
+        return future, True
+
+    async def _wait(self, future: asyncio.Future, priority: str, deadline: Optional[float]):
+        """
+        Ожидание общего результата не дольше своего дедлайна: истёкший дедлайн одного
+        запроса не завершает ожидание остальных
+        """
+        # shield: отмена одного клиента не отменяет общий результат для остальных
+        shielded = asyncio.shield(future)
+        if deadline is None:
+            return await shielded
+        try:
+            return await asyncio.wait_for(shielded, max(deadline - time.monotonic(), 0.0))
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("Дедлайн истёк в ожидании результата",
+                                   retry_after=self.scheduler.estimated_wait(priority))
+
+    def _settle(self, key: str, entities: Optional[List[Dict[str, Any]]] = None,
+                error: Optional[BaseException] = None):
+        """Завершение выполняющегося предсказания для всех ожидающих его запросов"""
+        future = self._inflight_keys.pop(key, None)
+        self._flight_deadlines.pop(key, None)
+        if future is None or future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+            # Ожидающих может не быть - не логируем "exception was never retrieved"
+            future.exception()
+        else:
+            future.set_result(entities)
+
+    def _runner(self):
+        """Исполнитель батчей: пул процессов инференса, если готов, иначе модель в процессе"""
+        return worker_pool if worker_pool.is_ready() else ner_model
+
+    def _max_inflight(self) -> int:
+        """Лимит одновременно выполняемых батчей для текущего исполнителя"""
+        return worker_pool.max_inflight_batches if worker_pool.is_ready() else self.max_inflight_batches
+
+    @property
+    def queue_depth(self) -> int:
+        """Количество текстов, ожидающих модели"""
+        return self.scheduler.queue_depth
+
+    async def stop(self):
+        """Остановка планировщика"""
+        await self.scheduler.stop()
+
+    async def batch_predict(self, texts: List[str], priority: str = BULK, deadline: Optional[float] = None,
+                            admission: bool = True) -> List[List[Dict[str, Any]]]:
+        """
+        Батчевое предсказание для множества текстов (priority - класс планировщика).
+        При admission=True батч целиком проходит контроль допуска (OverloadedError)
+        """
         if not texts:
             return []
-        
-        results = []
-        for text in texts:
-            try:
-                entities = await self.predict(text)
-                results.append(entities)
-            except Exception as e:
-                app_logger.error(f"Ошибка в батчевом предсказании: {str(e)}")
-                results.append([])
-        
+
+        loop = asyncio.get_running_loop()
+        results = [None] * len(texts)
+        index_maps = [None] * len(texts)
+        # Позиции каждого уникального ключа в запросе: повторы считаются один раз
+        positions: Dict[str, List[int]] = {}
+        for i, text in enumerate(texts):
+            if not text.strip():
+                results[i] = []
+                continue
+
+            key, index_maps[i] = self.cache.normalize(text)
+            if key in positions:
+                positions[key].append(i)
+                self.deduplicated_requests += 1
+                continue
+
+            entities = self.cache.get(key)
+            if entities is not None:
+                results[i] = self.cache.remap(entities, index_maps[i])
+            else:
+                positions[key] = [i]
+
+        # Ключи, которые уже считаются другими запросами, не отправляются в модель повторно
+        owned_keys = []
+        futures = {}
+        for key in positions:
+            futures[key], owner = self._claim(key, loop, deadline)
+            if owner:
+                owned_keys.append(key)
+
+        if owned_keys and admission:
+            self._admit(owned_keys, priority, deadline)
+
+        # Промахи кеша ставятся в очередь планировщика частями по bulk_chunk_size текстов
+        for start in range(0, len(owned_keys), self.bulk_chunk_size):
+            self._schedule(owned_keys[start:start + self.bulk_chunk_size], priority, deadline)
+
+        outcomes = await asyncio.gather(
+            *(self._wait(futures[key], priority, deadline) for key in positions),
+            return_exceptions=True
+        )
+        owned = set(owned_keys)
+        for key, outcome in zip(positions, outcomes):
+            # Отказ по перегрузке или своему дедлайну относится ко всему батчу; отказ
+            # общего ключа, который поставил другой запрос, - только к этому тексту
+            if isinstance(outcome, OverloadedError) and (key in owned or deadline is not None):
+                raise outcome
+            if isinstance(outcome, BaseException):
+                app_logger.error(f"Ошибка в батчевом предсказании: {str(outcome)}")
+                outcome = []
+            for i in positions[key]:
+                results[i] = self.cache.remap(outcome, index_maps[i])
+
         return results
-    
+
+    async def stream_predict(self, items: AsyncIterator[Tuple[Any, Optional[str]]],
+                             max_pending_chunks: int = 4) -> AsyncIterator[List[Tuple[Any, Optional[List[Dict[str, Any]]]]]]:
+        """
+        Потоковое батчевое предсказание для пар (метаданные, текст).
+        Входные пары читаются частями по bulk_batch_size; одновременно в работе не больше
+        max_pending_chunks частей, поэтому память не зависит от длины потока, а медленный
+        потребитель останавливает чтение входа. Части отдаются в порядке входа.
+        Пары с текстом None пропускаются через поток без предсказания.
+        """
+        chunks = asyncio.Queue(maxsize=max(max_pending_chunks, 1))
+
+        async def predict_chunk(chunk):
+            # Поток ограничен скоростью модели сам (max_pending_chunks) - без контроля допуска
+            predictions = iter(await self.batch_predict([text for _, text in chunk if text is not None],
+                                                        admission=False))
+            return [(meta, None if text is None else next(predictions)) for meta, text in chunk]
+
+        async def read():
+            chunk = []
+            async for item in items:
+                chunk.append(item)
+                if len(chunk) >= self.bulk_batch_size:
+                    await chunks.put(asyncio.ensure_future(predict_chunk(chunk)))
+                    chunk = []
+            if chunk:
+                await chunks.put(asyncio.ensure_future(predict_chunk(chunk)))
+            await chunks.put(None)
+
+        reader = asyncio.create_task(read())
+        try:
+            while True:
+                getter = asyncio.ensure_future(chunks.get())
+                # Ошибка чтения входа не должна оставить потребителя ждать бесконечно
+                await asyncio.wait({getter, reader}, return_when=asyncio.FIRST_COMPLETED)
+                if reader.done() and reader.exception() is not None:
+                    getter.cancel()
+                    raise reader.exception()
+                task = await getter
+                if task is None:
+                    break
+                yield await task
+        finally:
+            reader.cancel()
+            while not chunks.empty():
+                task = chunks.get_nowait()
+                if task is not None:
+                    task.cancel()
+
     def clear_cache(self):
         """Очистка кеша"""
         self.cache.clear()
         app_logger.info("Кеш очищен")
-    
+
     def get_cache_stats(self) -> Dict[str, Any]:
         """Статистика кеша"""
-        return {
-            "cache_size": len(self.cache),
-            "max_cache_size": self.cache_size
-        }
+        stats = self.cache.stats()
+        stats["inflight"] = len(self._inflight_keys)
+        stats["deduplicated_requests"] = self.deduplicated_requests
+        return stats
 
 # Глобальный экземпляр сервиса
-prediction_service = PredictionService()
\ No newline at end of file
+prediction_service = PredictionService(
+    batch_size=settings.batch_size,
+    max_wait_time=settings.max_wait_time,
+    bulk_batch_size=settings.bulk_batch_size,
+    max_inflight_batches=settings.max_inflight_batches,
+    bulk_chunk_size=settings.scheduler_chunk_size,
+    priority_weights=settings.scheduler_weights,
+    reserved_slots=settings.scheduler_reserved_slots,
+    max_queue_time=settings.admission_max_queue_time or None,
+    cache=PredictionCache(
+        max_entries=settings.cache_max_entries,
+        max_bytes=settings.cache_max_bytes,
+        ttl_seconds=settings.cache_ttl_seconds,
+        normalize_whitespace=settings.cache_normalize_whitespace,
+        normalize_case=settings.cache_normalize_case,
+        shared=create_shared_cache(
+            settings.shared_cache_backend,
+            settings.shared_cache_path,
+            ttl_seconds=settings.cache_ttl_seconds,
+            max_entries=settings.shared_cache_max_entries
+        )
+    )
+)
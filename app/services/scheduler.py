@@ -0,0 +1,361 @@
+"""
+Планировщик инференса с классами приоритета
+
+Все обращения к модели проходят через очередь планировщика. У каждого класса
+(интерактивные запросы, батчи, фоновые задания) своя очередь и вес: освободившийся
+слот инференса получает класс с наименьшим обслуженным объёмом на единицу веса
+(взвешенное справедливое разделение). Батчи ставятся в очередь частями, поэтому
+одиночные запросы проходят между частями большого батча, а не ждут его целиком.
+
+Контроль допуска: по измеренной стоимости батча модели и объёму работы в очереди
+оценивается ожидание нового запроса. Запрос, который не уложится в свой
+дедлайн или в max_queue_time класса, отклоняется сразу (OverloadedError), а части
+с истёкшим дедлайном снимаются с очереди при сборке батча, не занимая модель.
+"""
+import math
+import time
+import asyncio
+from collections import deque
+from typing import List, Dict, Any, Optional, Tuple, Callable, Awaitable
+from .metrics import metrics_collector
+from ..monitoring.stages import request_stages, batch_stages, add_stages
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+BACKGROUND = "background"
+
+
+class OverloadedError(Exception):
+    """Запрос отклонён контролем допуска; retry_after - через сколько секунд повторить"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class DeadlineExceeded(OverloadedError):
+    """Запрос не укладывается в свой дедлайн"""
+
+
+class PriorityClass:
+    """Класс приоритета: очередь частей, вес и правила сборки батча"""
+
+    def __init__(self, name: str, weight: float, max_batch: int, max_wait: float = 0.0,
+                 max_queue_time: Optional[float] = None):
+        self.name = name
+        self.weight = weight
+        # Максимум текстов в одном батче класса
+        self.max_batch = max_batch
+        # Ожидание заполнения батча с момента постановки первой части (секунды)
+        self.max_wait = max_wait
+        # Допустимое оценочное ожидание в очереди (None - класс не отклоняется по загрузке)
+        self.max_queue_time = max_queue_time
+        # Части в очереди: (тексты, future, время постановки, дедлайн по time.monotonic или None)
+        self.queue = deque()
+        self.queued_texts = 0
+        # Обслуженный объём (тексты / вес) - класс с наименьшим значением идёт следующим
+        self.virtual_time = 0.0
+
+
+class InferenceScheduler:
+    """Очереди классов приоритета перед моделью и раздача слотов инференса"""
+
+    def __init__(self, classes: List[PriorityClass],
+                 execute: Callable[[List[str]], Awaitable[List[Any]]],
+                 max_inflight: Callable[[], int], reserved_slots: int = 1, cost_alpha: float = 0.1):
+        # Первый класс - самый приоритетный: ему оставляются reserved_slots слотов
+        self.classes: Dict[str, PriorityClass] = {cls.name: cls for cls in classes}
+        self._order = [cls.name for cls in classes]
+        self._execute = execute
+        self._max_inflight = max_inflight
+        self.reserved_slots = reserved_slots
+
+        self._inflight: Dict[asyncio.Task, str] = {}
+        self._inflight_texts = 0
+        self._virtual_now = 0.0
+
+        # Стоимость батча модели: время = накладные расходы + размер * время на текст,
+        # линейная регрессия по EWMA моментов (размер, время, размер^2, размер*время)
+        self.cost_alpha = cost_alpha
+        self._cost_moments: Optional[List[float]] = None
+        self._last_completion = 0.0
+        # Задержка event loop (EWMA): столько запрос ждёт обработчика и отправки ответа
+        # сверх очереди модели, когда процесс перегружен самим HTTP трафиком
+        self.loop_lag = 0.0
+
+        self._task = None
+        self._lag_task = None
+        self._loop = None
+        self._new_work = None
+
+    def submit(self, texts: List[str], priority: str, deadline: Optional[float] = None) -> asyncio.Future:
+        """
+        Постановка части в очередь класса; future получает результаты для texts.
+        deadline - момент по time.monotonic(), после которого результат уже не нужен
+        """
+        cls = self.classes[priority]
+        loop = asyncio.get_running_loop()
+        self._ensure_task(loop)
+
+        # Класс, простаивавший в очереди, не получает накопленного "кредита"
+        if not cls.queue:
+            cls.virtual_time = max(cls.virtual_time, self._virtual_now)
+
+        future = loop.create_future()
+        # Разбивка по этапам запроса, который ставит часть (если он попал в выборку)
+        cls.queue.append((texts, future, loop.time(), deadline, request_stages.get()))
+        cls.queued_texts += len(texts)
+        self._new_work.set()
+        return future
+
+    def cost_model(self) -> Optional[Tuple[float, float]]:
+        """
+        Накладные расходы на батч и время на текст (секунды); None - ещё нет замеров.
+        Пока размеры батчей почти одинаковы, наклон не определён, и вся стоимость
+        относится к накладным расходам: оценка оптимистична, а малые батчи при слабой
+        нагрузке не занижают пропускную способность
+        """
+        if self._cost_moments is None:
+            return None
+        mean_size, mean_time, mean_size2, mean_size_time = self._cost_moments
+        variance = mean_size2 - mean_size * mean_size
+        per_text = (mean_size_time - mean_size * mean_time) / variance if variance > 0.25 else 0.0
+        overhead = mean_time - per_text * mean_size
+        if per_text < 0:
+            per_text, overhead = 0.0, mean_time
+        if overhead < 0:
+            per_text, overhead = mean_time / mean_size, 0.0
+        return overhead, per_text
+
+    def _work_time(self, texts: int, max_batch: int) -> float:
+        """Оценка времени модели на texts текстов батчами по max_batch"""
+        model = self.cost_model()
+        if model is None or texts <= 0:
+            return 0.0
+        overhead, per_text = model
+        return math.ceil(texts / max_batch) * overhead + texts * per_text
+
+    @property
+    def throughput(self) -> Optional[float]:
+        """Оценка пропускной способности модели на полных батчах (текстов/с); None - ещё нет замеров"""
+        max_batch = max(cls.max_batch for cls in self.classes.values())
+        work_time = self._work_time(max_batch, max_batch)
+        return max_batch / work_time if work_time > 0 else None
+
+    def estimated_wait(self, priority: str) -> float:
+        """
+        Оценка ожидания новой части класса до начала обработки (секунды): работа в модели
+        и в очередях классов с весом не меньше, которые обслуживаются раньше или наравне,
+        плюс задержка event loop
+        """
+        cls = self.classes[priority]
+        ahead = self._inflight_texts + sum(
+            other.queued_texts for other in self.classes.values() if other.weight >= cls.weight
+        )
+        return self._work_time(ahead, cls.max_batch) + self.loop_lag
+
+    def admit(self, size: int, priority: str, deadline: Optional[float] = None):
+        """Контроль допуска: OverloadedError, если size текстов не будут обработаны вовремя"""
+        if self.cost_model() is None:
+            return
+        cls = self.classes[priority]
+        wait = self.estimated_wait(priority)
+
+        if deadline is not None:
+            # До обработчика запрос уже ждал в event loop примерно loop_lag
+            remaining = deadline - time.monotonic() - self.loop_lag
+            expected = wait + self._work_time(size, cls.max_batch)
+            if expected > remaining:
+                metrics_collector.record_shed(priority, "deadline")
+                raise DeadlineExceeded(
+                    f"Запрос не уложится в дедлайн: ожидается {expected * 1000:.0f} мс, "
+                    f"осталось {max(remaining, 0) * 1000:.0f} мс",
+                    retry_after=wait
+                )
+
+        if cls.max_queue_time is not None and wait > cls.max_queue_time:
+            metrics_collector.record_shed(priority, "overload")
+            raise OverloadedError(
+                f"Сервис перегружен: ожидание в очереди {wait:.1f} с, допустимо {cls.max_queue_time:.1f} с",
+                retry_after=wait - cls.max_queue_time
+            )
+
+    def _ensure_task(self, loop: asyncio.AbstractEventLoop):
+        """Запуск диспетчера в текущем event loop"""
+        if self._loop is loop and self._task is not None and not self._task.done():
+            return
+
+        # Event loop сменился (перезапуск приложения, тестовый клиент) -
+        # части из старого цикла уже некому обработать
+        if self._loop is not loop:
+            for cls in self.classes.values():
+                cls.queue = deque(item for item in cls.queue if item[1].get_loop() is loop)
+                cls.queued_texts = sum(len(item[0]) for item in cls.queue)
+            self._inflight = {}
+            self._inflight_texts = 0
+
+        self._loop = loop
+        self._new_work = asyncio.Event()
+        self._task = loop.create_task(self._dispatcher())
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+        self._lag_task = loop.create_task(self._monitor_loop_lag())
+
+    async def _monitor_loop_lag(self, interval: float = 0.05):
+        """Замер задержки event loop: насколько позже срока просыпается таймер"""
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(loop.time() - start - interval, 0.0)
+            self.loop_lag = self.cost_alpha * lag + (1 - self.cost_alpha) * self.loop_lag
+
+    def _pick(self) -> Optional[PriorityClass]:
+        """Класс для следующего батча: непустой, с наименьшим обслуженным объёмом на вес"""
+        max_inflight = self._max_inflight()
+        # Неприоритетные классы не занимают зарезервированные слоты (но хотя бы один слот им доступен)
+        shared_slots = max(max_inflight - self.reserved_slots, 1)
+        others_inflight = sum(1 for name in self._inflight.values() if name != self._order[0])
+
+        candidates = [
+            cls for name, cls in self.classes.items()
+            if cls.queue and (name == self._order[0] or others_inflight < shared_slots)
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda cls: (cls.virtual_time, self._order.index(cls.name)))
+
+    async def _dispatcher(self):
+        """Фоновая задача: выбор класса на свободный слот и сборка батча"""
+        loop = asyncio.get_running_loop()
+        while True:
+            if len(self._inflight) >= self._max_inflight():
+                await asyncio.wait(list(self._inflight), return_when=asyncio.FIRST_COMPLETED)
+                continue
+
+            cls = self._pick()
+            if cls is None:
+                # Ждём новой работы или освобождения слота (_release тоже будит диспетчер)
+                self._new_work.clear()
+                await self._new_work.wait()
+                continue
+
+            # Пока слоты заняты, запросы копятся и следующий батч будет крупнее. Пока в модели
+            # есть батчи, ждём заполнения, но не дольше max_wait с момента первой части;
+            # простаивающая модель получает часть сразу
+            if cls.max_wait > 0 and self._inflight:
+                deadline = cls.queue[0][2] + cls.max_wait
+                while cls.queued_texts < cls.max_batch and self._inflight:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    self._new_work.clear()
+                    try:
+                        await asyncio.wait_for(self._new_work.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+
+            units = []
+            size = 0
+            now = loop.time()
+            now_monotonic = time.monotonic()
+            while cls.queue and (not units or size + len(cls.queue[0][0]) <= cls.max_batch):
+                texts, future, enqueued_at, deadline, stages = cls.queue.popleft()
+                cls.queued_texts -= len(texts)
+                # Ожидающий мог отказаться от результата, пока часть стояла в очереди
+                if future.done():
+                    continue
+                # Часть, которая уже не успеет к дедлайну, снимается, не занимая модель
+                if deadline is not None and deadline < now_monotonic + self._work_time(len(texts), cls.max_batch):
+                    metrics_collector.record_shed(cls.name, "expired")
+                    future.set_exception(DeadlineExceeded(
+                        f"Дедлайн истёк в очереди через {(now - enqueued_at) * 1000:.0f} мс",
+                        retry_after=self.estimated_wait(cls.name)
+                    ))
+                    continue
+                units.append((texts, future, stages))
+                size += len(texts)
+                metrics_collector.record_queue_time(cls.name, now - enqueued_at)
+                add_stages(stages, {"queue": now - enqueued_at})
+
+            if not units:
+                continue
+
+            self._virtual_now = cls.virtual_time
+            cls.virtual_time += size / cls.weight
+            self._inflight_texts += size
+            task = loop.create_task(self._run_batch(units, size))
+            self._inflight[task] = cls.name
+            task.add_done_callback(self._release)
+
+    def _release(self, task: asyncio.Task):
+        self._inflight.pop(task, None)
+        if self._new_work is not None:
+            self._new_work.set()
+
+    def _record_completion(self, size: int, started_at: float):
+        """
+        Замер стоимости батча. Время отсчитывается от начала батча или от завершения
+        предыдущего, если батч ждал его в пуле инференса, поэтому в замер не попадают
+        ни простой между запросами, ни ожидание чужого батча
+        """
+        now = time.monotonic()
+        interval = now - max(started_at, self._last_completion)
+        self._last_completion = now
+        sample = [float(size), interval, float(size * size), size * interval]
+        if self._cost_moments is None:
+            self._cost_moments = sample
+        else:
+            alpha = self.cost_alpha
+            self._cost_moments = [alpha * new + (1 - alpha) * old for new, old in zip(sample, self._cost_moments)]
+
+    async def _run_batch(self, units: List[tuple], size: int):
+        """Один проход модели для частей батча и раздача результатов по частям"""
+        texts = [text for unit_texts, _, _ in units for text in unit_texts]
+        metrics_collector.record_batch(len(texts), self.queue_depth)
+
+        # Исполнитель записывает сюда время этапов батча (задача батча - свой контекст)
+        timings = {}
+        batch_stages.set(timings)
+        started_at = time.monotonic()
+        try:
+            results = await self._execute(texts)
+        except Exception as e:
+            for _, future, _ in units:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._inflight_texts -= size
+
+        self._record_completion(size, started_at)
+        for stage, seconds in timings.items():
+            metrics_collector.record_stage(stage, seconds)
+
+        start = 0
+        for unit_texts, future, stages in units:
+            add_stages(stages, timings)
+            if not future.done():
+                future.set_result(results[start:start + len(unit_texts)])
+            start += len(unit_texts)
+
+    @property
+    def queue_depth(self) -> int:
+        """Тексты во всех очередях"""
+        return sum(cls.queued_texts for cls in self.classes.values())
+
+    def queue_depths(self) -> Dict[str, int]:
+        """Тексты в очереди каждого класса"""
+        return {name: cls.queued_texts for name, cls in self.classes.items()}
+
+    async def stop(self):
+        """Остановка диспетчера"""
+        for task in (self._task, self._lag_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+        self._lag_task = None
@@ -0,0 +1,313 @@
+"""
+Пул процессов инференса с общими весами модели
+
+Фронтовый процесс принимает HTTP запросы и раздаёт батчи N процессам инференса.
+Веса модели переносятся в разделяемую память (share_memory) и передаются
+процессам без копирования, поэтому N процессов не требуют N копий модели в RAM.
+Это верно для бэкенда torch без квантизации: сессии onnx/torchscript и INT8 веса
+создаются в каждом процессе заново.
+
+Завершившийся процесс перестаёт получать батчи, его батчи в работе сразу
+завершаются ошибкой, и процесс перезапускается. Пока готовых процессов нет,
+сервис предсказаний работает с моделью в процессе API.
+"""
+import os
+import time
+import asyncio
+import itertools
+import threading
+from multiprocessing import connection
+from typing import List, Dict, Any, Optional
+import torch
+import torch.multiprocessing as mp
+from ..core.config import settings
+from ..monitoring.profiler import profiler, profiled
+from ..core.logging import app_logger
+
+
+def _worker_main(worker_id: int, model, tokenizer, saved: Dict[str, Any], tags: List[str],
+                 quantized: bool, num_threads: int, requests_queue, results_queue):
+    """Цикл процесса инференса: батч из очереди -> предсказание -> очередь результатов"""
+    from ..models.ner_model import NERModelWrapper, create_backend
+
+    torch.set_num_threads(num_threads)
+
+    wrapper = NERModelWrapper()
+    wrapper.model = model
+    wrapper.tokenizer = tokenizer
+    wrapper.saved = saved
+    wrapper.tags = tags
+    wrapper.device = "cpu"
+    # Сессии onnx/torchscript не передаются между процессами - каждый процесс открывает свою
+    # Квантизация повторяется в процессе: веса в разделяемой памяти остаются fp32
+    wrapper.backend = create_backend(settings.inference_backend, settings.model_path, model, quantized=quantized)
+    wrapper.quantized = quantized
+
+    # Сигнал готовности: импорт и инициализация в spawn-процессе занимают время
+    results_queue.put((None, True, worker_id))
+
+    while True:
+        item = requests_queue.get()
+        if item is None:
+            break
+
+        request_id, texts, profile_batch, torch_trace = item
+        try:
+            # Компактные массивы сущностей дешевле передавать между процессами, чем словари;
+            # во время захвата профиля вместе с ними возвращается профиль батча
+            if profile_batch:
+                payload = profiled(wrapper.predict_batch_arrays, texts, torch_trace=torch_trace)
+            else:
+                payload = (wrapper.predict_batch_arrays(texts), None)
+            results_queue.put((request_id, True, payload))
+        except Exception as e:
+            results_queue.put((request_id, False, f"{type(e).__name__}: {str(e)}"))
+
+
+class InferenceWorkerPool:
+    """Пул процессов инференса с маршрутизацией по глубине очереди"""
+
+    def __init__(self, num_processes: int = 0, batches_per_process: int = 2, request_timeout: float = 30.0,
+                 max_restarts: int = 3, monitor_interval: float = 0.5):
+        self.num_processes = num_processes
+        self.batches_per_process = batches_per_process
+        self.request_timeout = request_timeout
+        # Перезапусков процесса подряд, после которых он так и не стал готов
+        self.max_restarts = max_restarts
+        self.monitor_interval = monitor_interval
+
+        self._processes = []
+        self._request_queues = []
+        self._results_queue = None
+        self._reader_thread = None
+        self._monitor_thread = None
+        self._stopping = False
+        self._ctx = None
+        self._worker_args = None
+        self._loop = None
+        # Батчи, отправленные в процесс и ещё не вернувшиеся
+        self._outstanding = []
+        self._ready = []
+        self._restarts = []
+        self._pending: Dict[int, tuple] = {}
+        self._request_ids = itertools.count()
+
+    @property
+    def max_inflight_batches(self) -> int:
+        """Сколько батчей имеет смысл держать в работе одновременно"""
+        return self.num_processes * self.batches_per_process
+
+    def is_running(self) -> bool:
+        """Запущен ли пул"""
+        return bool(self._processes)
+
+    def is_ready(self) -> bool:
+        """Готов ли хотя бы один процесс принимать батчи"""
+        return any(self._ready)
+
+    def start(self, wrapper) -> None:
+        """Запуск процессов инференса с общими весами загруженной модели"""
+        if self.is_running() or self.num_processes <= 0:
+            return
+
+        if str(wrapper.device) != "cpu":
+            app_logger.warning("Пул процессов инференса поддерживается только на CPU, пул не запущен")
+            return
+
+        # Параметры модели переносятся в разделяемую память один раз;
+        # дочерние процессы получают ссылки на неё, а не копии
+        wrapper.model.share_memory()
+        if settings.inference_backend != "torch" or wrapper.quantized:
+            app_logger.warning(
+                f"Бэкенд {settings.inference_backend}{' INT8' if wrapper.quantized else ''} не использует "
+                f"разделяемую память: каждый из {self.num_processes} процессов держит свою копию модели"
+            )
+
+        num_threads = settings.torch_num_threads or max(1, (os.cpu_count() or 1) // self.num_processes)
+        self._ctx = mp.get_context("spawn")
+        self._worker_args = (wrapper.model, wrapper.tokenizer, wrapper.saved, wrapper.tags, wrapper.quantized, num_threads)
+        self._loop = asyncio.get_running_loop()
+        self._results_queue = self._ctx.Queue()
+        self._stopping = False
+
+        for worker_id in range(self.num_processes):
+            process, requests_queue = self._spawn(worker_id)
+            self._processes.append(process)
+            self._request_queues.append(requests_queue)
+            self._outstanding.append(0)
+            self._ready.append(False)
+            self._restarts.append(0)
+
+        self._reader_thread = threading.Thread(target=self._read_results, name="ner-inference-results", daemon=True)
+        self._reader_thread.start()
+        self._monitor_thread = threading.Thread(target=self._watch_processes, name="ner-inference-monitor", daemon=True)
+        self._monitor_thread.start()
+
+        app_logger.info(f"Пул инференса запущен: {self.num_processes} процессов по {num_threads} потоков")
+
+    def _spawn(self, worker_id: int) -> tuple:
+        """Запуск процесса инференса со своей очередью батчей"""
+        requests_queue = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker_id, *self._worker_args, requests_queue, self._results_queue),
+            name=f"ner-inference-{worker_id}",
+            daemon=True
+        )
+        process.start()
+        return process, requests_queue
+
+    def _watch_processes(self):
+        """Поток наблюдения за процессами: о завершении процесса сообщает event loop"""
+        reported = set()
+        while not self._stopping:
+            sentinels = {
+                process.sentinel: (worker_id, process)
+                for worker_id, process in enumerate(list(self._processes)) if process not in reported
+            }
+            if not sentinels:
+                time.sleep(self.monitor_interval)
+                continue
+            # Новые процессы после перезапуска попадают в список не позже monitor_interval
+            for sentinel in connection.wait(list(sentinels), timeout=self.monitor_interval):
+                worker_id, process = sentinels[sentinel]
+                # Код завершения известен после того, как процесс забран
+                process.join(timeout=1)
+                reported.add(process)
+                self._loop.call_soon_threadsafe(self._on_exit, worker_id, process)
+
+    def _on_exit(self, worker_id: int, process):
+        """Завершение процесса: его батчи в работе - ошибка, процесс перезапускается"""
+        if self._stopping or worker_id >= len(self._processes) or self._processes[worker_id] is not process:
+            return
+
+        self._ready[worker_id] = False
+        self._outstanding[worker_id] = 0
+        error = RuntimeError(f"Процесс инференса {worker_id} завершился (код {process.exitcode})")
+        for request_id, (future, owner) in list(self._pending.items()):
+            if owner == worker_id:
+                del self._pending[request_id]
+                if not future.done():
+                    future.set_exception(error)
+        app_logger.error(str(error))
+
+        # Батчи из очереди упавшего процесса уже завершены ошибкой - очередь не нужна
+        self._request_queues[worker_id].cancel_join_thread()
+        self._request_queues[worker_id].close()
+        if self._restarts[worker_id] >= self.max_restarts:
+            app_logger.error(f"Процесс инференса {worker_id} не перезапускается: исчерпан лимит перезапусков ({self.max_restarts})")
+            return
+        self._restarts[worker_id] += 1
+        self._processes[worker_id], self._request_queues[worker_id] = self._spawn(worker_id)
+        app_logger.info(f"Процесс инференса {worker_id} перезапущен")
+
+    def _read_results(self):
+        """Поток чтения результатов из процессов и передачи их в event loop"""
+        while True:
+            item = self._results_queue.get()
+            if item is None:
+                break
+            self._loop.call_soon_threadsafe(self._resolve, item)
+
+    def _resolve(self, item: tuple):
+        """Передача результата ожидающему батчу"""
+        request_id, ok, payload = item
+        if request_id is None:
+            # Сигнал готовности мог прийти уже после остановки пула
+            if payload < len(self._ready):
+                self._ready[payload] = True
+                self._restarts[payload] = 0
+                app_logger.info(f"Процесс инференса {payload} готов")
+            return
+
+        entry = self._pending.pop(request_id, None)
+        if entry is None:
+            return
+
+        future, worker_id = entry
+        self._outstanding[worker_id] -= 1
+        if future.done():
+            return
+        if ok:
+            future.set_result(payload)
+        else:
+            future.set_exception(RuntimeError(payload))
+
+    def _pick_worker(self) -> int:
+        """Готовый процесс с наименьшим числом батчей в работе"""
+        alive = [i for i, process in enumerate(self._processes) if self._ready[i] and process.is_alive()]
+        if not alive:
+            raise RuntimeError("Нет живых процессов инференса")
+        return min(alive, key=self._outstanding.__getitem__)
+
+    @property
+    def queue_depths(self) -> List[int]:
+        """Число батчей в работе по процессам"""
+        return list(self._outstanding)
+
+    async def predict_batch(self, texts: List[str], timings: Optional[Dict[str, float]] = None) -> List[List[Dict[str, Any]]]:
+        """Предсказание батча в наименее загруженном процессе; timings - время этапов батча"""
+        from ..models.ner_model import batch_to_lists
+
+        worker_id = self._pick_worker()
+        request_id = next(self._request_ids)
+        future = self._loop.create_future()
+        capture = profiler.active
+        traced = capture.start_trace() if capture is not None else False
+
+        self._pending[request_id] = (future, worker_id)
+        self._outstanding[worker_id] += 1
+        self._request_queues[worker_id].put((request_id, texts, capture is not None, traced))
+
+        profile = None
+        try:
+            entities, profile = await asyncio.wait_for(future, self.request_timeout)
+            return batch_to_lists(entities, timings)
+        except asyncio.TimeoutError:
+            # Процесс мог упасть - не держим счётчик его очереди завышенным
+            if self._pending.pop(request_id, None) is not None:
+                self._outstanding[worker_id] -= 1
+            raise RuntimeError(f"Процесс инференса {worker_id} не ответил за {self.request_timeout} с")
+        finally:
+            if capture is not None:
+                capture.add(profile, traced)
+
+    def stop(self):
+        """Остановка процессов инференса"""
+        if not self.is_running():
+            return
+
+        self._stopping = True
+        # Очереди упавших и не перезапущенных процессов уже закрыты
+        for process, requests_queue in zip(self._processes, self._request_queues):
+            if process.is_alive():
+                requests_queue.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+        self._results_queue.put(None)
+        self._reader_thread.join(timeout=5)
+        self._monitor_thread.join(timeout=5)
+
+        for future, _ in self._pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError("Пул инференса остановлен"))
+
+        self._processes = []
+        self._request_queues = []
+        self._outstanding = []
+        self._ready = []
+        self._restarts = []
+        self._pending.clear()
+        app_logger.info("Пул инференса остановлен")
+
+
+# Глобальный пул процессов инференса (используется при INFERENCE_PROCESSES > 0)
+worker_pool = InferenceWorkerPool(
+    num_processes=settings.inference_processes,
+    batches_per_process=settings.max_inflight_batches,
+    request_timeout=settings.worker_request_timeout,
+    max_restarts=settings.worker_max_restarts
+)
@@ -0,0 +1,165 @@
+"""
+Бенчмарк инференса NER модели на распределении длин реальных запросов
+
+python benchmark.py                          # синтетическое распределение длин
+python benchmark.py --input queries.jsonl    # запросы из файла ({"input": ...} в каждой строке)
+python benchmark.py --quantization           # fp32 против INT8: пропускная способность и RSS
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import statistics
+import time
+from typing import List
+
+from app.core.config import settings
+from app.models.ner_model import ner_model
+
+# Типичные товарные запросы: 1-4 слова, изредка длинные описания
+WORDS = [
+    "молоко", "сгущенное", "простоквашино", "2.5%", "1л", "хлеб", "бородинский",
+    "сыр", "российский", "кефир", "домик", "в", "деревне", "масло", "сливочное",
+    "82.5%", "йогурт", "клубничный", "200г", "сметана", "15%", "творог", "5%",
+]
+LENGTH_WEIGHTS = {1: 15, 2: 35, 3: 25, 4: 12, 5: 6, 8: 4, 20: 2, 60: 1}
+
+# Сравниваемые режимы: (padding_strategy, length_buckets)
+MODES = {
+    "max_length": ("max_length", []),
+    "longest": ("longest", []),
+    "longest+buckets": ("longest", [8, 16, 32, 64]),
+}
+
+
+def synthetic_queries(count: int, seed: int = 0) -> List[str]:
+    """Генерация запросов с распределением длин, похожим на продуктовый трафик"""
+    rng = random.Random(seed)
+    lengths = rng.choices(list(LENGTH_WEIGHTS), weights=list(LENGTH_WEIGHTS.values()), k=count)
+    return [" ".join(rng.choices(WORDS, k=length)) for length in lengths]
+
+
+def load_queries(path: str, count: int) -> List[str]:
+    """Чтение запросов из JSONL файла"""
+    queries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                queries.append(json.loads(line)["input"])
+            if len(queries) >= count:
+                break
+    return queries
+
+
+async def run_mode(queries: List[str], batch_size: int) -> dict:
+    """Прогон всех запросов батчами, замер задержки батча и пропускной способности"""
+    latencies = []
+    start = time.perf_counter()
+    for i in range(0, len(queries), batch_size):
+        batch_start = time.perf_counter()
+        await ner_model.predict_batch(queries[i:i + batch_size])
+        latencies.append(time.perf_counter() - batch_start)
+    total = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] * 1000,
+        "texts_per_second": len(queries) / total,
+    }
+
+
+def quantization_run(quantization: str, queries: List[str], batch_size: int, results) -> None:
+    """Загрузка модели и прогон в отдельном процессе, чтобы RSS режимов не смешивались"""
+    import psutil
+
+    settings.quantization = quantization
+    # Бенчмарк меряет INT8 модель даже при несовпадении тегов; вердикт по порогу печатается отдельно
+    min_agreement = settings.quantization_min_agreement
+    settings.quantization_min_agreement = 0.0
+
+    async def run():
+        process = psutil.Process()
+        rss_before = process.memory_info().rss
+        if not await ner_model.load_model():
+            raise SystemExit("Не удалось загрузить модель")
+        await ner_model.predict_batch(queries[:32])
+        rss_loaded = process.memory_info().rss
+        result = await run_mode(queries, batch_size)
+        result["rss_mb"] = process.memory_info().rss / 2 ** 20
+        result["model_rss_mb"] = (rss_loaded - rss_before) / 2 ** 20
+        result["report"] = ner_model.quantization_report
+        result["min_agreement"] = min_agreement
+        ner_model.shutdown()
+        return result
+
+    results.put(asyncio.run(run()))
+
+
+def compare_quantization(queries: List[str], batch_size: int):
+    """Сравнение fp32 и динамической INT8 квантизации"""
+    ctx = multiprocessing.get_context("spawn")
+    rows = {}
+    for quantization in ("none", "dynamic"):
+        results = ctx.Queue()
+        process = ctx.Process(target=quantization_run, args=(quantization, queries, batch_size, results))
+        process.start()
+        rows[quantization] = results.get()
+        process.join()
+
+    print(f"\nbatch_size={batch_size}, бэкенд {settings.inference_backend}")
+    print(f"{'режим':<10}{'p50, мс':>10}{'p95, мс':>10}{'текстов/с':>12}{'RSS, МБ':>10}{'модель, МБ':>12}")
+    for quantization, result in rows.items():
+        print(f"{quantization:<10}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+              f"{result['texts_per_second']:>12.1f}{result['rss_mb']:>10.1f}{result['model_rss_mb']:>12.1f}")
+
+    report, min_agreement = rows["dynamic"]["report"], rows["dynamic"]["min_agreement"]
+    if report is None:
+        print("INT8 модель не проверена: нет контрольной выборки (QUANTIZATION_SAMPLE_PATH)")
+    else:
+        verdict = "проходит" if report["tag_agreement"] >= min_agreement else "не проходит"
+        print(f"Совпадение тегов с fp32: {report['tag_agreement']:.4f} на {report['sample_size']} текстах, "
+              f"порог {min_agreement} - {verdict}")
+    fp32, int8 = rows["none"], rows["dynamic"]
+    print(f"Ускорение x{int8['texts_per_second'] / fp32['texts_per_second']:.2f}, "
+          f"RSS {int8['rss_mb'] - fp32['rss_mb']:+.1f} МБ")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк инференса NER модели")
+    parser.add_argument("--input", help="JSONL файл с запросами")
+    parser.add_argument("--count", type=int, default=2000, help="Количество запросов")
+    parser.add_argument("--batch-sizes", default="1,8,32", help="Размеры батчей через запятую")
+    parser.add_argument("--quantization", action="store_true", help="Сравнить fp32 и INT8 квантизацию")
+    args = parser.parse_args()
+
+    if args.quantization:
+        queries = load_queries(args.input, args.count) if args.input else synthetic_queries(args.count)
+        for batch_size in (int(b) for b in args.batch_sizes.split(",")):
+            compare_quantization(queries, batch_size)
+        return
+
+    if not await ner_model.load_model():
+        raise SystemExit("Не удалось загрузить модель")
+
+    queries = load_queries(args.input, args.count) if args.input else synthetic_queries(args.count)
+    word_counts = sorted(len(q.split()) for q in queries)
+    print(f"Запросов: {len(queries)}, слов: медиана {statistics.median(word_counts)}, "
+          f"p95 {word_counts[int(len(word_counts) * 0.95)]}, максимум {word_counts[-1]}")
+
+    # Прогрев
+    await ner_model.predict_batch(queries[:32])
+
+    for batch_size in (int(b) for b in args.batch_sizes.split(",")):
+        print(f"\nbatch_size={batch_size}")
+        print(f"{'режим':<18}{'p50, мс':>10}{'p95, мс':>10}{'текстов/с':>12}")
+        for name, (padding_strategy, length_buckets) in MODES.items():
+            settings.padding_strategy = padding_strategy
+            settings.length_buckets = length_buckets
+            result = await run_mode(queries, batch_size)
+            print(f"{name:<18}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['texts_per_second']:>12.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
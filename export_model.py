@@ -0,0 +1,105 @@
+"""
+Экспорт NER модели для бэкендов инференса ONNX Runtime и TorchScript
+
+python export_model.py --format onnx          # -> <MODEL_PATH>/model.onnx
+python export_model.py --format torchscript   # -> <MODEL_PATH>/model.torchscript.pt
+python export_model.py --format onnx --quantize   # + <MODEL_PATH>/model.int8.onnx (INT8 веса)
+"""
+import os
+import argparse
+import asyncio
+import torch
+import torch.nn as nn
+
+from app.core.config import settings
+from app.models.ner_model import ner_model, backend_artifact_path
+
+
+class LogitsOnly(nn.Module):
+    """Обёртка модели с позиционными входами и одним выходом - логитами"""
+
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        return self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            token_type_ids=token_type_ids
+        ).logits
+
+
+def example_inputs(batch: int = 2, length: int = 16):
+    """Входы для трассировки; размеры батча и длины при экспорте помечаются динамическими"""
+    input_ids = torch.ones(batch, length, dtype=torch.long)
+    attention_mask = torch.ones(batch, length, dtype=torch.long)
+    token_type_ids = torch.zeros(batch, length, dtype=torch.long)
+    return input_ids, attention_mask, token_type_ids
+
+
+def export_onnx(module: nn.Module, path: str, opset: int):
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in ("input_ids", "attention_mask", "token_type_ids")}
+    dynamic_axes["logits"] = {0: "batch", 1: "sequence"}
+    torch.onnx.export(
+        module,
+        example_inputs(),
+        path,
+        input_names=["input_ids", "attention_mask", "token_type_ids"],
+        output_names=["logits"],
+        dynamic_axes=dynamic_axes,
+        opset_version=opset,
+        dynamo=False
+    )
+
+
+def quantize_onnx(path: str, output: str):
+    """Динамическая INT8 квантизация весов ONNX модели"""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    quantize_dynamic(path, output, weight_type=QuantType.QInt8)
+
+
+def export_torchscript(module: nn.Module, path: str):
+    with torch.no_grad():
+        traced = torch.jit.trace(module, example_inputs(), strict=False)
+    traced.save(path)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Экспорт NER модели для ONNX Runtime / TorchScript")
+    parser.add_argument("--format", choices=["onnx", "torchscript"], required=True)
+    parser.add_argument("--output", help="Путь артефакта (по умолчанию из настроек)")
+    parser.add_argument("--quantize", action="store_true",
+                        help="Дополнительно сохранить INT8 модель (только для onnx)")
+    parser.add_argument("--opset", type=int, default=17, help="Версия opset ONNX")
+    args = parser.parse_args()
+    if args.quantize and args.format != "onnx":
+        parser.error("--quantize поддерживается только для --format onnx; "
+                     "для torch используйте QUANTIZATION=dynamic")
+
+    # Экспорт всегда делается из eager модели
+    settings.inference_backend = "torch"
+    settings.quantization = "none"
+    settings.device = "cpu"
+    if not await ner_model.load_model():
+        raise SystemExit("Не удалось загрузить модель")
+
+    output = args.output or backend_artifact_path(args.format, settings.model_path)
+    module = LogitsOnly(ner_model.model).eval()
+    if args.format == "onnx":
+        export_onnx(module, output, args.opset)
+        if args.quantize:
+            quantized_output = backend_artifact_path(args.format, settings.model_path, quantized=True)
+            if args.output:
+                quantized_output = os.path.splitext(args.output)[0] + ".int8.onnx"
+            quantize_onnx(output, quantized_output)
+            print(f"INT8 модель сохранена: {quantized_output}")
+    else:
+        export_torchscript(module, output)
+
+    ner_model.shutdown()
+    print(f"Модель экспортирована: {output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
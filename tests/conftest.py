@@ -0,0 +1,63 @@
+"""
+Общие заглушки для тестов сервиса предсказаний, планировщика и заданий
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+import asyncio
+from app.services import prediction
+from app.services.prediction import PredictionService
+
+
+class StubModel:
+    """
+    Заглушка модели: размечает каждое слово как B-TYPE и запоминает батчи.
+    delay - время батча (секунды); после block_after батчей батч ждёт gate
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.batches = []
+        self.running = 0
+        self.max_running = 0
+        self.gate = asyncio.Event()
+        self.gate.set()
+        self.block_after = None
+
+    async def predict_batch(self, texts, timings=None):
+        if self.block_after is not None and len(self.batches) >= self.block_after:
+            await self.gate.wait()
+        self.batches.append(list(texts))
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+        finally:
+            self.running -= 1
+        return [self.tag(text) for text in texts]
+
+    @staticmethod
+    def tag(text):
+        entities = []
+        idx = 0
+        for word in text.split():
+            entities.append({'start_index': idx, 'end_index': idx + len(word), 'entity': 'B-TYPE'})
+            idx += len(word) + 1
+        return entities
+
+
+@pytest.fixture
+def stub_model(monkeypatch):
+    """Заглушка вместо модели сервиса предсказаний"""
+    model = StubModel()
+    monkeypatch.setattr(prediction, "ner_model", model)
+    return model
+
+
+@pytest.fixture
+def service(stub_model):
+    """Сервис предсказаний поверх заглушки модели (батчи по 8, ожидание 1 мс)"""
+    return PredictionService(batch_size=8, max_wait_time=0.001)
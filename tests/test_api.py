@@ -10,6 +10,7 @@ import asyncio
 import httpx
 from fastapi.testclient import TestClient
 from app.main import app
+from app.api.routes import _ResultSpool
 
 client = TestClient(app)
 
@@ -65,6 +66,15 @@ class TestAPIEndpoints:
         assert "average_response_time" in data
         assert "requests_per_second" in data
     
+    def test_openapi_response_schema(self):
+        """Ответы, закодированные orjson, по-прежнему описаны схемой PredictResponse"""
+        paths = client.get("/openapi.json").json()["paths"]
+        
+        predict_schema = paths["/api/predict"]["post"]["responses"]["200"]["content"]["application/json"]["schema"]
+        batch_schema = paths["/api/predict/batch"]["post"]["responses"]["200"]["content"]["application/json"]["schema"]
+        assert predict_schema["$ref"].endswith("/PredictResponse")
+        assert batch_schema["items"]["$ref"].endswith("/PredictResponse")
+    
     def test_batch_predict_endpoint(self):
         """Тест батчевого предсказания"""
         requests_data = [
@@ -142,4 +152,32 @@ class TestAsyncPerformance:
             assert (end_time - start_time) < 0.8
 
 if __name__ == "__main__":
-    pytest.main([__file__])
\ No newline at end of file
+    pytest.main([__file__])
+
+
+@pytest.mark.asyncio
+class TestResultSpool:
+    """Тесты буфера ответа потокового endpoint"""
+
+    async def test_slow_reader_bounds_buffer(self):
+        """Медленный клиент: обработка ждёт его, буфер не превышает max_bytes"""
+        spool = _ResultSpool(max_memory_bytes=1024, max_bytes=4096, read_size=512)
+        records = [b"%05d" % i * 100 for i in range(200)]
+        sizes = []
+
+        async def produce():
+            for record in records:
+                await spool.write(record)
+                sizes.append(spool.size)
+            spool.close()
+
+        producer = asyncio.create_task(produce())
+        received = []
+        async for data in spool.chunks():
+            received.append(data)
+            await asyncio.sleep(0.001)
+        await producer
+
+        assert b"".join(received) == b"".join(records)
+        assert max(sizes) <= 4096
+
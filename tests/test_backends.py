@@ -0,0 +1,131 @@
+"""
+Тесты бэкендов инференса: совпадение логитов ONNX Runtime / TorchScript с eager PyTorch
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+import asyncio
+import torch
+from app.core.config import settings
+from app.models.ner_model import NERModelWrapper, create_backend, backend_artifact_path
+
+TEXTS = ["сгущенное молоко", "хлеб", "сыр российский 45% 200г в нарезке"]
+
+
+@pytest.fixture(scope="module")
+def wrapper():
+    if not os.path.exists(os.path.join(settings.model_path, "config.json")):
+        pytest.skip("Нет весов модели")
+
+    backend = settings.inference_backend
+    settings.inference_backend = "torch"
+    model = NERModelWrapper()
+    try:
+        loaded = asyncio.run(model.load_model())
+    finally:
+        settings.inference_backend = backend
+    if not loaded:
+        pytest.skip("Не удалось загрузить модель")
+
+    yield model
+    model.shutdown()
+
+
+def batch_features(wrapper):
+    """Батч с паддингом: разные длины строк проверяют маску внимания"""
+    enc = wrapper.tokenizer([text.split() for text in TEXTS], is_split_into_words=True,
+                            padding=True, return_tensors="pt")
+    return {name: enc[name] for name in ("input_ids", "attention_mask", "token_type_ids") if name in enc}
+
+
+def assert_parity(wrapper, backend_name):
+    path = backend_artifact_path(backend_name, settings.model_path)
+    if not os.path.exists(path):
+        pytest.skip(f"Нет артефакта {path}, выполните export_model.py --format {backend_name}")
+
+    features = batch_features(wrapper)
+    expected = wrapper.backend.forward(features)
+    actual = create_backend(backend_name, settings.model_path, wrapper.model).forward(features)
+
+    mask = features["attention_mask"].bool()
+    assert actual.shape == expected.shape
+    assert torch.allclose(actual[mask], expected[mask], atol=1e-4)
+    assert torch.equal(actual[mask].argmax(-1), expected[mask].argmax(-1))
+
+
+class TestBackendParity:
+    """Тесты совпадения результатов бэкендов"""
+
+    def test_onnx_matches_torch(self, wrapper):
+        """Логиты ONNX Runtime совпадают с eager PyTorch"""
+        pytest.importorskip("onnxruntime")
+        assert_parity(wrapper, "onnx")
+
+    def test_torchscript_matches_torch(self, wrapper):
+        """Логиты TorchScript совпадают с eager PyTorch"""
+        assert_parity(wrapper, "torchscript")
+
+    def test_unknown_backend(self, wrapper):
+        """Неизвестный бэкенд - понятная ошибка"""
+        with pytest.raises(ValueError):
+            create_backend("tensorrt", settings.model_path, wrapper.model)
+
+
+class TestQuantization:
+    """Тесты проверки точности INT8 модели"""
+
+    def test_tag_agreement(self):
+        """Доля совпавших тегов считается по словам эталона"""
+        reference = [[{'start_index': 0, 'end_index': 6, 'entity': 'B-TYPE'},
+                      {'start_index': 7, 'end_index': 11, 'entity': 'B-BRAND'}]]
+        candidate = [[{'start_index': 0, 'end_index': 6, 'entity': 'B-TYPE'},
+                      {'start_index': 7, 'end_index': 11, 'entity': 'O'}]]
+
+        assert NERModelWrapper._tag_agreement(reference, reference) == 1.0
+        assert NERModelWrapper._tag_agreement(reference, candidate) == 0.5
+
+    def test_gate_keeps_fp32_below_threshold(self, wrapper, monkeypatch):
+        """INT8 модель не включается, если совпадение тегов ниже порога"""
+        monkeypatch.setattr(settings, "quantization", "dynamic")
+        monkeypatch.setattr(settings, "quantization_min_agreement", 1.01)
+        monkeypatch.setattr(wrapper, "_load_quantization_sample", lambda model_path: TEXTS)
+        fp32_backend = wrapper.backend
+
+        wrapper._apply_quantization(settings.model_path)
+
+        assert wrapper.quantized is False
+        assert wrapper.backend is fp32_backend
+        assert wrapper.quantization_report["sample_size"] == len(TEXTS)
+
+    def test_gate_enables_int8(self, wrapper, monkeypatch):
+        """INT8 модель включается при достаточном совпадении тегов"""
+        monkeypatch.setattr(settings, "quantization", "dynamic")
+        monkeypatch.setattr(settings, "quantization_min_agreement", 0.0)
+        monkeypatch.setattr(wrapper, "_load_quantization_sample", lambda model_path: TEXTS)
+        fp32_backend = wrapper.backend
+
+        try:
+            wrapper._apply_quantization(settings.model_path)
+
+            assert wrapper.quantized is True
+            assert wrapper.backend is not fp32_backend
+            assert len(wrapper.predict_batch_sync(TEXTS)) == len(TEXTS)
+        finally:
+            wrapper.backend = fp32_backend
+            wrapper.quantized = False
+
+    @pytest.mark.parametrize("backend", ["torchscript", "onnx"])
+    def test_missing_int8_artifact_keeps_fp32(self, wrapper, monkeypatch, tmp_path, backend):
+        """Без INT8 артефакта бэкенда (torchscript, нет model.int8.onnx) остаётся fp32 модель"""
+        monkeypatch.setattr(settings, "quantization", "dynamic")
+        monkeypatch.setattr(settings, "inference_backend", backend)
+        monkeypatch.setattr(settings, "onnx_model_path", str(tmp_path / "model.onnx"))
+        monkeypatch.setattr(wrapper, "_load_quantization_sample", lambda model_path: TEXTS)
+        fp32_backend = wrapper.backend
+
+        wrapper._apply_quantization(settings.model_path)
+
+        assert wrapper.quantized is False
+        assert wrapper.backend is fp32_backend
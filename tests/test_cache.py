@@ -0,0 +1,126 @@
+"""
+Тесты кеша предсказаний
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import time
+from app.services.cache import PredictionCache, SQLiteCacheBackend
+
+
+def entities_for(text):
+    """Сущность на каждое слово текста"""
+    entities = []
+    idx = 0
+    for word in text.split(" "):
+        entities.append({'start_index': idx, 'end_index': idx + len(word), 'entity': 'B-TYPE'})
+        idx += len(word) + 1
+    return entities
+
+
+class TestEviction:
+    """Тесты вытеснения"""
+
+    def test_lru_keeps_recently_used(self):
+        """Недавно прочитанная запись не вытесняется"""
+        cache = PredictionCache(max_entries=2)
+        cache.put("молоко", [])
+        cache.put("хлеб", [])
+        assert cache.get("молоко") == []
+
+        cache.put("сыр", [])
+
+        assert "молоко" in cache
+        assert "хлеб" not in cache
+        assert cache.stats()["evictions"] == 1
+
+    def test_ttl_expiration(self):
+        """Запись с истёкшим TTL считается промахом"""
+        cache = PredictionCache(ttl_seconds=0.01)
+        cache.put("молоко", [])
+        time.sleep(0.02)
+
+        assert cache.get("молоко") is None
+        stats = cache.stats()
+        assert stats["expirations"] == 1
+        assert stats["misses"] == 1
+
+    def test_byte_budget(self):
+        """Объём кеша не превышает бюджет памяти"""
+        entities = entities_for("сгущенное молоко")
+        entry_size = PredictionCache._entry_size("текст 0", entities)
+        cache = PredictionCache(max_bytes=entry_size * 3)
+
+        for i in range(10):
+            cache.put(f"текст {i}", entities)
+
+        assert cache.bytes_used <= entry_size * 3
+        assert len(cache) == 3
+
+    def test_hit_miss_counters(self):
+        """Счётчики попаданий и промахов"""
+        cache = PredictionCache()
+        cache.get("молоко")
+        cache.put("молоко", [])
+        cache.get("молоко")
+
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["hit_rate"] == 0.5
+
+
+class TestNormalization:
+    """Тесты нормализации ключей"""
+
+    def test_whitespace_variants_share_key(self):
+        """Лишние пробелы не меняют ключ"""
+        cache = PredictionCache()
+        assert cache.normalize("  сгущенное \t молоко  ")[0] == "сгущенное молоко"
+        assert cache.normalize("сгущенное молоко") == ("сгущенное молоко", None)
+
+    def test_case_normalization(self):
+        """Приведение к нижнему регистру включается настройкой"""
+        assert PredictionCache().normalize("Молоко")[0] == "Молоко"
+        assert PredictionCache(normalize_case=True).normalize("Молоко  ")[0] == "молоко"
+
+    def test_offsets_remapped_to_original_text(self):
+        """Позиции сущностей указывают на слова исходного текста"""
+        cache = PredictionCache(normalize_case=True)
+        text = "  Сгущенное \t Молоко "
+        key, index_map = cache.normalize(text)
+
+        entities = cache.remap(entities_for(key), index_map)
+
+        assert [text[e['start_index']:e['end_index']] for e in entities] == ["Сгущенное", "Молоко"]
+
+
+class TestSharedCache:
+    """Тесты общего кеша второго уровня"""
+
+    def test_result_shared_between_workers(self, tmp_path):
+        """Результат одного worker'а виден другому через общий кеш"""
+        path = str(tmp_path / "cache.sqlite3")
+        worker_a = PredictionCache(shared=SQLiteCacheBackend(path))
+        worker_b = PredictionCache(shared=SQLiteCacheBackend(path))
+        entities = entities_for("сгущенное молоко")
+
+        worker_a.put("сгущенное молоко", entities)
+
+        assert worker_b.get("сгущенное молоко") == entities
+        assert "сгущенное молоко" in worker_b
+        assert worker_b.stats()["shared"]["hits"] == 1
+
+    def test_shared_ttl_and_clear(self, tmp_path):
+        """Истёкшие записи общего кеша не возвращаются, очистка затрагивает оба уровня"""
+        path = str(tmp_path / "cache.sqlite3")
+        expiring = PredictionCache(shared=SQLiteCacheBackend(path, ttl_seconds=0.01))
+        expiring.put("молоко", [])
+        time.sleep(0.02)
+        assert PredictionCache(shared=SQLiteCacheBackend(path)).get("молоко") is None
+
+        cache = PredictionCache(shared=SQLiteCacheBackend(path))
+        cache.put("хлеб", [])
+        cache.clear()
+        assert PredictionCache(shared=SQLiteCacheBackend(path)).get("хлеб") is None
@@ -0,0 +1,105 @@
+"""
+Тесты офлайн разметки файлов
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import json
+import queue
+import pytest
+from app.cli import read_jsonl, _merge, _init_worker, ParquetWriter
+from app.core.config import settings
+from app.models.ner_model import NERModelWrapper
+
+
+class TestReadJsonl:
+    """Тесты чтения JSONL"""
+
+    def test_chunks_and_invalid_lines(self, tmp_path):
+        """Файл читается частями, некорректные строки остаются в потоке с ошибкой"""
+        path = tmp_path / "catalog.jsonl"
+        lines = [json.dumps({"id": i, "input": f"молоко {i}"}, ensure_ascii=False) for i in range(5)]
+        path.write_text("\n".join(lines[:3] + ["не json", "", '{"id": 9}', '{"input": 5}'] + lines[3:]) + "\n",
+                        encoding="utf-8")
+
+        chunks = list(read_jsonl(str(path), chunk_size=3, text_field="input"))
+
+        assert [len(records) for records, _ in chunks] == [3, 3, 2]
+        records = [record for chunk, _ in chunks for record in chunk]
+        texts = [text for _, chunk in chunks for text in chunk]
+        assert texts == ["молоко 0", "молоко 1", "молоко 2", None, None, None, "молоко 3", "молоко 4"]
+        assert "error" in records[3] and records[4]["error"]
+        assert records[5]["input"] == 5 and "error" in records[5]
+
+
+class TestMerge:
+    """Тесты сборки результата"""
+
+    def test_entities_added_in_order(self):
+        """Сущности добавляются к записям с текстом по порядку"""
+        records = [{"id": 0}, {"error": "Некорректная строка"}, {"id": 2}]
+        entities = [[{'start_index': 0, 'end_index': 6, 'entity': 'B-TYPE'}], []]
+
+        merged = _merge(records, ["молоко", None, ""], entities)
+
+        assert merged[0]["entities"] == entities[0]
+        assert "entities" not in merged[1]
+        assert merged[2]["entities"] == []
+
+
+class TestParquetWriter:
+    """Тесты записи Parquet с фиксированной схемой"""
+
+    def test_parts_with_errors_and_different_fields(self, tmp_path):
+        """Часть с колонкой error и другим набором полей пишется в ту же схему"""
+        pa = pytest.importorskip("pyarrow")
+        pq = pytest.importorskip("pyarrow.parquet")
+        source = tmp_path / "catalog.parquet"
+        pq.write_table(pa.table({"id": [1, 2], "name": ["молоко", "хлеб"]}), source)
+        output = tmp_path / "catalog.tagged.parquet"
+        entities = [{'start_index': 0, 'end_index': 6, 'entity': 'B-TYPE'}]
+
+        writer = ParquetWriter(str(output), str(source))
+        writer.write([{"id": 1, "name": "молоко", "entities": entities}])
+        writer.write([{"id": 2, "name": None, "error": "Поле name должно быть строкой", "extra": 1}])
+        writer.close()
+
+        rows = pq.read_table(output).to_pylist()
+        assert rows == [
+            {"id": 1, "name": "молоко", "entities": json.dumps(entities, ensure_ascii=False), "error": None},
+            {"id": 2, "name": None, "entities": None, "error": "Поле name должно быть строкой"}
+        ]
+
+    def test_jsonl_records_as_json_column(self, tmp_path):
+        """Записи JSONL с разными полями сохраняются целиком в колонке record"""
+        pq = pytest.importorskip("pyarrow.parquet")
+        output = tmp_path / "catalog.tagged.parquet"
+
+        writer = ParquetWriter(str(output), str(tmp_path / "catalog.jsonl"))
+        writer.write([{"id": 1, "input": "молоко", "entities": []}])
+        writer.write([{"error": "Некорректная строка"}, {"input": 5, "sku": "a1", "error": "Поле input должно быть строкой"}])
+        writer.close()
+
+        rows = pq.read_table(output).to_pylist()
+        assert [row["record"] for row in rows] == ['{"id": 1, "input": "молоко"}', None, '{"input": 5, "sku": "a1"}']
+        assert [row["entities"] for row in rows] == ["[]", None, None]
+        assert rows[1]["error"] == "Некорректная строка"
+
+
+class TestInitWorker:
+    """Тесты загрузки модели в процессе пула"""
+
+    def test_load_failure_reported(self, monkeypatch):
+        """Ошибка загрузки передаётся основному процессу, а не исключением из initializer"""
+        async def failing_load(self, model_path=None):
+            raise OSError("нет весов")
+
+        for name in ("torch_num_threads", "torch_interop_threads", "inference_threads"):
+            monkeypatch.setattr(settings, name, getattr(settings, name))
+        monkeypatch.setattr(NERModelWrapper, "load_model", failing_load)
+        ready = queue.Queue()
+
+        _init_worker(1, ready)
+
+        assert ready.get_nowait() == "OSError: нет весов"
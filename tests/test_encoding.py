@@ -0,0 +1,93 @@
+"""
+Тесты форматов ответа и выбора формата по Accept
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import io
+import json
+import msgpack
+from app.api import encoding
+
+RESULTS = [
+    [{'start_index': 0, 'end_index': 6, 'entity': 'B-TYPE'}, {'start_index': 7, 'end_index': 11, 'entity': 'B-BRAND'}],
+    [],
+    [{'start_index': 0, 'end_index': 4, 'entity': 'B-TYPE'}]
+]
+
+
+def from_columnar(data):
+    """Обратное преобразование колоночного формата в списки сущностей"""
+    splits, tags = data["row_splits"], data["tags"]
+    return [
+        [{'start_index': data["start_index"][j], 'end_index': data["end_index"][j], 'entity': tags[data["entity"][j]]}
+         for j in range(splits[i], splits[i + 1])]
+        for i in range(len(splits) - 1)
+    ]
+
+
+class TestNegotiation:
+    """Тесты выбора формата по заголовку Accept"""
+
+    def test_default_and_wildcards(self):
+        """Без Accept и для */* - формат по умолчанию"""
+        assert encoding.negotiate(None) == encoding.JSON
+        assert encoding.negotiate("text/html,*/*;q=0.8") == encoding.JSON
+        assert encoding.negotiate("*/*", default=encoding.NDJSON) == encoding.NDJSON
+
+    def test_quality_order(self):
+        """Выбирается поддерживаемый тип с наибольшим q"""
+        accept = "application/json;q=0.5, application/vnd.ner.columnar+json"
+        assert encoding.negotiate(accept) == encoding.COLUMNAR_JSON
+
+    def test_unsupported(self):
+        """Неподдерживаемые типы и q=0 - None (406)"""
+        assert encoding.negotiate("text/html") is None
+        assert encoding.negotiate("application/json;q=0") is None
+
+    def test_msgpack(self):
+        """msgpack выбирается по Accept, application/x-msgpack - синоним application/msgpack"""
+        assert encoding.negotiate("application/msgpack") == encoding.MSGPACK
+        assert encoding.negotiate("application/x-msgpack") == encoding.MSGPACK
+        assert encoding.negotiate("application/vnd.ner.columnar+msgpack") == encoding.COLUMNAR_MSGPACK
+
+
+class TestEncoding:
+    """Тесты кодирования результатов"""
+
+    def test_columnar_roundtrip(self):
+        """Колоночный формат восстанавливается в те же сущности, теги - через словарь"""
+        data = json.loads(encoding.encode_results(RESULTS, encoding.COLUMNAR_JSON))
+
+        assert data["row_splits"] == [0, 2, 2, 3]
+        assert data["tags"] == ['B-TYPE', 'B-BRAND']
+        assert data["entity"] == [0, 1, 0]
+        assert from_columnar(data) == RESULTS
+
+    def test_msgpack(self):
+        """msgpack и колоночный msgpack содержат ту же структуру"""
+        assert msgpack.unpackb(encoding.encode_results(RESULTS, encoding.MSGPACK)) == RESULTS
+        assert from_columnar(msgpack.unpackb(encoding.encode_results(RESULTS, encoding.COLUMNAR_MSGPACK))) == RESULTS
+
+    def test_stream_chunk(self):
+        """Часть потока: NDJSON - строка на вход, колоночный - одна запись с метаданными строк"""
+        def chunk():
+            return [({"line": 0}, RESULTS[0]), ({"line": 1, "error": "Некорректная строка"}, None)]
+
+        lines = encoding.encode_stream_chunk(chunk(), encoding.NDJSON).splitlines()
+        record = json.loads(encoding.encode_stream_chunk(chunk(), encoding.COLUMNAR_JSON))
+
+        assert [json.loads(line) for line in lines] == [
+            {"line": 0, "entities": RESULTS[0]}, {"line": 1, "error": "Некорректная строка"}
+        ]
+        assert record["lines"] == [{"line": 0}, {"line": 1, "error": "Некорректная строка"}]
+        assert from_columnar(record) == [RESULTS[0], []]
+
+    def test_msgpack_stream(self):
+        """Поток msgpack - последовательность объектов, читаемая Unpacker"""
+        data = encoding.encode_stream_chunk([({"line": 0}, RESULTS[2]), ({"line": 1}, [])], encoding.MSGPACK)
+
+        assert list(msgpack.Unpacker(io.BytesIO(data))) == [
+            {"line": 0, "entities": RESULTS[2]}, {"line": 1, "entities": []}
+        ]
@@ -0,0 +1,95 @@
+"""
+Тесты асинхронных заданий на разметку больших батчей
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+import asyncio
+from app.services import jobs
+from app.services.jobs import JobManager
+
+
+@pytest.fixture
+def service(service, monkeypatch):
+    # Менеджер заданий работает через тестовый сервис
+    monkeypatch.setattr(jobs, "prediction_service", service)
+    return service
+
+
+async def wait_finished(job, timeout=2.0):
+    for _ in range(int(timeout / 0.01)):
+        if job.finished:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"Задание не завершилось: {job.status}")
+
+
+@pytest.mark.asyncio
+class TestJobs:
+    """Тесты очереди заданий"""
+
+    async def test_job_completes_in_order(self, service, stub_model):
+        """Задание обрабатывается частями, результаты - в порядке текстов"""
+        manager = JobManager(chunk_size=4)
+        texts = [f"молоко{i} 1л" for i in range(10)]
+
+        job = manager.submit(texts)
+        await wait_finished(job)
+        await manager.stop()
+        await service.stop()
+
+        assert job.status == jobs.COMPLETED
+        assert job.info()["progress"] == 1.0
+        assert [r[0]['end_index'] for r in job.results] == [len(f"молоко{i}") for i in range(10)]
+        assert all(len(batch) <= 4 for batch in stub_model.batches)
+
+    async def test_partial_results(self, service, stub_model):
+        """Готовая часть результатов доступна, пока задание выполняется"""
+        manager = JobManager(chunk_size=2)
+        stub_model.block_after = 1
+        stub_model.gate.clear()
+
+        job = manager.submit([f"хлеб {i}" for i in range(6)])
+        await asyncio.sleep(0.05)
+
+        assert job.status == jobs.RUNNING
+        assert 0 < job.processed < job.total
+        assert len(job.results) == job.processed
+
+        stub_model.gate.set()
+        await wait_finished(job)
+        await manager.stop()
+        await service.stop()
+        assert job.processed == 6
+
+    async def test_delete_cancels_job(self, service, stub_model):
+        """Удалённое задание не продолжает обработку"""
+        manager = JobManager(chunk_size=1)
+        stub_model.block_after = 0
+        stub_model.gate.clear()
+
+        job = manager.submit([f"сыр {i}" for i in range(5)])
+        await asyncio.sleep(0.01)
+        assert manager.delete(job.id) is True
+        stub_model.gate.set()
+        await asyncio.sleep(0.05)
+        await manager.stop()
+        await service.stop()
+
+        assert job.status == jobs.CANCELLED
+        assert manager.get(job.id) is None
+        assert len(stub_model.batches) <= 1
+
+    async def test_limits(self, service):
+        """Слишком большое задание и превышение числа заданий отклоняются"""
+        manager = JobManager(max_jobs=1, max_items=3)
+
+        with pytest.raises(ValueError):
+            manager.submit(["a", "b", "c", "d"])
+        manager.submit(["a"])
+        with pytest.raises(OverflowError):
+            manager.submit(["b"])
+        await manager.stop()
+        await service.stop()
@@ -0,0 +1,170 @@
+"""
+Тесты гистограмм времени ответа и сборщика метрик
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import random
+import subprocess
+import pytest
+from app.services.metrics import LatencyHistogram, WindowedHistogram, SecondSeries, MetricsCollector
+from app.monitoring.stages import add_stages, server_timing
+
+
+class TestHistogram:
+    """Тесты гистограммы с логарифмическими корзинами"""
+
+    def test_quantiles_within_relative_error(self):
+        """Перцентили совпадают с точными в пределах ошибки корзины"""
+        rng = random.Random(0)
+        values = [rng.lognormvariate(-4, 1) for _ in range(10000)]
+        histogram = LatencyHistogram()
+        for value in values:
+            histogram.record(value)
+
+        values.sort()
+        for q in (0.5, 0.9, 0.99):
+            exact = values[int(q * len(values)) - 1]
+            assert histogram.quantile(q) == pytest.approx(exact, rel=0.03)
+        assert histogram.mean == pytest.approx(sum(values) / len(values))
+        assert histogram.max == values[-1]
+
+    def test_empty_and_out_of_range(self):
+        """Пустая гистограмма даёт 0, значения вне диапазона корзин не теряются"""
+        histogram = LatencyHistogram()
+        assert histogram.quantile(0.5) == 0.0
+
+        histogram.record(0.0)
+        histogram.record(5000.0)
+        assert histogram.count == 2
+        assert histogram.quantile(0.0) == 0.0
+        assert histogram.quantile(1.0) == 5000.0
+
+
+class TestWindow:
+    """Тесты скользящего окна"""
+
+    def test_old_intervals_leave_window(self):
+        """Замеры старше окна не учитываются, интервал переиспользуется"""
+        window = WindowedHistogram(window=10.0, slots=5)
+        window.record(1.0, now=100.0)
+        window.record(2.0, now=105.0)
+
+        assert window.snapshot(now=109.9).count == 2
+        assert window.snapshot(now=110.5).count == 1
+
+        window.record(3.0, now=120.0)
+        snapshot = window.snapshot(now=120.0)
+        assert snapshot.count == 1
+        assert snapshot.max == 3.0
+
+
+class TestSeries:
+    """Тесты посекундного ряда"""
+
+    def test_history_by_second(self):
+        """Запросы, ошибки и корзины времени - по секундам, пустые секунды - нули"""
+        series = SecondSeries(size=60)
+        series.record(0.003, True, now=1000.2)
+        series.record(0.2, False, now=1000.7)
+        series.record(0.02, True, now=1002.5)
+
+        history = series.history(4, now=1002.9)
+
+        assert history["timestamps"] == [999, 1000, 1001, 1002]
+        assert history["requests"] == [0, 2, 0, 1]
+        assert history["errors"] == [0, 1, 0, 0]
+        assert history["latency_buckets"][1][0] == 1
+        assert history["latency_buckets"][1][5] == 1
+        assert 10 < history["p50_response_time"][3] <= 25
+
+    def test_ring_overwrites_old_seconds(self):
+        """Секунды старше размера буфера не учитываются"""
+        series = SecondSeries(size=10)
+        series.record(0.01, True, now=100.0)
+        series.record(0.01, True, now=110.0)
+
+        assert series.count(10, now=110.0) == 1
+        assert series.history(20, now=110.0)["requests"] == [0] * 9 + [1]
+
+
+class TestCollector:
+    """Тесты сборщика метрик"""
+
+    def test_percentiles_by_endpoint(self):
+        """Перцентили считаются отдельно по каждому endpoint"""
+        collector = MetricsCollector(window_seconds=60.0, window_slots=6)
+        for i in range(100):
+            collector.record_request("/api/predict", 0.001 * (i + 1), True)
+        collector.record_request("/api/predict/batch", 0.5, False, "HTTP 503")
+
+        metrics = collector.get_metrics()
+        predict = metrics["response_time_by_endpoint"]["/api/predict"]
+        assert predict["count"] == 100
+        assert predict["p50"] == pytest.approx(50, rel=0.03)
+        assert predict["p99"] == pytest.approx(99, rel=0.03)
+        assert metrics["response_time_by_endpoint"]["/api/predict/batch"]["max"] == pytest.approx(500)
+        assert metrics["total_requests"] == 101
+        assert metrics["error_types"] == {"HTTP 503": 1}
+
+        collector.reset_metrics()
+        assert collector.get_metrics()["response_time_by_endpoint"] == {}
+
+    def test_requests_per_second(self, monkeypatch):
+        """RPS - число запросов за последние rps_window секунд, а не по длительностям"""
+        collector = MetricsCollector(rps_window=10)
+        clock = {"now": 5000.0}
+        monkeypatch.setattr("app.services.metrics.time.time", lambda: clock["now"])
+        monkeypatch.setattr(collector, "_start_monotonic", collector._start_monotonic - 100)
+
+        for second in range(20):
+            clock["now"] = 5000.0 + second
+            for _ in range(3):
+                collector.record_request("/api/predict", 0.5, True)
+
+        clock["now"] = 5019.999
+        assert collector.get_metrics()["requests_per_second"] == pytest.approx(3.0, rel=0.01)
+
+
+class TestStages:
+    """Тесты разбивки времени по этапам"""
+
+    def test_server_timing_header(self):
+        """Этапы суммируются и выводятся в порядке конвейера, total - последним"""
+        stages = {}
+        add_stages(stages, {"forward": 0.004, "queue": 0.001})
+        add_stages(stages, {"forward": 0.002})
+        add_stages(None, {"forward": 1.0})
+
+        assert server_timing(stages, 0.0105) == "queue;dur=1.00, forward;dur=6.00, total;dur=10.50"
+
+
+class TestPrometheus:
+    """Тесты экспорта Prometheus"""
+
+    def run(self, code, multiproc_dir):
+        env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(multiproc_dir)}
+        root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        return subprocess.run([sys.executable, "-c", code], env=env, cwd=root, check=True,
+                              capture_output=True, text=True).stdout
+
+    def test_multiprocess_aggregation(self, tmp_path):
+        """В multiprocess mode экспозиция суммирует значения всех процессов"""
+        pytest.importorskip("prometheus_client")
+        record = (
+            "from app.monitoring.prometheus import prometheus_exporter as e\n"
+            "e.observe_request('/api/predict', 'POST', 200, 0.02)\n"
+            "e.count_cache('hit')\n"
+        )
+        self.run(record, tmp_path)
+        self.run(record, tmp_path)
+
+        output = self.run(
+            "from app.monitoring.prometheus import prometheus_exporter as e\n"
+            "print(e.render()[0].decode())",
+            tmp_path
+        )
+
+        assert 'ner_http_requests_total{endpoint="/api/predict",method="POST",status="200"} 2.0' in output
+        assert 'ner_cache_lookups_total{result="hit"} 2.0' in output
@@ -0,0 +1,258 @@
+"""
+Тесты декодирования предсказаний NER модели
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import time
+import pytest
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from types import SimpleNamespace
+from app.core.config import settings
+from app.models.ner_model import NERModelWrapper, EntityBatch
+
+
+@pytest.fixture(scope="module")
+def wrapper():
+    if not os.path.exists(os.path.join(settings.model_path, "config.json")):
+        pytest.skip("Нет весов модели")
+
+    model = NERModelWrapper()
+    if not asyncio.run(model.load_model()):
+        pytest.skip("Не удалось загрузить модель")
+
+    yield model
+    model.shutdown()
+
+
+def entity_words(text, entities):
+    return [text[e['start_index']:e['end_index']] for e in entities]
+
+
+class TestOffsets:
+    """Тесты позиций сущностей в исходном тексте"""
+
+    def test_repeated_whitespace_and_tabs(self, wrapper):
+        """Позиции верны при табуляциях и повторяющихся пробелах"""
+        text = "  сыр \t российский   45%\n"
+
+        entities = wrapper.predict_batch_sync([text])[0]
+
+        assert entity_words(text, entities) == ["сыр", "российский", "45%"]
+
+    def test_same_tags_for_any_whitespace(self, wrapper):
+        """Разделители между словами не влияют на теги"""
+        single, spaced = wrapper.predict_batch_sync(["сгущенное молоко 2.5%", "сгущенное\t\tмолоко   2.5%"])
+
+        assert [e['entity'] for e in single] == [e['entity'] for e in spaced]
+
+    def test_punctuation_inside_word(self, wrapper):
+        """Слово с пунктуацией - одна сущность, хотя токенизатор делит его на части"""
+        text = "молоко 2.5% 1л."
+
+        entities = wrapper.predict_batch_sync([text])[0]
+
+        assert entity_words(text, entities) == ["молоко", "2.5%", "1л."]
+
+    def test_long_text_fully_tagged(self, wrapper, monkeypatch):
+        """Текст длиннее max_len размечается целиком окнами с перекрытием"""
+        monkeypatch.setattr(settings, "sliding_window", True)
+        words = ["сгущенное", "молоко", "2.5%", "простоквашино"] * 100
+        text = " ".join(words)
+
+        entities = wrapper.predict_batch_sync([text, "хлеб"])
+
+        assert entity_words(text, entities[0]) == words
+        assert len(entities[1]) == 1
+
+    def test_truncation_mode(self, wrapper, monkeypatch):
+        """Без окон текст обрезается по max_len"""
+        monkeypatch.setattr(settings, "sliding_window", False)
+        text = " ".join(["сгущенное молоко"] * 200)
+
+        entities = wrapper.predict_batch_sync([text])[0]
+
+        assert 0 < len(entities) < 400
+
+
+class TestPadding:
+    """Тесты паддинга и группировки батча по длинам"""
+
+    TEXTS = [
+        " ".join(["сгущенное молоко 2.5%"] * 12),
+        "хлеб",
+        "молоко простоквашино 3.2% 930мл",
+        "",
+        " ".join(["сыр российский 45%"] * 5),
+        "кефир 1л",
+    ]
+
+    @pytest.mark.parametrize("padding_strategy", ["longest", "max_length"])
+    @pytest.mark.parametrize("length_buckets", [[8, 16, 32, 64], []])
+    def test_entities_same_for_any_padding(self, wrapper, monkeypatch, padding_strategy, length_buckets):
+        """Сущности батча не зависят от паддинга и корзин и совпадают с предсказанием по одному тексту"""
+        single = [wrapper.predict_batch_sync([text])[0] for text in self.TEXTS]
+        monkeypatch.setattr(settings, "padding_strategy", padding_strategy)
+        monkeypatch.setattr(settings, "length_buckets", length_buckets)
+
+        assert wrapper.predict_batch_sync(self.TEXTS) == single
+
+    def test_length_groups(self, monkeypatch):
+        """Строки делятся на корзины длин, каждая строка попадает ровно в одну группу"""
+        monkeypatch.setattr(settings, "length_buckets", [8, 16])
+        lengths = [20, 3, 9, 8, 16, 2, 30]
+
+        groups = NERModelWrapper()._length_groups(lengths)
+
+        assert groups == [[5, 1, 3], [2, 4], [0, 6]]
+        assert sorted(row for group in groups for row in group) == list(range(len(lengths)))
+
+    @pytest.mark.parametrize("padding_strategy", ["longest", "max_length"])
+    def test_run_model_restores_order(self, monkeypatch, padding_strategy):
+        """Логиты групп возвращаются на места исходных строк батча"""
+        monkeypatch.setattr(settings, "length_buckets", [2, 4])
+        monkeypatch.setattr(settings, "padding_strategy", padding_strategy)
+        lengths = [6, 1, 3, 2, 5]
+        width = max(lengths)
+        input_ids = np.zeros((len(lengths), width), dtype=np.int64)
+        attention_mask = np.zeros_like(input_ids)
+        for row, length in enumerate(lengths):
+            input_ids[row, :length] = np.arange(1, length + 1) + 10 * row
+            attention_mask[row, :length] = 1
+
+        widths = []
+
+        def forward(features):
+            # Логит - сам идентификатор токена: по нему видно, на чьё место попала строка
+            widths.append(features["input_ids"].shape[1])
+            return features["input_ids"].float().unsqueeze(-1)
+
+        wrapper = NERModelWrapper()
+        wrapper.tokenizer = SimpleNamespace(pad_token_id=0)
+        wrapper.device = "cpu"
+        wrapper.backend = SimpleNamespace(forward=forward)
+
+        logits = wrapper._run_model({"input_ids": input_ids, "attention_mask": attention_mask}, max_length=8)
+
+        assert np.array_equal(logits[..., 0], input_ids)
+        if padding_strategy == "longest":
+            assert sorted(widths) == [2, 3, 6]
+        else:
+            assert widths == [8, 8, 8]
+
+
+@pytest.mark.asyncio
+class TestInflight:
+    """Тесты пула потоков инференса и ограничения батчей в работе"""
+
+    @pytest.fixture
+    def blocking_wrapper(self, monkeypatch):
+        """Обёртка без весов: синхронный батч блокирует поток на 50 мс"""
+        monkeypatch.setattr(settings, "max_inflight_batches", 2)
+        wrapper = NERModelWrapper()
+        wrapper.model = wrapper.tokenizer = object()
+        wrapper._executor = ThreadPoolExecutor(max_workers=4)
+        wrapper.running = wrapper.max_running = 0
+        lock = threading.Lock()
+
+        def predict_batch_sync(texts, timings=None):
+            with lock:
+                wrapper.running += 1
+                wrapper.max_running = max(wrapper.max_running, wrapper.running)
+            time.sleep(0.05)
+            with lock:
+                wrapper.running -= 1
+            return [[] for _ in texts]
+
+        wrapper.predict_batch_sync = predict_batch_sync
+        yield wrapper
+        wrapper.shutdown()
+
+    async def test_inflight_limit(self, blocking_wrapper):
+        """Одновременных батчей в пуле не больше max_inflight_batches, хотя потоков больше"""
+        results = await asyncio.gather(*[blocking_wrapper.predict_batch([f"хлеб {i}"]) for i in range(6)])
+
+        assert results == [[[]]] * 6
+        assert blocking_wrapper.max_running == 2
+
+    async def test_event_loop_not_blocked(self, blocking_wrapper):
+        """Во время прохода модели event loop продолжает обрабатывать другие задачи"""
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(time.perf_counter())
+                await asyncio.sleep(0.005)
+
+        task = asyncio.create_task(ticker())
+        await asyncio.sleep(0)
+        await blocking_wrapper.predict_batch(["хлеб"])
+        task.cancel()
+
+        assert len(ticks) >= 5
+        assert max(b - a for a, b in zip(ticks, ticks[1:])) < 0.04
+
+
+class TestDecode:
+    """Тесты векторного декодирования тегов без модели"""
+
+    TAGS = ['O', 'B-BRAND', 'I-BRAND', 'B-TYPE', 'I-TYPE', 'I-VOLUME']
+
+    def decode(self, texts, offsets, preds):
+        wrapper = NERModelWrapper()
+        wrapper.tags = self.TAGS
+        tables = wrapper._get_tag_tables()
+        text_base = np.concatenate(([0], np.cumsum([len(text) for text in texts])))
+        logits = np.eye(len(self.TAGS), dtype=np.float32)[np.array(preds)]
+        tokens = wrapper._merge_windows(text_base, np.array(offsets), np.arange(len(texts)), logits)
+        rows, starts, ends, tag_ids = wrapper._decode(texts, text_base, *tokens, tables)
+        names = [tables["names"][tag_id] for tag_id in tag_ids]
+        return list(zip(rows.tolist(), starts.tolist(), ends.tolist(), names))
+
+    def test_subtokens_merged_into_word(self):
+        """Сабтокены одного слова дают одну сущность с тегом первого сабтокена"""
+        texts = ["простоквашино 1л"]
+        offsets = [[(0, 0), (0, 6), (6, 13), (14, 15), (15, 16), (0, 0)]]
+        preds = [[0, 1, 3, 3, 0, 0]]
+
+        assert self.decode(texts, offsets, preds) == [(0, 0, 13, 'B-BRAND'), (0, 14, 16, 'B-TYPE')]
+
+    def test_bio_repair(self):
+        """I- тег без предшествующего слова того же типа становится B-, в том числе в начале строки"""
+        texts = ["a b c", "d e"]
+        offsets = [[(0, 0), (0, 1), (2, 3), (4, 5)], [(0, 0), (0, 1), (2, 3), (0, 0)]]
+        preds = [[0, 2, 2, 4], [0, 2, 5, 0]]
+
+        assert self.decode(texts, offsets, preds) == [
+            (0, 0, 1, 'B-BRAND'), (0, 2, 3, 'I-BRAND'), (0, 4, 5, 'B-TYPE'),
+            (1, 0, 1, 'B-BRAND'), (1, 2, 3, 'B-VOLUME')
+        ]
+
+    def test_entity_batch_serialization(self):
+        """EntityBatch переводится в формат API, пустые тексты получают пустой список"""
+        batch = EntityBatch(np.array([0, 0, 2]), np.array([0, 5]), np.array([4, 8]), np.array([1, 3]), self.TAGS)
+
+        assert batch.to_lists() == [[], [
+            {'start_index': 0, 'end_index': 4, 'entity': 'B-BRAND'},
+            {'start_index': 5, 'end_index': 8, 'entity': 'B-TYPE'}
+        ]]
+
+    def test_overlapping_windows_merged(self):
+        """Токены перекрытия окон встречаются в результате один раз, логиты складываются"""
+        texts = ["a b c d"]
+        offsets = np.array([[(0, 0), (0, 1), (2, 3), (4, 5)], [(0, 0), (2, 3), (4, 5), (6, 7)]])
+        logits = np.zeros((2, 4, len(self.TAGS)), dtype=np.float32)
+        logits[0, 1:, 3] = 1.0
+        # Токен "b": первое окно за B-TYPE, второе сильнее за B-BRAND
+        logits[1, 1, 1] = 3.0
+        logits[1, 2:, 3] = 1.0
+
+        rows, starts, ends, preds = NERModelWrapper._merge_windows(np.array([0, 7]), offsets, np.array([0, 0]), logits)
+
+        assert starts.tolist() == [0, 2, 4, 6]
+        assert rows.tolist() == [0, 0, 0, 0]
+        assert preds.tolist() == [3, 1, 3, 3]
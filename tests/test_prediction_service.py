@@ -0,0 +1,175 @@
+"""
+Тесты сервиса предсказаний
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+import asyncio
+from app.services.prediction import PredictionService
+
+
+@pytest.mark.asyncio
+class TestBatching:
+    """Тесты объединения запросов в батчи"""
+
+    async def test_concurrent_requests_share_batch(self, stub_model):
+        """Параллельные запросы уходят в модель одним батчем"""
+        service = PredictionService(batch_size=32, max_wait_time=0.05)
+        texts = [f"молоко {i}" for i in range(10)]
+
+        results = await asyncio.gather(*(service.predict(text) for text in texts))
+        await service.stop()
+
+        assert len(stub_model.batches) == 1
+        assert sorted(stub_model.batches[0]) == sorted(texts)
+        for text, entities in zip(texts, results):
+            assert entities[1]['end_index'] == len(text)
+
+    async def test_batch_flushed_by_size(self, stub_model):
+        """Батч отправляется при достижении batch_size, не дожидаясь таймаута"""
+        service = PredictionService(batch_size=4, max_wait_time=10.0)
+        texts = [f"хлеб {i}" for i in range(8)]
+
+        results = await asyncio.wait_for(
+            asyncio.gather(*(service.predict(text) for text in texts)),
+            timeout=1.0
+        )
+        await service.stop()
+
+        assert [len(batch) for batch in stub_model.batches] == [4, 4]
+        assert len(results) == 8
+
+    async def test_batch_error_propagates_to_callers(self, stub_model):
+        """Ошибка модели возвращается каждому запросу батча"""
+        async def failing_predict_batch(texts, timings=None):
+            raise RuntimeError("Модель не загружена")
+
+        stub_model.predict_batch = failing_predict_batch
+        service = PredictionService(batch_size=4, max_wait_time=0.01)
+
+        with pytest.raises(RuntimeError):
+            await service.predict("молоко")
+        await service.stop()
+
+
+@pytest.mark.asyncio
+class TestBatchPredict:
+    """Тесты батчевого предсказания"""
+
+    async def test_batch_predict_uses_few_forward_passes(self, stub_model):
+        """500 текстов обрабатываются несколькими вызовами predict_batch"""
+        service = PredictionService(batch_size=32, bulk_batch_size=128)
+        texts = [f"сгущенное молоко {i}" for i in range(500)]
+
+        results = await service.batch_predict(texts)
+
+        assert len(stub_model.batches) == 4
+        assert len(results) == 500
+        assert all(len(entities) == 3 for entities in results)
+
+    async def test_batch_predict_skips_empty_and_cached(self, stub_model):
+        """Пустые и закешированные тексты не отправляются в модель"""
+        service = PredictionService(batch_size=32)
+        await service.batch_predict(["молоко"])
+
+        results = await service.batch_predict(["молоко", "", "хлеб"])
+
+        assert stub_model.batches == [["молоко"], ["хлеб"]]
+        assert results[1] == []
+        assert results[2][0]['entity'] == 'B-TYPE'
+
+
+@pytest.mark.asyncio
+class TestDeduplication:
+    """Тесты объединения одинаковых выполняющихся запросов"""
+
+    async def test_concurrent_identical_requests_share_prediction(self, stub_model):
+        """Одинаковые параллельные запросы считаются моделью один раз"""
+        service = PredictionService(batch_size=32, max_wait_time=0.05)
+
+        results = await asyncio.gather(*(service.predict("сгущенное молоко") for _ in range(20)))
+        await service.stop()
+
+        assert stub_model.batches == [["сгущенное молоко"]]
+        assert all(entities == results[0] for entities in results)
+        assert service.get_cache_stats()["deduplicated_requests"] == 19
+
+    async def test_batch_duplicates_predicted_once(self, stub_model):
+        """Повторы внутри батча и варианты с лишними пробелами отправляются в модель один раз"""
+        service = PredictionService(batch_size=32)
+
+        results = await service.batch_predict(["молоко", "хлеб", "молоко", " молоко"])
+
+        assert stub_model.batches == [["молоко", "хлеб"]]
+        assert results[0] == results[2]
+        assert results[3][0]['start_index'] == 1
+
+    async def test_batch_joins_inflight_interactive_request(self, stub_model):
+        """Батч ждёт результат уже поставленного в очередь одиночного запроса"""
+        service = PredictionService(batch_size=32, max_wait_time=0.05)
+
+        single, batch = await asyncio.gather(
+            service.predict("кефир"),
+            service.batch_predict(["кефир", "сыр"])
+        )
+        await service.stop()
+
+        assert sorted(sum(stub_model.batches, [])) == ["кефир", "сыр"]
+        assert batch[0] == single
+
+
+async def numbered(texts):
+    """Асинхронный поток пар (номер, текст)"""
+    for i, text in enumerate(texts):
+        yield i, text
+
+
+@pytest.mark.asyncio
+class TestStreamPredict:
+    """Тесты потокового предсказания"""
+
+    async def test_results_in_input_order(self, stub_model):
+        """Результаты идут в порядке входа, пары без текста проходят без предсказания"""
+        service = PredictionService(bulk_batch_size=4)
+        texts = [f"молоко {i}" for i in range(10)] + [None, "хлеб"]
+
+        chunks = [chunk async for chunk in service.stream_predict(numbered(texts))]
+
+        assert [len(chunk) for chunk in chunks] == [4, 4, 4]
+        pairs = [pair for chunk in chunks for pair in chunk]
+        assert [meta for meta, _ in pairs] == list(range(12))
+        assert pairs[10][1] is None
+        assert pairs[3][1][1]['end_index'] == len("молоко 3")
+
+    async def test_slow_consumer_stops_reading(self, stub_model):
+        """Пока потребитель не забирает результаты, вход читается не дальше max_pending_chunks частей"""
+        service = PredictionService(bulk_batch_size=2)
+        consumed = 0
+
+        async def source():
+            nonlocal consumed
+            for i in range(1000):
+                consumed += 1
+                yield i, f"кефир {i}"
+
+        stream = service.stream_predict(source(), max_pending_chunks=2)
+        await stream.__anext__()
+        await asyncio.sleep(0.05)
+
+        # Отданная часть, ожидающий результата потребитель и полная очередь
+        assert consumed <= 2 * 4
+        await stream.aclose()
+
+    async def test_input_error_propagates(self, stub_model):
+        """Ошибка чтения входа завершает поток исключением"""
+        service = PredictionService(bulk_batch_size=2)
+
+        async def broken():
+            yield 0, "сыр"
+            raise ValueError("Обрыв соединения")
+
+        with pytest.raises(ValueError):
+            async for _ in service.stream_predict(broken()):
+                pass
@@ -0,0 +1,77 @@
+"""
+Тесты профилирования по запросу
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import io
+import json
+import marshal
+import asyncio
+import zipfile
+import pytest
+import torch
+from app.monitoring.profiler import Profiler, ProfilerBusy, profiled
+
+
+def work(n):
+    """Батч-заглушка с операциями torch"""
+    x = torch.ones(n, n)
+    return float((x @ x).sum())
+
+
+@pytest.fixture(scope="module", autouse=True)
+def torch_profiler_ready():
+    """Первый запуск torch.profiler в процессе долгий - прогреваем до коротких захватов"""
+    profiled(work, 2, torch_trace=True)
+
+
+@pytest.mark.asyncio
+class TestProfiler:
+    """Тесты захвата профиля"""
+
+    async def test_capture_archive(self):
+        """Батчи во время захвата попадают в cProfile, trace torch - не больше max_traces"""
+        profiler = Profiler(max_traces=2)
+        assert profiler.run(work, 4) == 64.0
+
+        capture = asyncio.ensure_future(profiler.capture(0.3))
+        await asyncio.sleep(0.05)
+        with pytest.raises(ProfilerBusy):
+            await profiler.capture(0.1)
+        loop = asyncio.get_running_loop()
+        for _ in range(3):
+            assert await loop.run_in_executor(None, profiler.run, work, 8) == 512.0
+        archive = zipfile.ZipFile(io.BytesIO(await capture))
+
+        assert profiler.active is None
+        names = archive.namelist()
+        assert [name for name in names if name.startswith("torch/")] == ["torch/batch_001.json", "torch/batch_002.json"]
+        info = json.loads(archive.read("info.json"))
+        assert info["batches"] == 3
+        assert info["torch_traces"] == 2
+        stats = marshal.loads(archive.read("python.prof"))
+        assert sum(calls for (_, _, function), (_, calls, *_) in stats.items() if function == "work") == 3
+        assert "aten::mm" in archive.read("torch_ops.txt").decode()
+
+    async def test_failed_batch_releases_trace(self):
+        """Батч с ошибкой не занимает trace torch до конца захвата"""
+        profiler = Profiler(max_traces=2)
+        capture = asyncio.ensure_future(profiler.capture(0.1))
+        await asyncio.sleep(0.01)
+        with pytest.raises(ZeroDivisionError):
+            profiler.run(lambda: 1 / 0)
+        profiler.run(work, 2)
+        archive = zipfile.ZipFile(io.BytesIO(await capture))
+
+        assert json.loads(archive.read("info.json"))["torch_traces"] == 1
+
+
+def test_profiled_without_trace():
+    """Профиль батча без torch.profiler - только статистика cProfile"""
+    result, profile = profiled(work, 2)
+
+    assert result == 8.0
+    assert profile["trace"] is None
+    assert any(function == "work" for (_, _, function) in profile["stats"])
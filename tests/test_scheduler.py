@@ -0,0 +1,274 @@
+"""
+Тесты планировщика инференса с классами приоритета
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import time
+import pytest
+import asyncio
+from app.services.metrics import metrics_collector
+from app.monitoring.stages import request_stages, batch_stages
+from app.services import prediction
+from app.services.prediction import PredictionService
+from conftest import StubModel
+from app.services.scheduler import (
+    InferenceScheduler, PriorityClass, OverloadedError, DeadlineExceeded, INTERACTIVE, BULK, BACKGROUND
+)
+
+
+def make_scheduler(model, weights=None, max_inflight=1, reserved_slots=0, max_batch=4, max_queue_time=None):
+    weights = weights or {INTERACTIVE: 8.0, BULK: 2.0, BACKGROUND: 1.0}
+    return InferenceScheduler(
+        [PriorityClass(INTERACTIVE, weights[INTERACTIVE], max_batch, 0.001, max_queue_time),
+         PriorityClass(BULK, weights[BULK], max_batch, max_queue_time=max_queue_time),
+         PriorityClass(BACKGROUND, weights[BACKGROUND], max_batch)],
+        execute=model.predict_batch,
+        max_inflight=lambda: max_inflight,
+        reserved_slots=reserved_slots
+    )
+
+
+@pytest.mark.asyncio
+class TestScheduler:
+    """Тесты порядка и разделения слотов модели"""
+
+    async def test_interactive_interleaved_with_bulk(self, monkeypatch):
+        """Одиночный запрос проходит между частями большого батча, а не после него"""
+        model = StubModel(delay=0.01)
+        monkeypatch.setattr(prediction, "ner_model", model)
+        service = PredictionService(batch_size=8, max_wait_time=0.001, max_inflight_batches=1,
+                                    bulk_chunk_size=4, reserved_slots=0)
+
+        bulk = asyncio.ensure_future(service.batch_predict([f"молоко {i}" for i in range(40)]))
+        await asyncio.sleep(0.015)
+        single = await service.predict("кефир")
+        await bulk
+        await service.stop()
+
+        position = model.batches.index(["кефир"])
+        assert single[0]['end_index'] == len("кефир")
+        assert position <= 3
+        assert len(model.batches) == 11
+
+    async def test_idle_model_dispatches_immediately(self):
+        """Без батчей в модели часть уходит сразу; пока модель занята, части копятся в батч"""
+        model = StubModel(delay=0.05)
+        scheduler = InferenceScheduler(
+            [PriorityClass(INTERACTIVE, 8.0, 4, max_wait=0.5)],
+            execute=model.predict_batch,
+            max_inflight=lambda: 2,
+            reserved_slots=0
+        )
+
+        start = time.monotonic()
+        await scheduler.submit(["кефир"], INTERACTIVE)
+        assert time.monotonic() - start < 0.25
+
+        busy = scheduler.submit(["молоко"], INTERACTIVE)
+        await asyncio.sleep(0.01)
+        parts = [scheduler.submit([text], INTERACTIVE) for text in ("сыр", "хлеб")]
+        await asyncio.gather(busy, *parts)
+        await scheduler.stop()
+
+        assert model.batches == [["кефир"], ["молоко"], ["сыр", "хлеб"]]
+
+    async def test_weighted_sharing(self):
+        """Загруженные классы получают слоты пропорционально весам"""
+        model = StubModel(delay=0.001)
+        scheduler = make_scheduler(model)
+
+        bulk = [scheduler.submit([f"b{i}"] * 4, BULK) for i in range(12)]
+        background = [scheduler.submit([f"f{i}"] * 4, BACKGROUND) for i in range(12)]
+        await asyncio.gather(*bulk, *background)
+        await scheduler.stop()
+
+        first = [batch[0][0] for batch in model.batches[:9]]
+        assert first.count("b") == 6
+        assert first.count("f") == 3
+
+    async def test_reserved_slots(self):
+        """Батчи не занимают слоты, зарезервированные за интерактивными запросами"""
+        model = StubModel(delay=0.2)
+        scheduler = make_scheduler(model, max_inflight=2, reserved_slots=1)
+
+        bulk = [scheduler.submit(["молоко"] * 4, BULK) for _ in range(4)]
+        await asyncio.sleep(0.005)
+        single = scheduler.submit(["кефир"], INTERACTIVE)
+        for _ in range(20):
+            if len(model.batches) > 1:
+                break
+            await asyncio.sleep(0.002)
+
+        # Интерактивный запрос выполняется параллельно с частью батча, не дожидаясь её
+        assert model.running == 2
+        assert model.batches[1] == ["кефир"]
+        await asyncio.gather(single, *bulk)
+        await scheduler.stop()
+
+    async def test_error_reaches_every_part(self):
+        """Ошибка модели возвращается каждой части батча"""
+        async def failing(texts):
+            raise RuntimeError("Модель не загружена")
+
+        scheduler = InferenceScheduler([PriorityClass(INTERACTIVE, 1.0, 8, 0.01)], failing, lambda: 1)
+
+        parts = [scheduler.submit([f"сыр {i}"], INTERACTIVE) for i in range(3)]
+        outcomes = await asyncio.gather(*parts, return_exceptions=True)
+        await scheduler.stop()
+
+        assert all(isinstance(outcome, RuntimeError) for outcome in outcomes)
+
+    async def test_queue_time_recorded_per_class(self):
+        """Время ожидания в очереди пишется в метрики по классам"""
+        metrics_collector.reset_metrics()
+        model = StubModel(delay=0.001)
+        scheduler = make_scheduler(model)
+
+        await asyncio.gather(scheduler.submit(["хлеб"], INTERACTIVE), scheduler.submit(["сыр"] * 4, BULK))
+        await scheduler.stop()
+
+        queue_metrics = metrics_collector.get_queue_metrics()
+        assert queue_metrics[INTERACTIVE]["count"] == 1
+        assert queue_metrics[BULK]["count"] == 1
+
+
+def set_cost(scheduler, samples):
+    """Модель стоимости по замерам (размер батча, время) с равными весами"""
+    n = len(samples)
+    scheduler._cost_moments = [
+        sum(size for size, _ in samples) / n,
+        sum(elapsed for _, elapsed in samples) / n,
+        sum(size * size for size, _ in samples) / n,
+        sum(size * elapsed for size, elapsed in samples) / n
+    ]
+
+
+class TestCostModel:
+    """Тесты оценки стоимости батча модели"""
+
+    def test_cost_model(self):
+        """Накладные расходы и время на текст восстанавливаются по батчам разного размера"""
+        scheduler = make_scheduler(StubModel(delay=0.01))
+        set_cost(scheduler, [(1, 0.011), (32, 0.042)])
+
+        overhead, per_text = scheduler.cost_model()
+
+        assert overhead == pytest.approx(0.01)
+        assert per_text == pytest.approx(0.001)
+        assert scheduler.throughput == pytest.approx(4 / 0.014)
+
+    def test_small_batches_do_not_understate_throughput(self):
+        """Одинаковые малые батчи (слабая нагрузка) считаются накладными расходами, а не ценой текста"""
+        scheduler = make_scheduler(StubModel(delay=0.01))
+        set_cost(scheduler, [(1, 0.02)] * 10)
+
+        assert scheduler.cost_model() == pytest.approx((0.02, 0.0))
+
+
+@pytest.mark.asyncio
+class TestAdmission:
+    """Тесты контроля допуска и дедлайнов"""
+
+    async def test_deadline_rejected_early(self):
+        """Запрос, который не уложится в дедлайн, отклоняется до постановки в очередь"""
+        model = StubModel(delay=0.01)
+        scheduler = make_scheduler(model)
+        set_cost(scheduler, [(1, 0.011), (4, 0.014)])
+        parts = [scheduler.submit(["молоко"] * 4, INTERACTIVE) for _ in range(10)]
+
+        with pytest.raises(DeadlineExceeded) as error:
+            scheduler.admit(1, INTERACTIVE, deadline=time.monotonic() + 0.05)
+        scheduler.admit(1, INTERACTIVE, deadline=time.monotonic() + 1.0)
+        assert error.value.retry_after >= 1
+
+        await asyncio.gather(*parts)
+        await scheduler.stop()
+
+    async def test_overload_by_queue_time(self):
+        """Без дедлайна класс отклоняется, когда ожидание в очереди больше max_queue_time"""
+        scheduler = make_scheduler(StubModel(delay=0.01), max_queue_time=0.1)
+        set_cost(scheduler, [(1, 0.011), (4, 0.014)])
+        parts = [scheduler.submit(["хлеб"] * 4, BULK) for _ in range(10)]
+
+        with pytest.raises(OverloadedError):
+            scheduler.admit(4, BULK)
+        # Интерактивный класс не ждёт батчей: их очередь не входит в его ожидание
+        scheduler.admit(1, INTERACTIVE)
+
+        await asyncio.gather(*parts)
+        await scheduler.stop()
+
+    async def test_expired_dropped_at_batch_formation(self):
+        """Часть с истёкшим дедлайном снимается с очереди без прохода модели"""
+        model = StubModel(delay=0.05)
+        scheduler = make_scheduler(model, max_batch=1)
+
+        first = scheduler.submit(["кефир"], BULK)
+        expired = scheduler.submit(["сыр"], BULK, deadline=time.monotonic() + 0.01)
+        outcomes = await asyncio.gather(first, expired, return_exceptions=True)
+        await scheduler.stop()
+
+        assert isinstance(outcomes[1], DeadlineExceeded)
+        assert model.batches == [["кефир"]]
+
+    async def test_rejected_batch_releases_keys(self, monkeypatch):
+        """Отклонённый батч возвращает OverloadedError и не блокирует те же тексты позже"""
+        model = StubModel(delay=0.001)
+        monkeypatch.setattr(prediction, "ner_model", model)
+        service = PredictionService(bulk_chunk_size=4, max_queue_time=0.1)
+
+        await service.batch_predict(["молоко"])
+        set_cost(service.scheduler, [(1, 0.011), (4, 0.014)])
+        with pytest.raises(OverloadedError):
+            await service.batch_predict(["кефир"], deadline=time.monotonic() + 0.001)
+
+        results = await service.batch_predict(["кефир"])
+        await service.stop()
+        assert results[0][0]['end_index'] == len("кефир")
+
+    async def test_expired_deadline_fails_only_its_caller(self, monkeypatch):
+        """Истёкший дедлайн общего ключа не завершает ошибкой запросы без дедлайна"""
+        model = StubModel(delay=0.1)
+        monkeypatch.setattr(prediction, "ner_model", model)
+        service = PredictionService(batch_size=8, max_wait_time=0.001, max_inflight_batches=1,
+                                    bulk_chunk_size=4, reserved_slots=0)
+
+        busy = asyncio.ensure_future(service.predict("молоко"))
+        while not model.running:
+            await asyncio.sleep(0.001)
+        deadlined = asyncio.ensure_future(service.predict("кефир", deadline=time.monotonic() + 0.03))
+        await asyncio.sleep(0)
+        shared = asyncio.ensure_future(service.predict("кефир"))
+        batch = asyncio.ensure_future(service.batch_predict(["кефир", "сыр"]))
+        outcomes = await asyncio.gather(deadlined, shared, batch, busy, return_exceptions=True)
+        await service.stop()
+
+        assert isinstance(outcomes[0], DeadlineExceeded)
+        assert outcomes[1][0]['end_index'] == len("кефир")
+        assert [entities[0]['end_index'] for entities in outcomes[2]] == [len("кефир"), len("сыр")]
+        assert model.batches.count(["кефир"]) == 1
+
+    async def test_stage_timings_reach_request(self):
+        """Этапы батча и ожидание в очереди попадают в разбивку каждой части запроса"""
+        class TimedModel(StubModel):
+            async def predict_batch(self, texts, timings=None):
+                batch_stages.get().update({"tokenize": 0.001, "forward": 0.002, "decode": 0.0005})
+                return await super().predict_batch(texts)
+
+        scheduler = make_scheduler(TimedModel(delay=0.001), max_batch=2)
+        stages = {}
+        token = request_stages.set(stages)
+        try:
+            parts = [scheduler.submit(["кефир", "сыр"], BULK), scheduler.submit(["молоко"], BULK)]
+        finally:
+            request_stages.reset(token)
+        await asyncio.gather(*parts)
+        untimed = await scheduler.submit(["хлеб"], BULK)
+        await scheduler.stop()
+
+        assert stages["forward"] == pytest.approx(0.004)
+        assert stages["decode"] == pytest.approx(0.001)
+        assert stages["queue"] >= 0
+        assert untimed[0][0]['end_index'] == len("хлеб")
@@ -0,0 +1,106 @@
+"""
+Тесты пула процессов инференса
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import time
+import signal
+import pytest
+import asyncio
+from app.core.config import settings
+from app.models.ner_model import NERModelWrapper
+from app.services import prediction
+from app.services.prediction import PredictionService
+from app.services.worker_pool import InferenceWorkerPool
+
+
+@pytest.fixture(scope="module")
+def wrapper():
+    if not os.path.exists(os.path.join(settings.model_path, "config.json")):
+        pytest.skip("Нет весов модели")
+
+    model = NERModelWrapper()
+    if not asyncio.run(model.load_model()) or str(model.device) != "cpu":
+        pytest.skip("Нет модели на CPU")
+
+    yield model
+    model.shutdown()
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(**kwargs):
+        pool = InferenceWorkerPool(num_processes=1, monitor_interval=0.1, **kwargs)
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.stop()
+
+
+async def wait_until(condition, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Условие не выполнено за отведённое время"
+        await asyncio.sleep(0.02)
+
+
+@pytest.mark.asyncio
+class TestWorkerPool:
+    """Тесты маршрутизации батчей и падения процессов инференса"""
+
+    async def test_predict_batch(self, wrapper, make_pool):
+        """Процесс инференса возвращает те же сущности, что и модель в процессе API"""
+        pool = make_pool()
+        pool.start(wrapper)
+        await wait_until(pool.is_ready)
+        texts = ["молоко простоквашино 2.5%", "", "хлеб"]
+
+        assert await pool.predict_batch(texts) == wrapper.predict_batch_sync(texts)
+        assert pool.queue_depths == [0]
+
+    async def test_dead_worker_fails_pending_and_respawns(self, wrapper, make_pool):
+        """Батч упавшего процесса сразу завершается ошибкой, процесс перезапускается"""
+        pool = make_pool()
+        pool.start(wrapper)
+        await wait_until(pool.is_ready)
+        process = pool._processes[0]
+
+        # Остановленный процесс не успевает ответить на батч до своего завершения
+        os.kill(process.pid, signal.SIGSTOP)
+        pending = asyncio.create_task(pool.predict_batch(["кефир"]))
+        await asyncio.sleep(0.05)
+        started = time.monotonic()
+        os.kill(process.pid, signal.SIGKILL)
+
+        with pytest.raises(RuntimeError, match="завершился"):
+            await pending
+        assert time.monotonic() - started < 5.0
+        assert not pool.is_ready()
+        assert pool.queue_depths == [0]
+
+        await wait_until(pool.is_ready)
+        assert pool._processes[0] is not process
+        assert await pool.predict_batch(["кефир"]) == wrapper.predict_batch_sync(["кефир"])
+
+    async def test_runner_falls_back_without_workers(self, wrapper, make_pool, monkeypatch):
+        """Без живых процессов сервис предсказаний работает с моделью в процессе API"""
+        pool = make_pool(max_restarts=0)
+        monkeypatch.setattr(prediction, "worker_pool", pool)
+        service = PredictionService()
+        pool.start(wrapper)
+        await wait_until(pool.is_ready)
+        assert service._runner() is pool
+
+        process = pool._processes[0]
+        process.kill()
+        await wait_until(lambda: not pool.is_ready(), timeout=5.0)
+
+        assert service._runner() is prediction.ner_model
+        await asyncio.sleep(0.3)
+        assert pool._processes[0] is process